@@ -3,78 +3,140 @@ Main does:
     - Reads in anvil.yaml and generates same in openapi.yaml format
     - Reads in (anvil or openapi) yaml and generate a file of pydantic models.
     - Reads in (anvil or openapi) yaml and generate a pydal definition of the database schema."""
-from y2s_reorder import reorder_openapi_yaml, reorder_tables
-from y2s_to_openapi import convert_anvil_to_openapi_yaml
-from y2s_to_pydal import openapi_to_pydal
-from y2s_constants import OPENAPI_TYPES, OPENAPI_FORMATS, Openapi_preamble
-from y2s_file_io import build_path, readfile
-from y2s_schema import openapi_schema, openapi_preamble_schema, anvil_yaml_schema
-from y2s_modify import update_field_type, snip_out
-import strictyaml as sy
+import argparse
+import time
+from typing import Iterable
 
-CLASS_MODELS = True
-try:
-    import datamodel_code_generator as dcg
-except ImportError:
-    print("Not generating class models.")
-    CLASS_MODELS = False
+from y2s_cache import DEFAULT_CACHE_BYTES
+from y2s_constants import OPENAPI_TYPES, OPENAPI_FORMATS, MIGRATION_FILE, DEFAULT_ADDRESS
+from y2s_file_io import write_if_changed
+from y2s_load import LOADERS
+from y2s_pipeline import generate, OUTPUT_FILES, DEFAULT_EMIT, NoTablesError
+from y2s_profile import Profiler, NO_PROFILER
+from y2s_to_classes import CLASS_STYLES
+from y2s_to_pydal import PydalOptions, DEFAULT_OPTIONS, DIALECTS, MIGRATE_MODES
 
 
-def main():
+def main(loader: str = 'strict', use_cache: bool = True, cache_size: int = DEFAULT_CACHE_BYTES,
+         emit: Iterable[str] = DEFAULT_EMIT, profiler: Profiler = NO_PROFILER,
+         pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass', concurrent: bool = True):
     input_dir = "tests/yaml/in/"
     output_dir = "tests/yaml/out/"
-    input_yaml = input_dir + "anvil.yaml"
-    input_refined = input_dir + "anvil_refined.yaml"
-    try:
-        # if there is anvil.yaml, converts to openapi.yaml
-        anvil_yaml, newline_list = readfile(input_yaml, "")
-        db_str = snip_out(anvil_yaml, 'db_schema')
-        if '{}' in db_str and len(db_str)<20:
-            print("!!!!!!!!!!!No database tables in anvil.yaml!!!!!!!!!!!")
-            db_str = readfile(input_dir+"user.yaml","")
-            if len(db_str)<20:
-                print("Exiting...")
-                exit(0)
-        parsed_yaml = sy.dirty_load(yaml_string=db_str, schema=anvil_yaml_schema(), allow_flow_style=True)
-        # convert to OPENAPI strict YAML
-        open_api_yaml = convert_anvil_to_openapi_yaml(parsed_yaml)
-        # is there more to add in anvil_refined.yaml?
+    with profiler.span('main'):
         try:
-            anvil_yaml_refined, newline_list = readfile(input_refined, "")
-            db_str = anvil_yaml_refined[anvil_yaml_refined.find('components'):]
-            refined_yaml = sy.dirty_load(yaml_string=db_str, schema=openapi_schema(), allow_flow_style=False)
-            update_field_type(open_api_yaml, refined_yaml)
-        except FileNotFoundError:
-            pass
-    except FileNotFoundError:
-        # if no anvil.yaml, read in the openapi.yaml
-        input_yaml = input_dir + "openapi.yaml"
-        open_yaml, newline_list = readfile(input_yaml, "")
-        db_str = open_yaml[open_yaml.find('components'):]
-        open_api_yaml = sy.dirty_load(yaml_string=db_str, schema=openapi_schema(), allow_flow_style=False)
-
-    # reorder so that no table is referenced before it is defined
-    ordered_openapi_yaml = reorder_openapi_yaml(open_api_yaml,
-                                                reorder_tables(open_api_yaml))
-    # write the openapi yaml to a file
-    preamble_yaml = sy.load(yaml_string=Openapi_preamble, schema=openapi_preamble_schema())
-    with open(output_dir + "anvil_openapi.yaml", "w") as f_out:
-        f_out.write(preamble_yaml.as_yaml())
-        f_out.write(ordered_openapi_yaml.as_yaml())
-    if CLASS_MODELS:
-        dcg.generate(
-            open_api_yaml.as_yaml(),  # do not need ordered yaml here as dcg will also order it.
-            input_file_type=dcg.InputFileType.OpenAPI,
-            input_filename=input_dir+"anvil.yaml",
-            output=build_path(output_dir+"db_models.py", "."))
-    # generate the pyDAL schema definitions
-    pydal_def = openapi_to_pydal(ordered_openapi_yaml)
-    with open(output_dir + "pydal_def.py", "w") as f_out:
-        f_out.write('\n'.join(pydal_def))
-    return True
+            return generate(input_dir, output_dir, loader=loader, use_cache=use_cache, cache_size=cache_size,
+                            emit=emit, profiler=profiler, pydal_options=pydal_options,
+                            class_style=class_style, concurrent=concurrent)
+        except NoTablesError:
+            print("Exiting...")
+            exit(0)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generates openapi, pyDAL and class definitions of a database schema.")
+    parser.add_argument('--loader', choices=LOADERS, default='strict',
+                        help="yaml loader: `strict` validates everything with strictyaml, "
+                             "`fast` uses PyYAML and checks only what is used.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Generate everything again instead of reusing the outputs of unchanged tables.")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="Size limit of the cache directory in MB.")
+    parser.add_argument('--emit', default=','.join(DEFAULT_EMIT),
+                        help="Comma separated outputs to generate, from: " + ', '.join(OUTPUT_FILES) +
+                             " (default: " + ','.join(DEFAULT_EMIT) + ").")
+    parser.add_argument('--dialect', choices=DIALECTS, default='sqlite',
+                        help="Database of the pyDAL definition. `postgres` stores json as jsonb and lists as "
+                             "native arrays, with GIN indexes.")
+    parser.add_argument('--no-reference-indexes', action='store_true',
+                        help="Only create the indexes declared in `x-indexes`, not one for every reference column.")
+    parser.add_argument('--junction-tables', action='store_true',
+                        help="Define a junction table for each link_multiple column "
+                             "instead of a list:reference column.")
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help="Number of database connections pyDAL keeps open (default 0: none).")
+    parser.add_argument('--lazy-tables', action='store_true',
+                        help="pyDAL defines each table only when it is first used.")
+    parser.add_argument('--migrate', choices=MIGRATE_MODES, default='on',
+                        help="`off` for databases whose tables already exist, `fake` to only rebuild pyDAL's "
+                             ".table files. Unless `on`, indexes are created by running pydal_def.py.")
+    parser.add_argument('--sqlite-pragmas', action='store_true',
+                        help="Set WAL journal, synchronous=NORMAL, mmap_size and cache_size on every sqlite "
+                             "connection.")
+    parser.add_argument('--split-tables', action='store_true',
+                        help="Write the pyDAL definition as a package pydal_def/ with one module per table, "
+                             "each imported and defined the first time it is used.")
+    parser.add_argument('--class-style', choices=CLASS_STYLES, default='dataclass',
+                        help="Classes of db_classes.py (--emit classes): dataclasses with __slots__ or msgspec "
+                             "Structs.")
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help="Compare two versions of the schema (app directories, anvil.yaml or openapi.yaml files) "
+                             "and write the SQL migrating a database of OLD to NEW into " + MIGRATION_FILE +
+                             ", for --dialect.")
+    parser.add_argument('--serial', action='store_true',
+                        help="Generate the outputs one after the other in this process, instead of at the same time "
+                             "with datamodel-code-generator in a process of its own (the default on more than "
+                             "one core).")
+    parser.add_argument('--batch', nargs='+', metavar='APP_DIR',
+                        help="Generate the schemas of many apps: directories or glob patterns of app directories "
+                             "containing anvil.yaml or openapi.yaml.")
+    parser.add_argument('--batch-out', default='batch_out',
+                        help="With --batch, each app writes its outputs into its own directory under this one.")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="With --batch or --serve, number of worker processes (default: number of CPUs).")
+    parser.add_argument('--serve', metavar='ADDRESS', nargs='?', const=DEFAULT_ADDRESS, default=None,
+                        help="Run a local service generating the outputs of the yaml sent to POST /generate, "
+                             f"on HOST:PORT or unix:PATH (default {DEFAULT_ADDRESS}). The options are the defaults "
+                             "of the requests, --cache-size bounds the answers kept in memory.")
+    parser.add_argument('--max-concurrent', type=int, default=None,
+                        help="With --serve, generations running at once (default: --jobs).")
+    parser.add_argument('--profile', metavar='OUT_JSON', default=None,
+                        help="Write the wall time, cpu time, peak memory and counters of every stage to this file.")
+    parser.add_argument('--profile-stage', default=None,
+                        help="With --profile, run this stage (read, parse, reorder, openapi, models, pydal..) "
+                             "under cProfile and dump its stats next to the profile.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Stay running and regenerate the outputs every time the input yaml files change.")
+    parser.add_argument('--watch-interval', type=float, default=0.2, help="With --watch, seconds between polls.")
+    parser.add_argument('--debounce', type=float, default=0.3,
+                        help="With --watch, seconds to wait for the writes to stop before regenerating.")
+    args = parser.parse_args()
+    emit = [name.strip() for name in args.emit.split(',') if name.strip()]
+    for name in emit:
+        if name not in OUTPUT_FILES:
+            parser.error(f"--emit: unknown output `{name}`")
+    try:
+        pydal_options = PydalOptions(dialect=args.dialect, reference_indexes=not args.no_reference_indexes,
+                                     junction_tables=args.junction_tables, pool_size=args.pool_size,
+                                     lazy_tables=args.lazy_tables, migrate=args.migrate,
+                                     sqlite_pragmas=args.sqlite_pragmas, split_tables=args.split_tables)
+    except ValueError as e:
+        parser.error(str(e))
+    if 'fixtures' in emit and pydal_options.dialect != 'sqlite':
+        parser.error("--emit fixtures: the test fixtures are sqlite databases, they need --dialect sqlite")
+    options = dict(loader=args.loader, use_cache=not args.no_cache, cache_size=args.cache_size * 1024 * 1024,
+                   emit=emit, pydal_options=pydal_options, class_style=args.class_style)
+    # the modules of the other modes are only imported when used, not to slow down the start of a generation
+    if args.diff:
+        from y2s_diff import diff_files, describe_changes, migration_sql
+        try:
+            diff = diff_files(*args.diff, loader=args.loader, options=pydal_options)
+        except NoTablesError as e:
+            print(e)
+            exit(0)
+        print('\n'.join(describe_changes(diff)))
+        write_if_changed("tests/yaml/out/" + MIGRATION_FILE, '\n'.join(migration_sql(diff)) + '\n')
+        exit(0)
+    if args.serve:
+        from y2s_serve import serve
+        serve(args.serve, workers=args.jobs, max_concurrent=args.max_concurrent, cache_size=options['cache_size'],
+              loader=args.loader, emit=emit, pydal_options=pydal_options, class_style=args.class_style)
+        exit(0)
+    if args.batch:
+        from y2s_batch import run_batch, print_summary
+        start = time.perf_counter()
+        results = run_batch(args.batch, args.batch_out, jobs=args.jobs, **options)
+        print_summary(results, time.perf_counter() - start)
+        exit(1 if not results or any(result['error'] is not None for result in results) else 0)
     comment = """
 Input:  input/anvil.yaml
     OR
@@ -91,7 +153,19 @@ Can convert the following:\n"""
     for key in OPENAPI_FORMATS:
         doc_type += f"{key} : {OPENAPI_FORMATS[key]}\n"
 
-    if not main():
+    if args.watch:
+        from y2s_watch import watch
+        watch("tests/yaml/in/", "tests/yaml/out/", interval=args.watch_interval, debounce=args.debounce, **options)
+        exit(0)
+    profiler = NO_PROFILER
+    if args.profile:
+        profiler = Profiler(trace_memory=True, cprofile_stage=args.profile_stage,
+                            cprofile_out=args.profile + '.' + args.profile_stage + '.prof' if args.profile_stage else None)
+    done = main(profiler=profiler, concurrent=not args.serial, **options)
+    if args.profile:
+        profiler.write(args.profile)
+        profiler.close()
+    if not done:
         print(comment + doc_type)
         exit(1)
     exit(0)
@@ -0,0 +1,217 @@
+"""Generates the outputs from yaml texts in memory, for tools that call yaml2schema many times in one process.
+Nothing is read from or written to disk::
+
+    from y2s_api import generate
+
+    outputs = generate(anvil_text=anvil_yaml, refined_text=refined_yaml, emit={'pydal', 'openapi'})
+    outputs['pydal']  # text of pydal_def.py
+    outputs.files()  # {'pydal_def.py': ..., 'anvil_openapi.yaml': ...}
+
+The results are remembered by the hash of the inputs and options, so generating the same schema again costs
+a dictionary lookup. After an edit, only the edited tables are parsed again (see `y2s_watch.TableParseMemo`).
+"""
+import json
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, Mapping, Optional, Tuple
+
+from y2s_cache import content_key, normalize_yaml_text
+from y2s_file_io import top_level_key_text
+from y2s_pipeline import OUTPUT_FILES, DEFAULT_EMIT, PYDAL_PACKAGE, render_outputs, check_emit, \
+    class_models_available
+from y2s_profile import Profiler, NO_PROFILER
+from y2s_to_pydal import PydalOptions, DEFAULT_OPTIONS
+from y2s_types import TYPES
+from y2s_watch import TableParseMemo
+
+DEFAULT_MEMO_ENTRIES = 128
+# the input file named in the header of `db_models.py`, the one `python main.py` names (whatever the input file)
+MODELS_FILENAME = "tests/yaml/in/anvil.yaml"
+
+
+class Outputs:
+    """The generated outputs of one schema. `outputs['pydal']` is the text of an output, by its `--emit` name
+    (see `y2s_pipeline.OUTPUT_FILES`). The same object may be returned to several callers, so it is read only.
+    """
+    __slots__ = ('_texts', '_split_tables')
+
+    def __init__(self, texts: Dict[str, str], split_tables: bool = False):
+        self._texts: Mapping[str, str] = MappingProxyType(dict(texts))
+        self._split_tables = split_tables
+
+    def __getitem__(self, name: str) -> str:
+        return self._texts[OUTPUT_FILES[name]]
+
+    def __contains__(self, name: str) -> bool:
+        return OUTPUT_FILES.get(name) in self._texts
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name, file_name in OUTPUT_FILES.items() if file_name in self._texts)
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._texts.get(OUTPUT_FILES.get(name), default)
+
+    def bytes(self, name: str) -> bytes:
+        """The output encoded as utf-8, as it would be written to its file."""
+        return self[name].encode('utf-8')
+
+    def files(self) -> Dict[str, str]:
+        """Text of every file that `y2s_pipeline.generate` would write, by path in the output directory.
+        With `split_tables`, the modules of the pyDAL package are `pydal_def/<module>.py`."""
+        files = {}
+        for file_name, text in self._texts.items():
+            if file_name == OUTPUT_FILES['pydal'] and self._split_tables:
+                files.update((PYDAL_PACKAGE + "/" + module, module_text)
+                             for module, module_text in json.loads(text).items())
+            else:
+                files[file_name] = text
+        return files
+
+
+def sections_from_texts(anvil_text: Optional[str] = None, refined_text: Optional[str] = None,
+                        openapi_text: Optional[str] = None) -> Tuple[str, str, str]:
+    """The sections that `y2s_pipeline.read_sections` reads from the files, taken from texts instead.
+
+    Raises
+    ------
+    ValueError
+        If neither or both of `anvil_text` and `openapi_text` are given, or there are no tables.
+    """
+    if (anvil_text is None) == (openapi_text is None):
+        raise ValueError("Give either `anvil_text` or `openapi_text`.")
+    if anvil_text is not None:
+        source, db_str = 'anvil', top_level_key_text(anvil_text, 'db_schema')
+    else:
+        source, db_str = 'openapi', top_level_key_text(openapi_text, 'components')
+    if len(db_str) < 20:
+        raise ValueError(f"No database tables in the {source} yaml.")
+    refined_str = top_level_key_text(refined_text, 'components') if refined_text else ''
+    return source, db_str, refined_str
+
+
+class Generator:
+    """Generates outputs in memory and remembers the last `max_entries` results by the hash of their inputs.
+    Safe to use from several threads: the results are shared, a generation runs one at a time.
+
+    Parameters
+    ----------
+    max_entries
+        Number of keys kept, a result is kept under the hash of its texts and of their sections.
+        The least recently used are forgotten first.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MEMO_ENTRIES):
+        self.max_entries = max_entries
+        self.memo: 'OrderedDict[str, Outputs]' = OrderedDict()
+        self.parse = TableParseMemo()
+        self.hits = 0
+        self.misses = 0
+        self._memo_lock = threading.Lock()
+        self._render_lock = threading.Lock()
+
+    def generate(self, anvil_text: Optional[str] = None, refined_text: Optional[str] = None,
+                 openapi_text: Optional[str] = None, emit: Iterable[str] = DEFAULT_EMIT, loader: str = 'strict',
+                 pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass',
+                 profiler: Profiler = NO_PROFILER, models_filename: str = MODELS_FILENAME) -> Outputs:
+        """See the module function `generate`."""
+        emit = frozenset(emit)
+        if 'models' in emit and not class_models_available():
+            # as `y2s_pipeline.generate`: the other outputs without datamodel-code-generator
+            emit = emit - {'models'}
+        options_key = content_key(loader, pydal_options.key(), class_style, ','.join(sorted(emit)), TYPES.key(),
+                                  models_filename)
+        # the very same texts are found without reading their sections
+        text_key = content_key('texts', anvil_text or '', refined_text or '', openapi_text or '', options_key)
+        outputs = self._lookup(text_key)
+        if outputs is not None:
+            return outputs
+        check_emit(emit, pydal_options)
+        source, db_str, refined_str = sections_from_texts(anvil_text, refined_text, openapi_text)
+        # texts that only differ by comments or outside of the sections give the same outputs
+        key = content_key(source, normalize_yaml_text(db_str), normalize_yaml_text(refined_str), options_key)
+        outputs = self._lookup(key)
+        if outputs is not None:
+            self._remember(text_key, outputs)
+            return outputs
+        with self._render_lock:
+            texts = render_outputs(source, db_str, refined_str, emit, loader=loader, profiler=profiler,
+                                   parse=self.parse, pydal_options=pydal_options, class_style=class_style,
+                                   models_filename=models_filename)
+        outputs = Outputs(texts, pydal_options.split_tables)
+        with self._memo_lock:
+            self.misses += 1
+        self._remember(key, outputs)
+        self._remember(text_key, outputs)
+        return outputs
+
+    def _lookup(self, key: str) -> Optional[Outputs]:
+        with self._memo_lock:
+            outputs = self.memo.get(key)
+            if outputs is not None:
+                self.memo.move_to_end(key)
+                self.hits += 1
+            return outputs
+
+    def _remember(self, key: str, outputs: Outputs):
+        with self._memo_lock:
+            self.memo[key] = outputs
+            while len(self.memo) > self.max_entries:
+                self.memo.popitem(last=False)
+
+    def clear(self):
+        """Forgets every result and parsed table."""
+        with self._memo_lock:
+            self.memo.clear()
+        with self._render_lock:
+            self.parse = TableParseMemo()
+
+
+_generator = Generator()
+
+
+def generate(anvil_text: Optional[str] = None, refined_text: Optional[str] = None,
+             openapi_text: Optional[str] = None, emit: Iterable[str] = DEFAULT_EMIT, loader: str = 'strict',
+             pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass',
+             profiler: Profiler = NO_PROFILER, models_filename: str = MODELS_FILENAME) -> Outputs:
+    """Generates the outputs of a schema from yaml texts, without touching the disk.
+    The same texts and options give back the same `Outputs`, from memory.
+
+    Parameters
+    ----------
+    anvil_text
+        Text of anvil.yaml (only `db_schema` is used)
+    refined_text
+        Text of anvil_refined.yaml, optional
+    openapi_text
+        Text of openapi.yaml, instead of `anvil_text`
+    emit
+        Names of the outputs to generate, keys of `y2s_pipeline.OUTPUT_FILES`. `models` is left out when
+        datamodel-code-generator is not installed.
+    loader
+        `strict` or `fast`, see `y2s_load`
+    pydal_options
+        See `y2s_to_pydal.PydalOptions`
+    class_style
+        `dataclass` or `msgspec`, see `y2s_to_classes`
+    profiler
+        Records a span for every stage of a generation (not of a result found in memory)
+    models_filename
+        Input file named in the header of `db_models.py`. The default is the one of `python main.py`, so both
+        give the same bytes.
+
+    Returns
+    -------
+        Outputs
+
+    Raises
+    ------
+    ValueError
+        For unknown outputs, options that do not go together or texts without tables
+    """
+    return _generator.generate(anvil_text, refined_text, openapi_text, emit=emit, loader=loader,
+                               pydal_options=pydal_options, class_style=class_style, profiler=profiler,
+                               models_filename=models_filename)
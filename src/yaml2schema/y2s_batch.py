@@ -0,0 +1,119 @@
+"""Generates the schemas of many apps at once, spread over a pool of processes.
+
+Each app directory holds its own anvil.yaml (and anvil_refined.yaml) or openapi.yaml.
+The outputs of an app go to their own directory, and an app that fails does not stop the others.
+"""
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Iterable, Optional
+
+from y2s_pipeline import generate, NoTablesError
+
+INPUT_FILES = ("anvil.yaml", "openapi.yaml")
+
+
+def find_app_dirs(patterns: Iterable[str]) -> List[str]:
+    """Expands the directories or glob patterns into the app directories that contain an input yaml file.
+
+    Parameters
+    ----------
+    patterns
+        Directories, or glob patterns such as `apps/*`
+
+    Returns
+    -------
+        Sorted list of app directories, without duplicates.
+    """
+    app_dirs = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern) or [pattern]:
+            if any(os.path.isfile(os.path.join(path, name)) for name in INPUT_FILES):
+                app_dirs.add(os.path.normpath(path))
+    return sorted(app_dirs)
+
+
+def output_dirs(app_dirs: List[str], output_root: str) -> Dict[str, str]:
+    """One output directory per app, named after the app directory (`name-2`, `name-3`.. if names repeat)."""
+    used = {}
+    out = {}
+    for app_dir in app_dirs:
+        name = os.path.basename(os.path.abspath(app_dir))
+        used[name] = used.get(name, 0) + 1
+        if used[name] > 1:
+            name = f"{name}-{used[name]}"
+        out[app_dir] = os.path.join(output_root, name)
+    return out
+
+
+def run_app(app_dir: str, output_dir: str, options: Dict) -> Dict:
+    """Runs the pipeline for one app. Errors are returned, not raised, so one app cannot stop the batch.
+
+    Returns
+    -------
+        dict with keys `app`, `output_dir`, `seconds`, `error` (None if it worked) and `skipped` (True for an app
+        without database tables, which is not an error)
+    """
+    start = time.perf_counter()
+    error, skipped = None, False
+    try:
+        generate(app_dir, output_dir, **options)
+    except NoTablesError:
+        skipped = True
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {'app': app_dir, 'output_dir': output_dir, 'seconds': time.perf_counter() - start, 'error': error,
+            'skipped': skipped}
+
+
+def run_batch(patterns: Iterable[str], output_root: str, jobs: Optional[int] = None, **options) -> List[Dict]:
+    """Generates the outputs of every app found in `patterns`.
+
+    Parameters
+    ----------
+    patterns
+        App directories or glob patterns
+    output_root
+        Each app writes into its own directory under this one
+    jobs
+        Number of worker processes, the number of CPUs by default. 1 runs everything in this process.
+    options
+        Passed on to `y2s_pipeline.generate` (loader, use_cache, cache_size, emit)
+
+    Returns
+    -------
+        Results of `run_app`, in the order of the app directories.
+    """
+    app_dirs = find_app_dirs(patterns)
+    out = output_dirs(app_dirs, output_root)
+    if jobs == 1 or len(app_dirs) <= 1:
+        return [run_app(app_dir, out[app_dir], options) for app_dir in app_dirs]
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_app, app_dir, out[app_dir], options): app_dir for app_dir in app_dirs}
+        for future in as_completed(futures):
+            app_dir = futures[future]
+            try:
+                results[app_dir] = future.result()
+            except Exception as e:  # the worker process itself died
+                results[app_dir] = {'app': app_dir, 'output_dir': out[app_dir], 'seconds': 0.0,
+                                    'error': f"{type(e).__name__}: {e}", 'skipped': False}
+    return [results[app_dir] for app_dir in app_dirs]
+
+
+def print_summary(results: List[Dict], wall_seconds: float):
+    """Prints one line per app with its time and error, then the totals."""
+    width = max([len(result['app']) for result in results] + [3])
+    print(f"{'app':<{width}}  {'seconds':>8}  result")
+    for result in results:
+        if result['error'] is not None:
+            status = "FAILED " + result['error']
+        elif result['skipped']:
+            status = "skipped, no tables"
+        else:
+            status = "ok -> " + result['output_dir']
+        print(f"{result['app']:<{width}}  {result['seconds']:>8.2f}  {status}")
+    failed = sum(1 for result in results if result['error'] is not None)
+    skipped = sum(1 for result in results if result['skipped'])
+    print(f"{len(results)} apps, {failed} failed, {skipped} skipped, {wall_seconds:.2f} s")
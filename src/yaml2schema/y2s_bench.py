@@ -0,0 +1,262 @@
+"""Benchmarks each stage of the pipeline on synthetic schemas and writes the timings as json.
+
+Example::
+
+    python y2s_bench.py --tables 500 --columns 12 --references 0.3 --link-multiple 0.25 --out bench.json
+
+The synthetic anvil.yaml has `--tables` tables of `--columns` columns. A column is a link to another table with
+probability `--references`, and a link is a `link_multiple` with probability `--link-multiple`.
+Links only point to tables defined earlier, unless `--cycles` back references are injected.
+The tables are written in shuffled order, so `reorder_tables` has work to do.
+"""
+import argparse
+import importlib.util
+import json
+import pathlib
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Callable, Optional
+
+from y2s_constants import YAML2SCHEMA_VERSION
+from y2s_file_io import read_top_level_key
+from y2s_ir import schema_from_openapi
+from y2s_load import load_anvil, load_openapi, FAST_LOADER
+from y2s_modify import update_field_type
+from y2s_pipeline import class_models_available
+from y2s_reorder import reorder_tables, reorder_schema, ReferenceCycleError
+from y2s_to_openapi import convert_anvil_to_openapi, schema_to_openapi_yaml, schema_to_openapi_json, \
+    table_to_openapi_yaml_strict
+from y2s_to_classes import schema_to_classes
+from y2s_to_pydal import openapi_to_pydal
+from y2s_to_sql import schema_to_sql
+from y2s_types import classify_schema
+
+COLUMN_TYPES = ['string', 'number', 'bool', 'datetime', 'date', 'simpleObject', 'media']
+
+
+def synthetic_tables(tables: int = 100, columns: int = 10, references: float = 0.2, link_multiple: float = 0.25,
+                     cycles: int = 0, seed: int = 0) -> List[Dict]:
+    """Random anvil tables: a list of {'name': .., 'columns': [{'name', 'type', 'target'}]} in shuffled order."""
+    rnd = random.Random(seed)
+    names = [f"table_{ix}" for ix in range(tables)]
+    result = []
+    for ix, name in enumerate(names):
+        cols = []
+        for col_ix in range(columns):
+            if ix > 0 and rnd.random() < references:
+                link = 'link_multiple' if rnd.random() < link_multiple else 'link_single'
+                cols.append({'name': f"col_{col_ix}", 'type': link, 'target': names[rnd.randrange(ix)]})
+            else:
+                cols.append({'name': f"col_{col_ix}", 'type': rnd.choice(COLUMN_TYPES)})
+        result.append({'name': name, 'columns': cols})
+    for cycle_ix in range(min(cycles, tables - 1)):
+        # a back reference from an early table to a later one that (may) reference it
+        early = rnd.randrange(tables - 1)
+        late = rnd.randrange(early + 1, tables)
+        result[early]['columns'].append({'name': f"cycle_{cycle_ix}", 'type': 'link_single', 'target': names[late]})
+        result[late]['columns'].append({'name': f"cycle_back_{cycle_ix}", 'type': 'link_single',
+                                        'target': names[early]})
+    rnd.shuffle(result)
+    return result
+
+
+def synthetic_anvil_yaml(tables: List[Dict]) -> str:
+    """anvil.yaml text with the tables in `db_schema`, and some of the other sections an app has."""
+    lines = ["dependencies: []",
+             "services:",
+             "- source: /runtime/services/tables.yml",
+             "  client_config: {}",
+             "  server_config: {auto_create_missing_columns: true}",
+             "package_name: SyntheticApp",
+             "allow_embedding: false",
+             "name: SyntheticApp",
+             "runtime_options: {version: 2, client_version: '3', server_version: python3-full}",
+             "metadata: {}",
+             "startup_form: null",
+             "db_schema:"]
+    for table in tables:
+        lines.extend([f"  {table['name']}:",
+                      f"    title: {table['name'].title()}",
+                      "    client: none",
+                      "    server: full",
+                      "    columns:"])
+        for col in table['columns']:
+            lines.extend([f"    - name: {col['name']}",
+                          "      admin_ui: {width: 200}",
+                          f"      type: {col['type']}"])
+            if 'target' in col:
+                lines.append(f"      target: {col['target']}")
+    lines.append("renamed: true")
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_refined_yaml(tables: List[Dict]) -> str:
+    """anvil_refined.yaml text that turns every `number` column into a float."""
+    lines = ["components:", "  schemas:"]
+    for table in tables:
+        numbers = [col['name'] for col in table['columns'] if col['type'] == 'number']
+        if numbers:
+            lines.extend([f"    {table['name']}:", "      properties:"])
+            for name in numbers:
+                lines.extend([f"        {name}:", "          type: number", "          format: float"])
+    return '\n'.join(lines) + '\n'
+
+
+def synthetic_openapi_yaml(tables: List[Dict]) -> str:
+    """openapi.yaml text of the same tables."""
+    schema = convert_anvil_to_openapi({'db_schema': {table['name']: {'columns': table['columns']}
+                                                     for table in tables}})
+    return "openapi: 3.0.3\ninfo:\n  title: Synthetic\n  version: 0.0.1\n" + schema_to_openapi_yaml(schema)
+
+
+def time_stage(stage: Callable, repeat: int) -> Dict:
+    """Runs `stage` `repeat` times. Returns the timings in seconds and the last result."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'max': max(times), 'repeat': repeat,
+            'result': result}
+
+
+def sqlite_create_tables(schema_sql: str) -> sqlite3.Connection:
+    """A new database in memory with the tables of the sqlite script `schema_sql`."""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(schema_sql)
+    return conn
+
+
+def sqlite_clone(template: sqlite3.Connection, filename: str = ':memory:'):
+    """Copies the database `template` with the backup API, as `db_fixtures.py` does for each test."""
+    conn = sqlite3.connect(filename)
+    template.backup(conn)
+    conn.close()
+
+
+def pydal_define_tables(pydal_text: str, folder: str):
+    """Runs `define_tables_of_db` of the generated pydal_def.py on a new database in memory, with migrations."""
+    from pydal import DAL
+    namespace = {'__name__': 'pydal_def', '__file__': folder + "/pydal_def.py"}
+    exec(pydal_text, namespace)
+    namespace['db'] = DAL('sqlite:memory', folder=folder)
+    namespace['define_tables_of_db']()
+    namespace['db'].close()
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(tables: int = 100, columns: int = 10, references: float = 0.2, link_multiple: float = 0.25,
+                  cycles: int = 0, seed: int = 0, repeat: int = 3, models: bool = False) -> Dict:
+    """Times every stage of the pipeline on its own, on a synthetic schema.
+
+    Returns
+    -------
+        json serializable dict with the parameters, the environment and the timings of each stage.
+    """
+    params = dict(tables=tables, columns=columns, references=references, link_multiple=link_multiple,
+                  cycles=cycles, seed=seed, repeat=repeat)
+    synthetic = synthetic_tables(tables, columns, references, link_multiple, cycles, seed)
+    stages = {}
+
+    def record(name: str, stage: Callable, times: int = repeat):
+        timing = time_stage(stage, times)
+        stages[name] = {k: v for k, v in timing.items() if k != 'result'}
+        return timing['result']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        anvil_path = tmp + "/anvil.yaml"
+        openapi_path = tmp + "/openapi.yaml"
+        with open(anvil_path, "w") as f_out:
+            f_out.write(synthetic_anvil_yaml(synthetic))
+        with open(openapi_path, "w") as f_out:
+            f_out.write(synthetic_openapi_yaml(synthetic))
+        refined_str = synthetic_refined_yaml(synthetic)
+
+        db_str = record('read_db_schema', lambda: read_top_level_key(anvil_path, 'db_schema', ''))
+        components_str = record('read_components', lambda: read_top_level_key(openapi_path, 'components', ''))
+        anvil_data = record('load_anvil_strict', lambda: load_anvil(db_str, 'strict'))
+        record('load_openapi_strict', lambda: load_openapi(components_str, 'strict'))
+        if FAST_LOADER:
+            record('load_anvil_fast', lambda: load_anvil(db_str, 'fast'))
+            record('load_openapi_fast', lambda: load_openapi(components_str, 'fast'))
+        refined = schema_from_openapi(load_openapi(refined_str, 'strict'))
+        schema = record('convert_anvil_to_openapi', lambda: convert_anvil_to_openapi(anvil_data))
+        record('update_field_type', lambda: update_field_type(schema, refined))
+        try:
+            field_types = record('classify_schema', lambda: classify_schema(schema))
+            tables_in_order = record('reorder_tables', lambda: reorder_tables(schema, field_types))
+            ordered_schema = record('reorder_schema', lambda: reorder_schema(schema, tables_in_order))
+        except ReferenceCycleError as e:
+            stages['reorder_tables'] = {'error': str(e)}
+            ordered_schema, reorder_error = schema, e
+        else:
+            reorder_error = None
+        openapi_yaml = record('schema_to_openapi_yaml', lambda: schema_to_openapi_yaml(ordered_schema))
+        record('schema_to_openapi_yaml_strict',
+               lambda: schema_to_openapi_yaml(ordered_schema, table_to_openapi_yaml_strict))
+        record('schema_to_openapi_json', lambda: schema_to_openapi_json(ordered_schema))
+        pydal_text = '\n'.join(record('openapi_to_pydal', lambda: openapi_to_pydal(ordered_schema)))
+        record('schema_to_classes', lambda: schema_to_classes(ordered_schema))
+        schema_sql = '\n'.join(record('schema_to_sql', lambda: schema_to_sql(ordered_schema))) + '\n'
+        # a fresh test database: tables created by the script, or copied from a template (db_fixtures.py)
+        record('sqlite_create_tables', lambda: sqlite_create_tables(schema_sql).close())
+        template = sqlite_create_tables(schema_sql)
+        record('sqlite_clone_memory', lambda: sqlite_clone(template))
+        record('sqlite_clone_file', lambda: sqlite_clone(template, tmp + "/clone.sqlite"))
+        template.close()
+        if importlib.util.find_spec('pydal') is not None:
+            if reorder_error is None:
+                record('pydal_define_tables', lambda: pydal_define_tables(pydal_text, tmp))
+            else:
+                # pyDAL cannot define a table before the tables it references
+                stages['pydal_define_tables'] = {'error': f"not run, the tables are not ordered: {reorder_error}"}
+        if models and class_models_available():
+            import datamodel_code_generator as dcg
+            record('dcg_generate', lambda: dcg.generate(openapi_yaml, input_file_type=dcg.InputFileType.OpenAPI,
+                                                         output=pathlib.Path(tmp) / "db_models.py"),
+                   times=1)
+    return {'version': YAML2SCHEMA_VERSION,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': params,
+            'counts': {'tables': len(schema.tables),
+                       'fields': sum(len(table.fields) for table in schema.tables.values()),
+                       'references': len(schema.references())},
+            'stages': stages}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times each stage of yaml2schema on a synthetic schema.")
+    parser.add_argument('--tables', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=10, help="columns per table")
+    parser.add_argument('--references', type=float, default=0.2, help="probability that a column is a link")
+    parser.add_argument('--link-multiple', type=float, default=0.25,
+                        help="probability that a link is a link_multiple")
+    parser.add_argument('--cycles', type=int, default=0, help="number of reference cycles to inject")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--models', action='store_true', help="also time datamodel-code-generator (once)")
+    parser.add_argument('--out', default=None, help="json file for the results (default: print)")
+    args = parser.parse_args()
+    report = run_benchmark(args.tables, args.columns, args.references, args.link_multiple, args.cycles,
+                           args.seed, args.repeat, args.models)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f_out:
+            f_out.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,145 @@
+"""On-disk cache of the generated outputs, so unchanged schemas are not generated again.
+
+Entries are keyed by a hash of their inputs (see `content_key`):
+    - whole outputs by the normalized db_schema/components text, the refinement text and the options,
+    - per-table fragments by the openapi description of the table, so only changed tables are rebuilt.
+Every key includes `generator_version`, so the entries written by another version of the code are not used.
+The directory is bounded in size; the least recently used entries are removed first.
+"""
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+from typing import Callable, Optional, Union
+
+from y2s_constants import YAML2SCHEMA_VERSION
+from y2s_ir import Table
+
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# the modules generating the outputs, whose sources are hashed into `generator_version`
+SOURCE_DIR = pathlib.Path(__file__).parent
+
+
+def normalize_yaml_text(text: str) -> str:
+    """Removes what does not change the generated outputs: trailing spaces, blank lines,
+    comment lines and anvil's `admin_ui` column widths."""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#') or stripped.startswith('admin_ui:'):
+            continue
+        lines.append(line.rstrip())
+    return '\n'.join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def generator_version() -> str:
+    """The tool version and a hash of the sources of its modules, so that any change to the code generating the
+    outputs changes the keys, even when `YAML2SCHEMA_VERSION` was not bumped."""
+    digest = hashlib.sha256()
+    for path in sorted(SOURCE_DIR.glob('y2s_*.py')):
+        digest.update(path.name.encode('utf-8') + b'\0')
+        digest.update(path.read_bytes())
+    return f"{YAML2SCHEMA_VERSION}+{digest.hexdigest()[:16]}"
+
+
+def content_key(*parts: str) -> str:
+    """sha256 of the parts and the `generator_version`."""
+    digest = hashlib.sha256(generator_version().encode('utf-8'))
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def table_key(kind: str, table: Table, variant: str = '') -> str:
+    """Key of the fragment `kind` (for example 'pydal') generated from one table."""
+    return content_key(kind, variant, table.name, json.dumps(table.to_openapi(), sort_keys=True))
+
+
+class BuildCache:
+    """A directory of cached texts, one file per key.
+
+    Parameters
+    ----------
+    directory
+        Where the entries are stored. Created when needed.
+    max_bytes
+        Once the entries take more than this, the least recently used are deleted.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / (key + '.txt')
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            text = path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # just evicted by another process
+            pass
+        self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        """Stores `text` under `key`. Written to a temporary file of its own then renamed, so that other processes
+        sharing the directory (a second run, `--watch`) never read a half written entry."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, prefix=key + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(text.encode('utf-8'))
+            os.replace(tmp_name, self._path(key))
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def evict(self):
+        """Deletes the least recently used entries until the directory is within `max_bytes`."""
+        if not self.directory.exists():
+            return
+        entries = []
+        total = 0
+        for path in self.directory.glob('*.txt'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def memo_table(self, kind: str, render: Callable[[str, Table], object], variant: str = ''):
+        """Wraps a per-table render function, `render(table_name, table)`, so that a table that did not change
+        is read from the cache instead of rendered again. The result of `render` must be json serializable.
+        """
+        def cached_render(table_name: str, table: Table):
+            key = table_key(kind, table, variant)
+            text = self.get(key)
+            if text is not None:
+                return json.loads(text)
+            result = render(table_name, table)
+            self.put(key, json.dumps(result))
+            return result
+
+        return cached_render
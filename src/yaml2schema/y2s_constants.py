@@ -1,3 +1,9 @@
+YAML2SCHEMA_VERSION = '0.3.0'
+# written by `--diff`, next to the other outputs
+MIGRATION_FILE = "migration.sql"
+# of `--serve`
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
 OPENAPI_TYPES = {'string': 'string',
                  'datetime': 'string',
                  'date': 'string',
@@ -27,3 +33,20 @@ info:
 paths:
     /:
 """
+# `Openapi_preamble` as strictyaml writes it back, the start of anvil_openapi.yaml
+Openapi_preamble_yaml = """openapi: 3.0.3
+info:
+  title: Example openapi file
+  description: File can be used as an input to 'yaml2schema'.
+  termsOfService: https://unlicense.org
+  version: 0.0.1
+paths:
+  /:
+"""
+# the same as data, the start of the json document
+Openapi_preamble_data = {'openapi': '3.0.3',
+                         'info': {'title': 'Example openapi file',
+                                  'description': "File can be used as an input to 'yaml2schema'.",
+                                  'termsOfService': 'https://unlicense.org',
+                                  'version': '0.0.1'},
+                         'paths': {'/': {}}}
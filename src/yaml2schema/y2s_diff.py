@@ -0,0 +1,385 @@
+"""Compares two versions of a schema and writes the SQL migrating a database from the old one to the new one.
+
+Both versions go through the same conversion as the other outputs (anvil.yaml, anvil_refined.yaml or openapi.yaml
+into the openapi schema), then the tables, columns (references included) and indexes are compared.
+The migration only touches what changed, in an order the foreign keys allow:
+
+    1. drop the indexes that are gone,
+    2. create the new tables (in reference order, see `reorder_tables`) with their indexes and junction tables,
+    3. add the new columns, then change the type or the referenced table of the retyped ones,
+    4. create the new indexes of the existing tables,
+    5. drop the columns that are gone, then the tables (in reverse reference order).
+
+sqlite can not change the type of a column: a table with retyped columns is rebuilt, its rows copied into a new
+table with the new definition (the procedure of https://www.sqlite.org/lang_altertable.html).
+"""
+import pathlib
+from typing import List, Optional, Dict, Tuple
+
+from y2s_api import sections_from_texts
+from y2s_constants import MIGRATION_FILE
+from y2s_ir import Schema, Reference
+from y2s_pipeline import read_sections, parse_schema
+from y2s_reorder import reorder_tables
+from y2s_to_pydal import PydalOptions, DEFAULT_OPTIONS, pydal_type, junction, junctions, table_indexes, index_name
+from y2s_to_sql import (quote, sql_type, column_to_sql, foreign_key_sql, foreign_keys_sql, create_table_sql,
+                        create_index_sql, table_to_sql, table_columns, table_body_sql, junction_to_sql)
+from y2s_types import FieldType, VALUE, REFERENCE, REFERENCES, classify_schema
+
+# kinds of change
+ADD_TABLE = 'add table'
+DROP_TABLE = 'drop table'
+ADD_COLUMN = 'add column'
+DROP_COLUMN = 'drop column'
+RETYPE_COLUMN = 'retype column'
+ADD_INDEX = 'add index'
+DROP_INDEX = 'drop index'
+
+# an index: its columns and method, see `table_indexes`
+Index = Tuple[Tuple[str, ...], str]
+
+
+class Change:
+    """One difference between the old and the new schema.
+
+    Attributes
+    ----------
+    kind
+        `ADD_TABLE`, `DROP_TABLE`, `ADD_COLUMN`, `DROP_COLUMN`, `RETYPE_COLUMN`, `ADD_INDEX` or `DROP_INDEX`
+    table
+        Table name
+    column
+        Column name, None for a table or an index
+    old, new
+        The `FieldType` of the column or the `Index` before and after the change, None when it does not exist
+    """
+    __slots__ = ('kind', 'table', 'column', 'old', 'new')
+
+    def __init__(self, kind: str, table: str, column: Optional[str] = None, old=None, new=None):
+        self.kind = kind
+        self.table = table
+        self.column = column
+        self.old = old
+        self.new = new
+
+    def describe(self) -> str:
+        """The change in one line, such as `~ column contact.phone: reference phone -> string`."""
+        sign = {'add': '+', 'drop': '-', 'retype': '~'}[self.kind.split()[0]]
+        if self.column is not None:
+            kinds = {field_type.kind for field_type in (self.old, self.new) if field_type is not None}
+            what = 'column' if kinds == {VALUE} else 'reference'
+            types = ' -> '.join(field_type.type_of for field_type in (self.old, self.new) if field_type is not None)
+            return f"{sign} {what} {self.table}.{self.column}: {types}"
+        if self.kind in (ADD_INDEX, DROP_INDEX):
+            columns, method = self.new or self.old
+            return f"{sign} index {self.table} ({', '.join(columns)})" + (f" using {method}" if method else "")
+        return f"{sign} table {self.table}"
+
+    def __repr__(self):
+        return f"Change({self.describe()})"
+
+
+class SchemaDiff:
+    """The changes from the `old` to the `new` schema, with the column types of both (see `classify_schema`).
+
+    Attributes
+    ----------
+    changes
+        In the order of the migration: index drops, table creations, column additions and retypes,
+        index creations, column drops and table drops
+    """
+    __slots__ = ('old', 'new', 'old_types', 'new_types', 'options', 'changes')
+
+    def __init__(self, old: Schema, new: Schema, old_types: Dict[str, Dict[str, FieldType]],
+                 new_types: Dict[str, Dict[str, FieldType]], options: PydalOptions, changes: List[Change]):
+        self.old = old
+        self.new = new
+        self.old_types = old_types
+        self.new_types = new_types
+        self.options = options
+        self.changes = changes
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def of_kind(self, kind: str) -> List[Change]:
+        return [change for change in self.changes if change.kind == kind]
+
+
+def retyped(old: FieldType, new: FieldType, dialect: str) -> bool:
+    """Does the column change in the database? Its pyDAL type, such as `reference users` -> `reference staff`."""
+    return pydal_type(old.type_of, dialect) != pydal_type(new.type_of, dialect)
+
+
+def diff_schemas(old: Schema, new: Schema, options: PydalOptions = DEFAULT_OPTIONS) -> SchemaDiff:
+    """Classifies the added, dropped and retyped tables, columns (references included) and indexes.
+
+    Parameters
+    ----------
+    old, new
+        The two versions of the schema in openapi format
+    options
+        The dialect, and the indexes and junction tables of the database (as for `pydal_def.py`)
+
+    Returns
+    -------
+        SchemaDiff
+
+    Raises
+    ------
+    ReferenceCycleError
+        if the new tables can not be put in reference order
+    """
+    old_types, new_types = classify_schema(old), classify_schema(new)
+    dialect = options.dialect
+
+    def indexes(schema: Schema, types: Dict[str, Dict[str, FieldType]], table: str) -> List[Index]:
+        return [(tuple(columns), method)
+                for columns, method in table_indexes(table, schema.tables[table], options, types[table])]
+
+    kept = [table for table in new.tables if table in old.tables]
+    added = [table for table in reorder_tables(new, new_types) if table not in old.tables]
+    dropped = [table for table in reorder_tables(old, old_types) if table not in new.tables]
+    index_drops, index_adds, column_adds, retypes, column_drops = [], [], [], [], []
+    for table in kept:
+        before, after = old_types[table], new_types[table]
+        column_adds.extend(Change(ADD_COLUMN, table, column, new=field_type)
+                           for column, field_type in after.items() if column not in before)
+        retypes.extend(Change(RETYPE_COLUMN, table, column, old=before[column], new=field_type)
+                       for column, field_type in after.items()
+                       if column in before and retyped(before[column], field_type, dialect))
+        column_drops.extend(Change(DROP_COLUMN, table, column, old=field_type)
+                            for column, field_type in before.items() if column not in after)
+        old_indexes, new_indexes = indexes(old, old_types, table), indexes(new, new_types, table)
+        index_drops.extend(Change(DROP_INDEX, table, old=index) for index in old_indexes if index not in new_indexes)
+        index_adds.extend(Change(ADD_INDEX, table, new=index) for index in new_indexes if index not in old_indexes)
+    changes = index_drops + [Change(ADD_TABLE, table) for table in added] + column_adds + retypes + index_adds + \
+        column_drops + [Change(DROP_TABLE, table) for table in reversed(dropped)]
+    return SchemaDiff(old, new, old_types, new_types, options, changes)
+
+
+def describe_changes(diff: SchemaDiff) -> List[str]:
+    """One line per change, in the order of the migration."""
+    return [change.describe() for change in diff.changes] or ["no changes"]
+
+
+def drop_index_sql(dialect: str, table: str, columns: Tuple[str, ...]) -> str:
+    name = quote(dialect, index_name(table, list(columns)))
+    if dialect == 'mysql':
+        return f"DROP INDEX {name} ON {quote(dialect, table)};"
+    return f"DROP INDEX IF EXISTS {name};"
+
+
+def add_index_sql(dialect: str, table: str, index: Index) -> str:
+    columns, method = index
+    if dialect == 'mysql':
+        # mysql has no CREATE INDEX IF NOT EXISTS
+        column_list = ', '.join(quote(dialect, column) for column in columns)
+        return f"CREATE INDEX {quote(dialect, index_name(table, list(columns)))} ON {quote(dialect, table)} " \
+               f"({column_list});"
+    return create_index_sql(dialect, table, list(columns), method)
+
+
+def drop_table_sql(dialect: str, table: str) -> str:
+    return f"DROP TABLE IF EXISTS {quote(dialect, table)};"
+
+
+def junction_of(field_type: FieldType) -> Reference:
+    """The `Reference` of a `link_multiple` column, to name its junction table."""
+    return Reference(field_type.table, field_type.field, field_type.reference, True)
+
+
+def drop_foreign_key_sql(dialect: str, table: str, column: str) -> List[str]:
+    """Lines dropping the foreign key of a reference column, postgres and mysql. mysql named it itself
+    (`<table>_ibfk_<n>`): its name is looked up in information_schema and the statement prepared from it."""
+    if dialect != 'mysql':
+        # the name postgres gives to the foreign key of a column
+        return [f"ALTER TABLE {quote(dialect, table)} DROP CONSTRAINT IF EXISTS "
+                f"{quote(dialect, f'{table}_{column}_fkey')};"]
+    return [f"SET @y2s_fkey = (SELECT CONSTRAINT_NAME FROM information_schema.KEY_COLUMN_USAGE WHERE "
+            f"TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{table}' AND COLUMN_NAME = '{column}' "
+            f"AND REFERENCED_TABLE_NAME IS NOT NULL LIMIT 1);",
+            f"SET @y2s_sql = IF(@y2s_fkey IS NULL, 'DO 0', "
+            f"CONCAT('ALTER TABLE {quote(dialect, table)} DROP FOREIGN KEY `', @y2s_fkey, '`'));",
+            "PREPARE y2s_drop_fkey FROM @y2s_sql;",
+            "EXECUTE y2s_drop_fkey;",
+            "DEALLOCATE PREPARE y2s_drop_fkey;"]
+
+
+def add_column_sql(dialect: str, options: PydalOptions, field_type: FieldType) -> List[str]:
+    """Lines adding a column to its table, or creating its junction table."""
+    if options.junction_tables and field_type.kind == REFERENCES:
+        return junction_to_sql(dialect, junction_of(field_type))
+    table = quote(dialect, field_type.table)
+    column_types = table_columns({field_type.field: field_type}, options)
+    lines = [f"ALTER TABLE {table} ADD COLUMN {column_to_sql(dialect, name, type_of)};"
+             for name, type_of in column_types]
+    lines.extend(f"ALTER TABLE {table} ADD {constraint};" for constraint in foreign_keys_sql(dialect, column_types))
+    return lines
+
+
+def drop_column_sql(dialect: str, options: PydalOptions, field_type: FieldType) -> List[str]:
+    """Lines dropping a column from its table, or its junction table. In mysql, `migration_sql` drops the foreign
+    key of a reference column first."""
+    if options.junction_tables and field_type.kind == REFERENCES:
+        return [drop_table_sql(dialect, junction(junction_of(field_type))[0])]
+    table = quote(dialect, field_type.table)
+    if_exists = " IF EXISTS" if dialect == 'postgres' else ""
+    return [f"ALTER TABLE {table} DROP COLUMN{if_exists} {quote(dialect, name)};"
+            for name, _ in reversed(table_columns({field_type.field: field_type}, options))]
+
+
+def retype_column_sql(dialect: str, options: PydalOptions, old: FieldType, new: FieldType) -> List[str]:
+    """Lines changing the type or the referenced table of a column, postgres and mysql (for sqlite see
+    `rebuild_table_sql`). The values are converted by the database: a conversion it can not do fails.
+    In mysql, `migration_sql` drops the foreign key of an old reference column first."""
+    if options.junction_tables and REFERENCES in (old.kind, new.kind):
+        # a junction table can not be converted: the old links are dropped
+        return drop_column_sql(dialect, options, old) + add_column_sql(dialect, options, new)
+    table, column = quote(dialect, new.table), quote(dialect, new.field)
+    old_type, new_type = pydal_type(old.type_of, dialect), pydal_type(new.type_of, dialect)
+    old_sql, new_sql = sql_type(dialect, new.field, old_type), sql_type(dialect, new.field, new_type)
+    # the name postgres gives to the foreign key of a column
+    foreign_key = quote(dialect, f"{new.table}_{new.field}_fkey")
+    lines = []
+    if old.kind == REFERENCE and dialect != 'mysql':
+        lines.extend(drop_foreign_key_sql(dialect, new.table, new.field))
+    if old_sql != new_sql:
+        if dialect == 'mysql':
+            lines.append(f"ALTER TABLE {table} MODIFY COLUMN {column} {new_sql};")
+        else:
+            lines.append(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {new_sql} USING {column}::{new_sql};")
+    if new.kind == REFERENCE:
+        constraint = "" if dialect == 'mysql' else f"CONSTRAINT {foreign_key} "
+        lines.append(f"ALTER TABLE {table} ADD {constraint}FOREIGN KEY ({column}) "
+                     f"{foreign_key_sql(dialect, new.reference)};")
+    # the upload column of the file name of a blob
+    upload = FieldType(new.table, new.field, 'blob')
+    if old_type == 'blob' and new_type != 'blob':
+        lines.append(drop_column_sql(dialect, options, upload)[0])
+    elif new_type == 'blob' and old_type != 'blob':
+        lines.append(add_column_sql(dialect, options, upload)[0])
+    return lines
+
+
+def rebuild_table_sql(diff: SchemaDiff, table: str) -> List[str]:
+    """sqlite: lines replacing the table by a new one with the new definition, keeping its rows.
+    The indexes are created again, the junction tables of its changed `link_multiple` columns too."""
+    options, dialect = diff.options, diff.options.dialect
+    before, after = diff.old_types[table], diff.new_types[table]
+    old_columns = {name for name, _ in table_columns(before, options)}
+    new_columns = table_columns(after, options)
+    copied = ', '.join(quote(dialect, name) for name in ['id'] + [name for name, _ in new_columns
+                                                                   if name in old_columns])
+    rebuilt = table + "__new"
+    lines = create_table_sql(dialect, rebuilt, *table_body_sql(dialect, new_columns))
+    lines.extend([f"INSERT INTO {quote(dialect, rebuilt)} ({copied}) SELECT {copied} FROM {quote(dialect, table)};",
+                  drop_table_sql(dialect, table),
+                  f"ALTER TABLE {quote(dialect, rebuilt)} RENAME TO {quote(dialect, table)};"])
+    lines.extend(add_index_sql(dialect, table, (tuple(columns), method)) for columns, method
+                 in table_indexes(table, diff.new.tables[table], options, after))
+    if options.junction_tables:
+        for change in diff.of_kind(RETYPE_COLUMN):
+            if change.table == table and change.old.kind == REFERENCES:
+                lines.append(drop_table_sql(dialect, junction(junction_of(change.old))[0]))
+            if change.table == table and change.new.kind == REFERENCES:
+                lines.extend(junction_to_sql(dialect, junction_of(change.new)))
+    return lines
+
+
+def migration_sql(diff: SchemaDiff) -> List[str]:
+    """Converts the changes into one SQL script migrating a database of the old schema to the new one.
+    In sqlite and postgres the script is a single transaction. mysql commits each statement on its own.
+
+    Parameters
+    ----------
+    diff
+        From `diff_schemas`, the dialect and the indexes of the database are its options
+
+    Returns
+    -------
+    list of lines
+    """
+    options, dialect = diff.options, diff.options.dialect
+    lines = [f"-- {dialect} migration of the tables of pydal_def.py: run it on a database of the old schema, "
+             f"then open the database once with the new pydal_def.py generated with --migrate fake"]
+    if not diff:
+        return lines + ["-- no changes"]
+    # sqlite rebuilds the tables with retyped columns, which takes their other changes along
+    rebuilt = [] if dialect != 'sqlite' else list(dict.fromkeys(change.table for change in diff.of_kind(RETYPE_COLUMN)))
+
+    def in_place(change: Change) -> bool:
+        """Is the change made by its own statements rather than by the rebuild of its table?
+        The junction tables of a rebuilt table are still created and dropped on their own."""
+        field_type = change.new or change.old
+        return change.table not in rebuilt or (options.junction_tables and isinstance(field_type, FieldType)
+                                               and field_type.kind == REFERENCES)
+
+    if rebuilt:
+        # the rows are copied into the new table while the tables referencing the old one still do
+        lines.append("PRAGMA foreign_keys=OFF;")
+    if dialect != 'mysql':
+        lines.append("BEGIN;")
+    else:
+        # mysql can neither drop nor change a column with a foreign key, nor drop the index the foreign key uses
+        for change in diff.of_kind(RETYPE_COLUMN) + diff.of_kind(DROP_COLUMN):
+            if change.old.kind == REFERENCE:
+                lines.extend(drop_foreign_key_sql(dialect, change.table, change.old.field))
+    lines.extend(drop_index_sql(dialect, change.table, change.old[0])
+                 for change in diff.of_kind(DROP_INDEX) if in_place(change))
+    added = diff.of_kind(ADD_TABLE)
+    for change in added:
+        lines.extend(table_to_sql(change.table, diff.new.tables[change.table], options, diff.new_types[change.table]))
+    if options.junction_tables:
+        # after all the new tables, the ones they link to
+        added_tables = {change.table for change in added}
+        for ref in junctions(diff.new):
+            if ref.table in added_tables:
+                lines.extend(junction_to_sql(dialect, ref))
+    for change in diff.of_kind(ADD_COLUMN):
+        if in_place(change):
+            lines.extend(add_column_sql(dialect, options, change.new))
+    for table in rebuilt:
+        lines.extend(rebuild_table_sql(diff, table))
+    for change in diff.of_kind(RETYPE_COLUMN):
+        if change.table not in rebuilt:
+            lines.extend(retype_column_sql(dialect, options, change.old, change.new))
+    lines.extend(add_index_sql(dialect, change.table, change.new)
+                 for change in diff.of_kind(ADD_INDEX) if in_place(change))
+    for change in diff.of_kind(DROP_COLUMN):
+        if in_place(change):
+            lines.extend(drop_column_sql(dialect, options, change.old))
+    for change in diff.of_kind(DROP_TABLE):
+        if options.junction_tables:
+            lines.extend(drop_table_sql(dialect, junction(junction_of(field_type))[0])
+                         for field_type in diff.old_types[change.table].values() if field_type.kind == REFERENCES)
+        lines.append(drop_table_sql(dialect, change.table))
+    if dialect != 'mysql':
+        lines.append("COMMIT;")
+    if rebuilt:
+        lines.extend(["PRAGMA foreign_key_check;", "PRAGMA foreign_keys=ON;"])
+    return lines
+
+
+def read_schema(path: str, loader: str = 'strict') -> Schema:
+    """The schema of an app directory (as `read_sections` reads it) or of an anvil.yaml or openapi.yaml file.
+    A file named anvil.yaml is refined by the anvil_refined.yaml next to it, if there is one."""
+    path_ = pathlib.Path(path)
+    if path_.is_dir():
+        return parse_schema(*read_sections(str(path_) + "/"), loader=loader)
+    text = path_.read_text(encoding='utf-8')
+    if text.startswith('db_schema:') or '\ndb_schema:' in text:
+        refined = path_.with_name("anvil_refined.yaml")
+        refined_text = None
+        if path_.name == "anvil.yaml" and refined.exists():
+            refined_text = refined.read_text(encoding='utf-8')
+        sections = sections_from_texts(anvil_text=text, refined_text=refined_text)
+    else:
+        sections = sections_from_texts(openapi_text=text)
+    return parse_schema(*sections, loader=loader)
+
+
+def diff_files(old_path: str, new_path: str, loader: str = 'strict',
+               options: PydalOptions = DEFAULT_OPTIONS) -> SchemaDiff:
+    """`diff_schemas` of the schemas of two app directories or yaml files, see `read_schema`."""
+    return diff_schemas(read_schema(old_path, loader), read_schema(new_path, loader), options)
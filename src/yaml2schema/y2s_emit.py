@@ -0,0 +1,223 @@
+"""Runs the backends writing the outputs of one schema at the same time, so the wall time of a generation is
+the one of the slowest backend rather than the sum of all of them.
+
+Every backend reads the same ordered schema, which none of them changes. The python backends (openapi, pyDAL,
+SQL, classes) run in threads. datamodel-code-generator, by far the slowest, runs in a process of its own,
+started and warmed up while the schema is still being parsed. This only pays on more than one core, see
+`available_cpus`. The errors of the backends are collected: the others still finish, then `EmitError` reports
+all the failures. Each backend is timed, see `BackendResult`.
+"""
+import os
+import pathlib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, TimeoutError as FuturesTimeoutError
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# backends run in threads at once, at most
+MAX_THREADS = 4
+# added to the niceness of the process of datamodel-code-generator
+MODELS_NICENESS = 10
+# seconds to wait for the backends, after which the models still running are given up
+DEFAULT_TIMEOUT = 300.0
+
+
+def available_cpus() -> int:
+    """Number of cores this process may run on. With one, running the backends at once gains nothing."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def render_models(openapi_yaml: str, models_filename: str) -> str:
+    """Text of `db_models.py`: the pydantic models of the openapi components, by datamodel-code-generator.
+    Without the timestamp, the same schema gives the same models, byte for byte."""
+    # imported only now: it brings in pydantic, black, isort and jinja
+    import datamodel_code_generator as dcg
+    models = dcg.generate(
+        openapi_yaml,
+        input_file_type=dcg.InputFileType.OpenAPI,
+        input_filename=models_filename,
+        disable_timestamp=True)
+    # as dcg writes it to a file
+    return models if models.endswith('\n') else models + '\n'
+
+
+def warm_up_models():
+    """Runs datamodel-code-generator once on a tiny schema, so all the modules it needs are loaded
+    before the first real schema."""
+    import datamodel_code_generator as dcg
+    with tempfile.TemporaryDirectory() as tmp:
+        dcg.generate("components:\n  schemas:\n    warm_up:\n      properties:\n        name:\n"
+                     "          type: string\n",
+                     input_file_type=dcg.InputFileType.OpenAPI,
+                     output=pathlib.Path(tmp) / "db_models.py")
+
+
+def start_models_worker():
+    """Initializer of the process of datamodel-code-generator. Its priority is lowered, so that on a machine with
+    few cores its warm up does not slow down the parsing of the schema (nor anything else when its models
+    turn out to be in the cache)."""
+    # tracing inherited from a profiler of the parent (`--profile`) would slow everything down several times
+    import tracemalloc
+    tracemalloc.stop()
+    # an initializer that raises makes the pool start a new process forever, and the models never come
+    try:
+        if hasattr(os, 'nice'):
+            os.nice(MODELS_NICENESS)
+        warm_up_models()
+    except Exception:  # a warm up that fails only costs time, `render_models` reports the error
+        pass
+
+
+class BackendResult:
+    """What a backend produced and how long it took.
+
+    Attributes
+    ----------
+    name
+        Name of the backend, such as `pydal` or `models`
+    texts
+        Text of each output by file name, empty if the backend failed
+    error
+        The exception raised by the backend, None if it worked
+    wall, cpu
+        Seconds the backend ran, and cpu seconds of its thread or process
+    where
+        `thread` or `process`
+    """
+    __slots__ = ('name', 'texts', 'error', 'wall', 'cpu', 'where')
+
+    def __init__(self, name: str, texts: Dict[str, str], error: Optional[BaseException], wall: float, cpu: float,
+                 where: str):
+        self.name = name
+        self.texts = texts
+        self.error = error
+        self.wall = wall
+        self.cpu = cpu
+        self.where = where
+
+    def __repr__(self):
+        return f"BackendResult({self.name}: {self.wall * 1000:.1f} ms in a {self.where}" \
+               f"{', ' + type(self.error).__name__ if self.error is not None else ''})"
+
+
+class EmitError(Exception):
+    """Some backends failed. Raised once all of them finished, the outputs of the others are already out.
+
+    Attributes
+    ----------
+    errors
+        The exception of each failed backend, by backend name
+    """
+
+    def __init__(self, errors: Dict[str, BaseException]):
+        self.errors = errors
+        super().__init__("; ".join(f"{name}: {type(error).__name__}: {error}" for name, error in errors.items()))
+
+
+def run_timed(render: Callable, args: Tuple) -> Tuple[object, Optional[BaseException], float, float]:
+    """Runs `render(*args)` in the current thread or process. Returns its result, or the exception it raised,
+    with the wall and cpu seconds it took."""
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        result, error = render(*args), None
+    except Exception as e:
+        result, error = None, e
+    return result, error, time.perf_counter() - wall, time.thread_time() - cpu
+
+
+class EmitScheduler:
+    """Runs the backends of one generation. Use it as a context manager, so the threads and the process stop::
+
+        with EmitScheduler() as scheduler:
+            scheduler.start_models_process()  # as early as possible
+            ...
+            scheduler.submit_models(openapi_yaml, "anvil.yaml")
+            scheduler.submit('pydal', render_pydal)
+            for result in scheduler.results():
+                ...
+
+    Parameters
+    ----------
+    threads
+        Number of backends running in threads at once
+    timeout
+        Seconds `results` waits for the backends. The models are then given up with a `TimeoutError` (and their
+        process stopped), the threads, which can not be stopped, are still waited for.
+    """
+
+    def __init__(self, threads: int = MAX_THREADS, timeout: float = DEFAULT_TIMEOUT):
+        self._threads = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='y2s_emit')
+        self.timeout = timeout
+        self._models_pool = None
+        self._models_submitted = False
+        self._timed_out = False
+        self._submitted: List[Tuple[str, str, Future]] = []
+
+    def start_models_process(self):
+        """Starts the process of datamodel-code-generator, which loads its modules in the background."""
+        if self._models_pool is None:
+            # imported only now: a generation without models does not need it
+            import multiprocessing
+            self._models_pool = multiprocessing.Pool(1, initializer=start_models_worker)
+
+    def submit(self, name: str, render: Callable[[], Dict[str, str]]):
+        """Runs the backend `render` in a thread. It returns the text of each of its outputs by file name."""
+        self._submitted.append((name, 'thread', self._threads.submit(run_timed, render, ())))
+
+    def submit_models(self, openapi_yaml: str, models_filename: str):
+        """Runs `render_models` in the process of datamodel-code-generator, the backend `models`."""
+        self.start_models_process()
+        future = Future()
+        self._models_pool.apply_async(run_timed, (render_models, (openapi_yaml, models_filename)),
+                                      callback=future.set_result, error_callback=future.set_exception)
+        self._models_submitted = True
+        self._submitted.append(('models', 'process', future))
+
+    def results(self) -> Iterator[BackendResult]:
+        """The result of each submitted backend, as soon as it finishes. A backend of the process still running
+        after `timeout` seconds gets a `TimeoutError`."""
+        names = {id(future): (name, where) for name, where, future in self._submitted}
+        finished = set()
+        try:
+            for future in as_completed([future for _, _, future in self._submitted], timeout=self.timeout):
+                finished.add(id(future))
+                yield self._result(*names[id(future)], future)
+        except FuturesTimeoutError:
+            self._timed_out = True
+            for name, where, future in self._submitted:
+                if id(future) in finished:
+                    continue
+                if where == 'thread':
+                    yield self._result(name, where, future)
+                else:
+                    error = TimeoutError(f"no result from the process after {self.timeout:g} s")
+                    yield BackendResult(name, {}, error, self.timeout, 0.0, where)
+
+    @staticmethod
+    def _result(name: str, where: str, future: Future) -> BackendResult:
+        try:
+            texts, error, wall, cpu = future.result()
+        except Exception as e:  # the result could not be sent back from the process
+            texts, error, wall, cpu = None, e, 0.0, 0.0
+        if error is None and where == 'process':
+            texts = {"db_models.py": texts}
+        return BackendResult(name, texts or {}, error, wall, cpu, where)
+
+    def close(self):
+        self._threads.shutdown(wait=True)
+        if self._models_pool is not None:
+            if self._models_submitted and not self._timed_out:
+                self._models_pool.close()
+            else:
+                # not needed after all (the models were in the cache), or given up: no need to wait for it
+                self._models_pool.terminate()
+            self._models_pool.join()
+            self._models_pool = None
+
+    def __enter__(self) -> 'EmitScheduler':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
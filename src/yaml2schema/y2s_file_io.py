@@ -1,5 +1,13 @@
+import mmap
+import os
 import pathlib
-from typing import Tuple, List
+import re
+import tempfile
+from typing import Tuple, List, Dict, Union
+
+# a line that starts in the first column and is neither a comment nor a sequence item.
+# group(1) is the key if it is a `key:` line.
+_TOP_LEVEL_LINE = re.compile(rb'^(?!-(?:\s|$))(?:([^\s#:][^:\r\n]*):(?=\s|$)|[^\s#])', re.MULTILINE)
 
 
 def build_path(filename, directory='source') -> pathlib.Path:
@@ -7,6 +15,39 @@ def build_path(filename, directory='source') -> pathlib.Path:
     return root
 
 
+def write_if_changed(path: Union[str, pathlib.Path], text: str) -> bool:
+    """Writes `text` to the file `path` unless the file already holds exactly that text.
+
+    An unchanged file keeps its mtime, so the tools watching the outputs (pytest, bundlers, dev servers)
+    see no change. A changed file is written to a temporary file in the same directory and renamed over
+    the old one, so a reader never sees it half written.
+
+    Returns
+    -------
+        True if the file was written
+    """
+    path = pathlib.Path(path)
+    data = text.encode('utf-8')
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        mode = 0o644
+    else:
+        mode = stat.st_mode & 0o777
+        if stat.st_size == len(data) and path.read_bytes() == data:
+            return False
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.' + path.name + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_name, mode)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return True
+
+
 def readfile(filename: str, directory: str = 'source') -> Tuple[str, List[str]]:
     """Reads a file and outputs the text and an array of newline characters
     used at the end of each line.
@@ -31,3 +72,86 @@ def readfile(filename: str, directory: str = 'source') -> Tuple[str, List[str]]:
         text = ''.join(lines)  # list(f))
         n.extend(f.newlines)
     return text, n
+
+
+def _index_top_level(buffer) -> Dict[str, Tuple[int, int]]:
+    index: Dict[str, Tuple[int, int]] = {}
+    key, start = None, 0
+    for match in _TOP_LEVEL_LINE.finditer(buffer):
+        if key is not None:
+            index[key] = (start, match.start())
+        key = match.group(1)
+        if key is not None:
+            key = key.decode('utf-8').strip().strip('"\'')
+            start = match.start()
+    if key is not None:
+        index[key] = (start, len(buffer))
+    return index
+
+
+def index_top_level_keys(filename: str, directory: str = 'source') -> Dict[str, Tuple[int, int]]:
+    """Finds the byte range of every top level key of a yaml file, in one pass over the memory-mapped file.
+
+    A section starts at the line of its key and ends where the next line starting in the first column begins.
+    Comment lines and sequence items (`- `) in the first column do not end a section.
+
+    Parameters
+    ----------
+    filename : str
+    directory : str, optional
+        Directory of the file. The default is current directory.
+
+    Returns
+    -------
+        Dict of key name to (start, end) byte offsets
+    """
+    with build_path(filename, directory).open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return {}
+        with mm:
+            return _index_top_level(mm)
+
+
+def read_top_level_key(filename: str, key: str, directory: str = 'source') -> str:
+    """Reads only the section of a top level key of a yaml file, for example `db_schema` of anvil.yaml.
+    The file is memory-mapped, so the other sections are never copied into memory.
+
+    Parameters
+    ----------
+    filename : str
+    key : str
+        Top level key
+    directory : str, optional
+        Directory of the file. The default is current directory.
+
+    Returns
+    -------
+        Text of the section (starting with the key) or '' if the key is not in the file.
+    """
+    with build_path(filename, directory).open("rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return ''
+        with mm:
+            return _section(mm, key)
+
+
+def _section(buffer, key: str) -> str:
+    index = _index_top_level(buffer)
+    if key not in index:
+        return ''
+    start, end = index[key]
+    return bytes(buffer[start:end]).decode('utf-8').replace('\r\n', '\n').rstrip() + '\n'
+
+
+def top_level_key_text(text: str, key: str) -> str:
+    """`read_top_level_key` for yaml text that is already in memory.
+
+    Returns
+    -------
+        Text of the section (starting with the key) or '' if the key is not in the text.
+    """
+    return _section(text.encode('utf-8'), key)
@@ -0,0 +1,167 @@
+"""In-memory description of the database schema that every stage of the pipeline works on.
+
+The schema is built once, from anvil.yaml (see `y2s_to_openapi`) or from openapi.yaml (see `schema_from_openapi`),
+and strictyaml is only used to parse the input and to write the output.
+The attributes follow the openapi names of a property, so `Table.to_openapi` gives back the openapi `components`.
+"""
+from typing import Optional, Dict, List, Tuple
+
+REF_PREFIX = "#/components/schemas/"
+
+
+class Field:
+    """A column of a table, or the `items` of an array column, as described by openapi.
+
+    Attributes
+    ----------
+    name
+        Column name. `None` for the `items` of an array.
+    type
+        openapi `type`, for example `string` or `array`. `None` for a reference.
+    format
+        openapi `format`, for example `date-time`.
+    ref
+        Name of the referenced table (the last part of `$ref`).
+    items
+        The description of the elements if `type` is `array`.
+    nullable
+    description
+    """
+    __slots__ = ('name', 'type', 'format', 'ref', 'items', 'nullable', 'description')
+
+    def __init__(self, name: Optional[str] = None, type: Optional[str] = None, format: Optional[str] = None,
+                 ref: Optional[str] = None, items: Optional['Field'] = None, nullable: Optional[bool] = None,
+                 description: Optional[str] = None):
+        self.name = name
+        self.type = type
+        self.format = format
+        self.ref = ref
+        self.items = items
+        self.nullable = nullable
+        self.description = description
+
+    @classmethod
+    def from_openapi(cls, name: Optional[str], prop: Dict) -> 'Field':
+        """Builds the field from an openapi property such as `{'type': 'string', 'format': 'date-time'}`."""
+        ref = prop.get('$ref', None)
+        items = prop.get('items', None)
+        return cls(name=name,
+                   type=prop.get('type', None),
+                   format=prop.get('format', None),
+                   ref=ref.split('/')[-1] if ref is not None else None,
+                   items=cls.from_openapi(None, items) if items is not None else None,
+                   nullable=prop.get('nullable', None),
+                   description=prop.get('description', None))
+
+    def to_openapi(self) -> Dict:
+        """The openapi property of this field."""
+        prop = {}
+        if self.type is not None:
+            prop['type'] = self.type
+        if self.format is not None:
+            prop['format'] = self.format
+        if self.items is not None:
+            prop['items'] = self.items.to_openapi()
+        if self.ref is not None:
+            prop['$ref'] = REF_PREFIX + self.ref
+        if self.nullable is not None:
+            prop['nullable'] = self.nullable
+        if self.description is not None:
+            prop['description'] = self.description
+        return prop
+
+    def reference(self) -> Tuple[Optional[str], bool]:
+        """Returns the referenced table name (or None) and whether it is a list of references."""
+        if self.type is None:
+            return self.ref, False
+        if self.type == 'array' and self.items is not None and self.items.ref is not None:
+            return self.items.ref, True
+        return None, False
+
+
+class Reference:
+    """A column of `table` that points at rows of `target`."""
+    __slots__ = ('table', 'field', 'target', 'multiple')
+
+    def __init__(self, table: str, field: str, target: str, multiple: bool = False):
+        self.table = table
+        self.field = field
+        self.target = target
+        self.multiple = multiple
+
+    def __repr__(self):
+        return f"Reference({self.table}.{self.field} -> {self.target}{'[]' if self.multiple else ''})"
+
+
+class Table:
+    """A database table: its name, its fields in the order they are defined and the column names
+    of its extra indexes (`x-indexes` in openapi)."""
+    __slots__ = ('name', 'fields', 'indexes')
+
+    def __init__(self, name: str, fields: Optional[Dict[str, Field]] = None,
+                 indexes: Optional[List[List[str]]] = None):
+        self.name = name
+        self.fields: Dict[str, Field] = fields if fields is not None else {}
+        self.indexes: List[List[str]] = indexes if indexes is not None else []
+
+    def add(self, field: Field):
+        self.fields[field.name] = field
+
+    def references(self) -> List[Reference]:
+        """All the references to other tables (or to itself) made by the fields of this table."""
+        refs = []
+        for field in self.fields.values():
+            target, multiple = field.reference()
+            if target is not None:
+                refs.append(Reference(self.name, field.name, target, multiple))
+        return refs
+
+    def to_openapi(self) -> Dict:
+        table = {}
+        if self.indexes:
+            table['x-indexes'] = [list(index) for index in self.indexes]
+        table['properties'] = {name: field.to_openapi() for name, field in self.fields.items()}
+        return table
+
+
+class Schema:
+    """All the tables of the database, in the order they are defined."""
+    __slots__ = ('tables',)
+
+    def __init__(self, tables: Optional[Dict[str, Table]] = None):
+        self.tables: Dict[str, Table] = tables if tables is not None else {}
+
+    def add(self, table: Table):
+        self.tables[table.name] = table
+
+    def references(self) -> List[Reference]:
+        refs = []
+        for table in self.tables.values():
+            refs.extend(table.references())
+        return refs
+
+    def to_openapi(self) -> Dict:
+        """The openapi `components` of the schema, as plain dicts."""
+        return {'components': {'schemas': {name: table.to_openapi() for name, table in self.tables.items()}}}
+
+
+def schema_from_openapi(openapi_data: Dict) -> Schema:
+    """Builds the schema from the data of a parsed openapi yaml (the `components` part).
+
+    Parameters
+    ----------
+    openapi_data
+        Plain dict, for example `sy.YAML.data`, containing the key `components`.
+
+    Returns
+    -------
+        Schema
+    """
+    schema = Schema()
+    components = openapi_data.get('components', None) or {}
+    for table_name, table_data in (components.get('schemas', None) or {}).items():
+        table = Table(table_name, indexes=[list(index) for index in (table_data or {}).get('x-indexes', None) or []])
+        for field_name, prop in ((table_data or {}).get('properties', None) or {}).items():
+            table.add(Field.from_openapi(field_name, prop or {}))
+        schema.add(table)
+    return schema
@@ -0,0 +1,65 @@
+"""Parses the yaml text of anvil.yaml or openapi.yaml into plain dicts.
+
+Two loaders:
+    - `strict` (default): strictyaml validates the whole text against `anvil_yaml_schema` or `openapi_schema`.
+    - `fast`: PyYAML (with its C `libyaml` parser when available) loads the text and only the parts
+      yaml2schema uses are checked, see `check_anvil_data` and `check_openapi_data`.
+"""
+from typing import Dict
+
+import strictyaml as sy
+
+from y2s_schema import anvil_yaml_schema, openapi_schema, check_anvil_data, check_openapi_data
+
+LOADERS = ('strict', 'fast')
+
+FAST_LOADER = True
+try:
+    import yaml
+    YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+except ImportError:
+    FAST_LOADER = False
+
+
+def _fast_load(yaml_string: str):
+    if not FAST_LOADER:
+        raise ImportError("The `fast` loader needs PyYAML: pip install pyyaml")
+    return yaml.load(yaml_string, Loader=YamlLoader)
+
+
+def load_anvil(db_str: str, loader: str = 'strict') -> Dict:
+    """Parses the `db_schema` part of anvil.yaml.
+
+    Parameters
+    ----------
+    db_str
+        Text starting with `db_schema:`
+    loader
+        `strict` or `fast`
+
+    Returns
+    -------
+        Plain dict with the key `db_schema`
+    """
+    if loader == 'fast':
+        return check_anvil_data(_fast_load(db_str))
+    return sy.dirty_load(yaml_string=db_str, schema=anvil_yaml_schema(), allow_flow_style=True).data
+
+
+def load_openapi(db_str: str, loader: str = 'strict') -> Dict:
+    """Parses the `components` part of openapi.yaml or anvil_refined.yaml.
+
+    Parameters
+    ----------
+    db_str
+        Text starting with `components:`
+    loader
+        `strict` or `fast`
+
+    Returns
+    -------
+        Plain dict with the key `components`
+    """
+    if loader == 'fast':
+        return check_openapi_data(_fast_load(db_str))
+    return sy.dirty_load(yaml_string=db_str, schema=openapi_schema(), allow_flow_style=False).data
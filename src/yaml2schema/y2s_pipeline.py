@@ -0,0 +1,409 @@
+"""The pipeline that turns the input yaml of one app into the output files:
+read the db_schema section, parse it into the schema, reorder the tables and write each requested output."""
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+from contextlib import nullcontext
+from functools import partial, lru_cache
+from typing import Tuple, Iterable, Callable, Dict, Optional
+
+from y2s_cache import BuildCache, content_key, normalize_yaml_text, DEFAULT_CACHE_BYTES
+from y2s_constants import Openapi_preamble_yaml
+from y2s_emit import EmitScheduler, EmitError, render_models, available_cpus
+from y2s_file_io import read_top_level_key, write_if_changed
+from y2s_ir import Schema, schema_from_openapi
+from y2s_load import load_anvil, load_openapi
+from y2s_modify import update_field_type
+from y2s_profile import Profiler, NO_PROFILER
+from y2s_reorder import reorder_schema, reorder_tables
+from y2s_to_classes import schema_to_classes, table_to_class
+from y2s_to_fixtures import fixtures_module
+from y2s_to_openapi import convert_anvil_to_openapi, schema_to_openapi_yaml, table_to_openapi_yaml, \
+    schema_to_openapi_json
+from y2s_to_pydal import openapi_to_pydal, openapi_to_pydal_package, table_to_pydal, PydalOptions, DEFAULT_OPTIONS
+from y2s_to_sql import schema_to_sql, table_to_sql
+from y2s_types import TYPES, FieldType, classify_schema
+
+CACHE_DIR = ".yaml2schema_cache"
+# directory of the pyDAL definition with `split_tables`
+PYDAL_PACKAGE = "pydal_def"
+# output name (for --emit) : file written in the output directory
+OUTPUT_FILES = {'openapi': "anvil_openapi.yaml",
+                'openapi_json': "anvil_openapi.json",
+                'pydal': "pydal_def.py",
+                'models': "db_models.py",
+                'classes': "db_classes.py",
+                'sql': "schema.sql",
+                'fixtures': "db_fixtures.py"}
+# outputs generated when --emit is not given
+DEFAULT_EMIT = ('openapi', 'pydal', 'models')
+# the backends of `render_outputs`, each writing some of the outputs, also the names of their profiler spans
+BACKENDS = ('openapi', 'openapi_json', 'models', 'classes', 'pydal', 'sql')
+
+
+def class_models_available() -> bool:
+    """Can the class models be generated? Checks that datamodel-code-generator is installed, without importing it."""
+    return importlib.util.find_spec('datamodel_code_generator') is not None
+
+
+@lru_cache(maxsize=None)
+def models_generator_version() -> str:
+    """Version of the installed datamodel-code-generator, part of the cache keys of `db_models.py`, which it writes.
+    Empty if it is not installed."""
+    # imported only now: not needed without models
+    import importlib.metadata
+    try:
+        return importlib.metadata.version('datamodel-code-generator')
+    except importlib.metadata.PackageNotFoundError:
+        return ''
+
+
+def write_pydal(output_dir: str, text: str, pydal_options: PydalOptions) -> bool:
+    """Writes the pyDAL definition: `pydal_def.py`, or with `split_tables` the package `pydal_def/`
+    (then `text` is the json of its files, see `y2s_to_pydal.openapi_to_pydal_package`).
+    The other layout, left by an earlier run, is removed, so `import pydal_def` finds the new one.
+    So are the modules of the tables that are gone. Returns True if a file changed."""
+    package = pathlib.Path(output_dir) / PYDAL_PACKAGE
+    single = pathlib.Path(output_dir) / "pydal_def.py"
+    if pydal_options.split_tables:
+        files = json.loads(text)
+        package.mkdir(exist_ok=True)
+        changed = False
+        for path in package.glob("table_*.py"):
+            if path.name not in files:
+                path.unlink()
+                changed = True
+        for name, file_text in files.items():
+            changed = write_if_changed(package / name, file_text) or changed
+        if single.exists():
+            single.unlink()
+            changed = True
+        return changed
+    changed = False
+    if (package / "__init__.py").exists():
+        shutil.rmtree(package)
+        changed = True
+    return write_if_changed(single, text) or changed
+
+
+class NoTablesError(Exception):
+    """The input files describe no database tables: there is nothing to generate. Not a failure,
+    `main.py` exits with 0."""
+
+
+def read_sections(input_dir: str) -> Tuple[str, str, str]:
+    """Reads the parts of the input files that describe the database.
+
+    Returns
+    -------
+    source
+        'anvil' or 'openapi', the kind of input file that was found
+    db_str
+        `db_schema` section of anvil.yaml or `components` section of openapi.yaml
+    refined_str
+        `components` section of anvil_refined.yaml, '' if there is none
+
+    Raises
+    ------
+    NoTablesError
+        if neither anvil.yaml nor user.yaml has database tables
+    """
+    refined_str = ''
+    try:
+        # if there is anvil.yaml, converts to openapi.yaml
+        db_str = read_top_level_key(input_dir + "anvil.yaml", 'db_schema', "")
+        if '{}' in db_str and len(db_str)<20:
+            print("!!!!!!!!!!!No database tables in anvil.yaml!!!!!!!!!!!")
+            try:
+                db_str = read_top_level_key(input_dir+"user.yaml", 'db_schema', "")
+            except FileNotFoundError:
+                db_str = ""
+            if len(db_str)<20:
+                raise NoTablesError("No database tables in anvil.yaml nor in user.yaml.")
+        # is there more to add in anvil_refined.yaml?
+        try:
+            refined_str = read_top_level_key(input_dir + "anvil_refined.yaml", 'components', "")
+        except FileNotFoundError:
+            pass
+        return 'anvil', db_str, refined_str
+    except FileNotFoundError:
+        # if no anvil.yaml, read in the openapi.yaml
+        return 'openapi', read_top_level_key(input_dir + "openapi.yaml", 'components', ""), refined_str
+
+
+def parse_schema(source: str, db_str: str, refined_str: str, loader: str = 'strict') -> Schema:
+    """Parses the sections returned by `read_sections` into the openapi description of the schema."""
+    if source == 'openapi':
+        return schema_from_openapi(load_openapi(db_str, loader))
+    # convert to the OPENAPI description of the schema
+    schema = convert_anvil_to_openapi(load_anvil(db_str, loader))
+    if refined_str:
+        update_field_type(schema, schema_from_openapi(load_openapi(refined_str, loader)))
+    return schema
+
+
+def check_emit(emit: Iterable[str], pydal_options: PydalOptions):
+    """Raises ValueError for an unknown output name or outputs that do not go with the options."""
+    for name in emit:
+        if name not in OUTPUT_FILES:
+            raise ValueError(f"Unknown output `{name}`, expected some of {', '.join(OUTPUT_FILES)}.")
+    if 'fixtures' in emit and pydal_options.dialect != 'sqlite':
+        raise ValueError("The test fixtures are sqlite databases, they need the dialect `sqlite`.")
+
+
+def render_outputs(source: str, db_str: str, refined_str: str, emit: Iterable[str] = DEFAULT_EMIT,
+                   loader: str = 'strict', profiler: Profiler = NO_PROFILER,
+                   parse: Callable[[str, str, str, str], Schema] = parse_schema,
+                   pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass',
+                   cache: Optional[BuildCache] = None, models_filename: str = "anvil.yaml",
+                   on_output: Optional[Callable[[str, str], None]] = None,
+                   concurrent: bool = False) -> Dict[str, str]:
+    """Generates the text of the requested outputs from the sections of `read_sections`, in memory.
+
+    Parameters
+    ----------
+    source, db_str, refined_str
+        As returned by `read_sections`
+    emit
+        Names of the outputs to generate, keys of `OUTPUT_FILES`
+    loader, profiler, parse, pydal_options, class_style
+        See `generate`
+    cache
+        Cache of the table fragments and of the class models, None to render everything
+    models_filename
+        Input file named in the header of `db_models.py`
+    on_output
+        Called with the file name and the text of each output as soon as it is ready
+    concurrent
+        Run the backends of the outputs at the same time, datamodel-code-generator in a process of its own,
+        see `y2s_emit`. Otherwise they run one after the other in this thread. Ignored on a single core, where
+        it gains nothing, and when the `cprofile_stage` of `profiler` is one of `BACKENDS`, which cProfile can
+        only follow in this thread.
+
+    Returns
+    -------
+        Text of each output by file name (see `OUTPUT_FILES`). With `split_tables`, the text of `pydal_def.py`
+        is the json of the files of the package, see `y2s_to_pydal.openapi_to_pydal_package`.
+
+    Raises
+    ------
+    EmitError
+        With `concurrent`, once all the backends finished, if some failed
+    """
+    emit = set(emit)
+    check_emit(emit, pydal_options)
+    if concurrent and (available_cpus() < 2 or profiler.enabled and profiler.cprofile_stage in BACKENDS):
+        concurrent = False
+    field_types: Dict[str, Dict[str, FieldType]] = {}
+
+    def with_types(render):
+        # the renderers get the column types of `classify_schema`, worked out once
+        return lambda table_name, table: render(table_name, table, field_types=field_types[table_name])
+
+    render_table_pydal = with_types(partial(table_to_pydal, options=pydal_options))
+    render_table_sql = with_types(partial(table_to_sql, options=pydal_options))
+    render_table_class = with_types(partial(table_to_class, style=class_style))
+    if cache is not None:
+        # the column types depend on the registered formats too
+        types_key = TYPES.key()
+        render_openapi = cache.memo_table('openapi', table_to_openapi_yaml, types_key)
+        render_pydal = cache.memo_table('pydal', render_table_pydal, pydal_options.table_key() + types_key)
+        render_sql = cache.memo_table('sql', render_table_sql, pydal_options.key() + types_key)
+        render_class = cache.memo_table('classes', render_table_class, class_style + types_key)
+    else:
+        render_openapi, render_pydal, render_sql = table_to_openapi_yaml, render_table_pydal, render_table_sql
+        render_class = render_table_class
+
+    texts = {}
+
+    def add(name: str, text: str):
+        texts[name] = text
+        if on_output is not None:
+            on_output(name, text)
+
+    with (EmitScheduler() if concurrent else nullcontext()) as scheduler:
+        if scheduler is not None and 'models' in emit:
+            # datamodel-code-generator loads its modules in its own process while the schema is parsed
+            scheduler.start_models_process()
+        with profiler.span('parse'):
+            schema = parse(source, db_str, refined_str, loader)
+            profiler.count('tables', len(schema.tables))
+            profiler.count('fields', sum(len(table.fields) for table in schema.tables.values()))
+        with profiler.span('classify'):
+            # the type of every column, used by all the stages below
+            field_types.update(classify_schema(schema))
+        with profiler.span('reorder'):
+            # reorder so that no table is referenced before it is defined
+            ordered_schema = reorder_schema(schema, reorder_tables(schema, field_types))
+            profiler.count('references', len(ordered_schema.references()))
+        if 'openapi' in emit or 'models' in emit:
+            with profiler.span('openapi_components'):
+                openapi_yaml = schema_to_openapi_yaml(ordered_schema, render_openapi)
+
+        if 'models' in emit:
+            models_key = content_key('models', models_generator_version(), 'disable_timestamp', models_filename,
+                                     openapi_yaml)
+
+        def render_models_file() -> Dict[str, str]:
+            models = cache.get(models_key) if cache is not None else None
+            if models is None:
+                models = render_models(openapi_yaml, models_filename)
+                if cache is not None:
+                    cache.put(models_key, models)
+            return {"db_models.py": models}
+
+        def render_classes_file() -> Dict[str, str]:
+            # the same models as datamodel-code-generator, as dataclasses or msgspec Structs
+            return {"db_classes.py": '\n'.join(schema_to_classes(ordered_schema, render_class, class_style))}
+
+        def render_pydal_file() -> Dict[str, str]:
+            # generate the pyDAL schema definitions
+            if pydal_options.split_tables:
+                files = openapi_to_pydal_package(ordered_schema, render_pydal, pydal_options, field_types)
+                return {"pydal_def.py": json.dumps(files)}
+            return {"pydal_def.py": '\n'.join(openapi_to_pydal(ordered_schema, render_pydal, pydal_options,
+                                                               field_types))}
+
+        def render_sql_files() -> Dict[str, str]:
+            # the script creating the same tables without pyDAL, and pytest fixtures copying a database made with it
+            schema_sql = schema_to_sql(ordered_schema, render_sql, pydal_options)
+            files = {"schema.sql": '\n'.join(schema_sql) + '\n'} if 'sql' in emit else {}
+            if 'fixtures' in emit:
+                files["db_fixtures.py"] = fixtures_module(schema_sql)
+            return files
+
+        # the backends by name, each gives the text of its outputs by file name
+        backends: Dict[str, Callable[[], Dict[str, str]]] = {}
+        if 'openapi' in emit:
+            # the preamble, then the components
+            backends['openapi'] = lambda: {"anvil_openapi.yaml": Openapi_preamble_yaml + openapi_yaml}
+        if 'openapi_json' in emit:
+            backends['openapi_json'] = lambda: {"anvil_openapi.json": schema_to_openapi_json(ordered_schema)}
+        if 'models' in emit:
+            backends['models'] = render_models_file
+        if 'classes' in emit:
+            backends['classes'] = render_classes_file
+        if 'pydal' in emit:
+            backends['pydal'] = render_pydal_file
+        if 'sql' in emit or 'fixtures' in emit:
+            backends['sql'] = render_sql_files
+        if scheduler is None:
+            for name, render in backends.items():
+                with profiler.span(name):
+                    for file_name, text in render().items():
+                        add(file_name, text)
+        else:
+            if backends.pop('models', None) is not None:
+                models = cache.get(models_key) if cache is not None else None
+                if models is not None:
+                    add("db_models.py", models)
+                else:
+                    scheduler.submit_models(openapi_yaml, models_filename)
+            for name, render in backends.items():
+                scheduler.submit(name, render)
+            errors = {}
+            with profiler.span('emit'):
+                for result in scheduler.results():
+                    profiler.add_span(result.name, result.wall, result.cpu, where=result.where,
+                                      error=None if result.error is None else repr(result.error))
+                    if result.error is not None:
+                        errors[result.name] = result.error
+                        continue
+                    if result.name == 'models' and cache is not None:
+                        cache.put(models_key, result.texts["db_models.py"])
+                    for file_name, text in result.texts.items():
+                        add(file_name, text)
+            if errors:
+                raise EmitError(errors) from next(iter(errors.values()))
+        # in the order of OUTPUT_FILES, whatever order the backends finished in
+        return {file_name: texts[file_name] for file_name in OUTPUT_FILES.values() if file_name in texts}
+
+
+def generate(input_dir: str, output_dir: str, loader: str = 'strict', use_cache: bool = True,
+             cache_size: int = DEFAULT_CACHE_BYTES, emit: Iterable[str] = DEFAULT_EMIT,
+             profiler: Profiler = NO_PROFILER,
+             parse: Callable[[str, str, str, str], Schema] = parse_schema,
+             pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass',
+             concurrent: bool = False) -> bool:
+    """Reads anvil.yaml (and anvil_refined.yaml) or openapi.yaml from `input_dir` and writes
+    the requested outputs into `output_dir`.
+
+    Parameters
+    ----------
+    input_dir
+        Directory of the input yaml files
+    output_dir
+        Directory of the generated files. Created if needed.
+    loader
+        `strict` or `fast`, see `y2s_load`
+    use_cache
+        Reuse the outputs of unchanged tables, see `y2s_cache`
+    cache_size
+        Size limit in bytes of the cache directory
+    emit
+        Names of the outputs to generate, keys of `OUTPUT_FILES`
+    profiler
+        Records a span for every stage, see `y2s_profile`
+    parse
+        Function turning the sections of `read_sections` into the schema, `parse_schema` by default
+    pydal_options
+        Dialect, indexes, junction tables and connection settings of the pyDAL definition,
+        see `y2s_to_pydal.PydalOptions`
+    class_style
+        `dataclass` or `msgspec`, the classes of `db_classes.py`, see `y2s_to_classes`
+    concurrent
+        Run the backends of the outputs at the same time, see `render_outputs`
+
+    Returns
+    -------
+        True when done
+    """
+    def write_output(name: str, text: str):
+        # only the files whose text changed are written, see `write_if_changed`
+        if name == "pydal_def.py":
+            written = write_pydal(output_dir, text, pydal_options)
+        else:
+            written = write_if_changed(output_dir + name, text)
+        if written:
+            profiler.count('files_written', 1)
+            profiler.count('bytes_written', len(text.encode('utf-8')))
+        else:
+            profiler.count('files_unchanged', 1)
+
+    input_dir = os.path.join(input_dir, '')
+    output_dir = os.path.join(output_dir, '')
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+    emit = set(emit)
+    check_emit(emit, pydal_options)
+    if 'models' in emit and not class_models_available():
+        print("Not generating class models.")
+        emit.discard('models')
+    with profiler.span('read'):
+        source, db_str, refined_str = read_sections(input_dir)
+        profiler.count('bytes_read', len(db_str.encode('utf-8')) + len(refined_str.encode('utf-8')))
+    outputs = [OUTPUT_FILES[name] for name in OUTPUT_FILES if name in emit]
+    # the models change with the version of datamodel-code-generator too
+    versions = {name: models_generator_version() if name == OUTPUT_FILES['models'] else '' for name in outputs}
+    cache = BuildCache(output_dir + CACHE_DIR, cache_size) if use_cache else None
+    if cache is not None:
+        with profiler.span('cache_lookup'):
+            # nothing changed since the last run? Then the outputs are in the cache.
+            build_key = content_key(source, normalize_yaml_text(db_str), normalize_yaml_text(refined_str),
+                                    pydal_options.key(), class_style, TYPES.key())
+            cached = {name: cache.get(content_key(build_key, name, versions[name])) for name in outputs}
+        if all(text is not None for text in cached.values()):
+            with profiler.span('write_cached'):
+                for name, text in cached.items():
+                    write_output(name, text)
+            return True
+    texts = render_outputs(source, db_str, refined_str, emit, loader=loader, profiler=profiler, parse=parse,
+                           pydal_options=pydal_options, class_style=class_style, cache=cache,
+                           models_filename=input_dir + "anvil.yaml", on_output=write_output, concurrent=concurrent)
+    if cache is not None:
+        with profiler.span('cache_store'):
+            for name, text in texts.items():
+                cache.put(content_key(build_key, name, versions[name]), text)
+            cache.evict()
+    return True
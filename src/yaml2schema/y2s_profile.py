@@ -0,0 +1,144 @@
+"""Named spans around the stages of the pipeline, recording where the time and memory go.
+
+Each span records wall time, cpu time, peak traced memory (if `trace_memory`) and counters
+such as the number of tables or the bytes written. Finished spans are passed to the hooks::
+
+    import y2s_profile
+    y2s_profile.add_hook(lambda span: send_to_dashboard(span))
+
+and `Profiler.report()` gives all of them as a json serializable dict (what `--profile out.json` writes).
+"""
+import cProfile
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# functions called with the dict of every finished span, by every profiler
+HOOKS: List[Callable[[Dict], None]] = []
+
+
+def add_hook(hook: Callable[[Dict], None]):
+    HOOKS.append(hook)
+
+
+def remove_hook(hook: Callable[[Dict], None]):
+    HOOKS.remove(hook)
+
+
+class Profiler:
+    """Records spans. A disabled profiler (the default in the pipeline) does nothing.
+
+    Parameters
+    ----------
+    enabled
+        When False, `span` and `count` do nothing.
+    trace_memory
+        Record the peak of the memory allocated by python in each span, with tracemalloc. Slows things down.
+    cprofile_stage
+        Name of a span to run under cProfile.
+    cprofile_out
+        File for the cProfile stats of `cprofile_stage`, readable with `pstats`.
+    hooks
+        Functions called with each finished span, on top of the module `HOOKS`.
+    """
+
+    def __init__(self, enabled: bool = True, trace_memory: bool = False, cprofile_stage: Optional[str] = None,
+                 cprofile_out: Optional[str] = None, hooks: Optional[List[Callable[[Dict], None]]] = None):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_out = cprofile_out
+        self.hooks = list(hooks) if hooks else []
+        self.spans: List[Dict] = []
+        self._stack: List[Dict] = []
+        self._started_tracing = False
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **counters):
+        """Context manager around one stage. `counters` are added to the counters of the span."""
+        if not self.enabled:
+            yield
+            return
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        record = {'name': name, 'depth': len(self._stack), 'counters': dict(counters)}
+        if self.trace_memory:
+            if self._stack:  # keep the peak of the enclosing span before resetting it
+                self._stack[-1]['peak_memory'] = max(self._stack[-1]['peak_memory'],
+                                                     tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            # peak_memory - memory_start is what the span itself allocated at most
+            record['memory_start'] = tracemalloc.get_traced_memory()[0]
+            record['peak_memory'] = 0
+        self._stack.append(record)
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        record['start'] = wall - self._t0
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                if self.cprofile_out:
+                    profile.dump_stats(self.cprofile_out)
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            self._stack.pop()
+            if self.trace_memory:
+                record['peak_memory'] = max(record['peak_memory'], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]['peak_memory'] = max(self._stack[-1]['peak_memory'], record['peak_memory'])
+            self.spans.append(record)
+            for hook in HOOKS + self.hooks:
+                hook(record)
+
+    def add_span(self, name: str, wall: float, cpu: float, **fields):
+        """Records a span measured elsewhere (in another thread or process) as a child of the current span.
+        `fields`, such as where it ran, are added to its record."""
+        if not self.enabled:
+            return
+        record = {'name': name, 'depth': len(self._stack), 'counters': {},
+                  'start': time.perf_counter() - wall - self._t0, 'wall': wall, 'cpu': cpu}
+        record.update(fields)
+        self.spans.append(record)
+        for hook in HOOKS + self.hooks:
+            hook(record)
+
+    def count(self, name: str, value: int = 1):
+        """Adds `value` to the counter `name` of the current span."""
+        if not self.enabled or not self._stack:
+            return
+        counters = self._stack[-1]['counters']
+        counters[name] = counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        """All finished spans, in the order they started, and the totals of the counters."""
+        totals: Dict[str, int] = {}
+        for record in self.spans:
+            for name, value in record['counters'].items():
+                totals[name] = totals.get(name, 0) + value
+        report = {'spans': sorted(self.spans, key=lambda record: record['start']), 'counters': totals}
+        if self.trace_memory:
+            report['peak_memory_scope'] = "python allocations of this process only, not of the process of " \
+                                          "datamodel-code-generator (the span with where: process)"
+        return report
+
+    def write(self, filename: str):
+        """Writes `report()` as json."""
+        with open(filename, "w") as f_out:
+            json.dump(self.report(), f_out, indent=2)
+            f_out.write('\n')
+
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+
+NO_PROFILER = Profiler(enabled=False)
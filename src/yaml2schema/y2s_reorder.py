@@ -1,10 +1,8 @@
-from typing import Optional, Dict, List, Tuple
+import heapq
+from typing import Optional, Dict, List, Tuple, Sequence, Iterable
 
-import strictyaml as sy
-from collections import OrderedDict
-
-from y2s_constants import OPENAPI_FORMATS
-from y2s_schema import openapi_schema
+from y2s_ir import Schema, Field
+from y2s_types import TYPES, FieldType, classify_schema
 
 
 def key_of_value(dict_: Dict, value) -> str:
@@ -13,69 +11,177 @@ def key_of_value(dict_: Dict, value) -> str:
     return next((k for k, v in dict_.items() if v == value), None)
 
 
-def find_type_of_string(sy_dict: sy.YAML) -> str:
+def find_type_of_string(db_field: Field) -> str:
     """Finds the type of the field aka column from the openapi yaml format.
     In openyaml, types like datetime are `format` of `string`.
 
     Parameters
     ----------
-    sy_dict
-        The dict containing the keys `type` and `format`
+    db_field
+        The field with the attributes `type` and `format`
 
     Returns
     -------
         The string type, from the format key.
     """
-    format_ = sy_dict.get('format', None)
-    if format_ is not None:
-        type_of = key_of_value(OPENAPI_FORMATS, format_.text)
-        if type_of == 'media':
-            type_of = 'blob'
-    else:
-        type_of = sy_dict['type'].text
-    return type_of
-
-
-def yaml_recursive_add_to_table(
-        tables_in_order: List[str],
-        table_name: str,
-        do_later: List[Dict]):
-    """Recursive function to move do_later tables to the tables_in_order list. Of course it only does this
-    if the do_later table has all its references previously inserted into tables_in_order.
+    return TYPES.type_of_string(db_field)
+
+
+class ReferenceCycleError(ValueError):
+    """Raised when the tables cannot be ordered so that every table is defined before it is referenced.
+
+    Attributes
+    ----------
+    cycles
+        Each entry is a list of table names that reference each other in a loop.
+    missing
+        Maps a table name to the names of the tables it references that do not exist.
+    """
+
+    def __init__(self, cycles: List[List[str]], missing: Dict[str, List[str]]):
+        self.cycles = cycles
+        self.missing = missing
+        problems = []
+        for cycle in cycles:
+            problems.append("tables reference each other in a cycle: " + " -> ".join(cycle + cycle[:1]))
+        for table_name, targets in missing.items():
+            problems.append(f"table `{table_name}` references undefined table(s): " + ", ".join(targets))
+        super().__init__("Cannot order the tables, " + "; ".join(problems))
+
+
+def strongly_connected(members: List[int], adjacency: List[List[int]]) -> List[List[int]]:
+    """Iterative Tarjan's algorithm restricted to `members`. Returns the components with more than one table.
 
     Parameters
     ----------
-    tables_in_order
-        list of table names that are already ordered
-    table_name
-        the current table name
-    do_later
-        A list of dicts containing information about tables that cannot be added to
-        new yaml because they have references that are not in new yaml
+    members
+        Indexes of the tables to look at, in the original order of the tables.
+    adjacency
+        For each table index, the indexes of the tables it references.
+
+    Returns
+    -------
+        List of components, each a list of table indexes in the original order.
+    """
+    in_members = set(members)
+    index_of: Dict[int, int] = {}
+    low: Dict[int, int] = {}
+    stack: List[int] = []
+    on_stack = set()
+    components = []
+    counter = 0
+    for root in members:
+        if root in index_of:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child_ix = work.pop()
+            if child_ix == 0:
+                index_of[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack.add(node)
+            recurse = False
+            children = adjacency[node]
+            while child_ix < len(children):
+                child = children[child_ix]
+                child_ix += 1
+                if child not in in_members:
+                    continue
+                if child not in index_of:
+                    work.append((node, child_ix))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index_of[child])
+            if recurse:
+                continue
+            if low[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    components.append(sorted(component))
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+    return components
+
+
+def dependency_order(table_names: Sequence[str], references: Sequence[Iterable[str]]) -> List[int]:
+    """Orders tables so that every table comes after the tables it references.
+
+    Kahn's algorithm on an adjacency index with in-degree counting, O(tables + references).
+    When several tables are ready, the one that appears first in `table_names` is taken, which keeps
+    the original order for tables that do not need to move.
+    Self references are ignored, since a table can always refer to itself.
+
+    Parameters
+    ----------
+    table_names
+        Names of the tables in their original order.
+    references
+        For each table, the names of the tables it references.
 
     Returns
     -------
-    None
+        Indexes into `table_names` in dependency order.
+
+    Raises
+    ------
+    ReferenceCycleError
+        If some tables reference each other in a cycle or reference tables that do not exist.
     """
-    tables_in_order.append(table_name)
-    for ix, doing_now in enumerate(do_later):
-        if all([ref_name in tables_in_order for ref_name in doing_now['references']]):
-            # need to nullify this table, so it is not repeatedly added to file_lines
-            do_later[ix]['references'] = ['This is a dummy table name.']
-            yaml_recursive_add_to_table(
-                tables_in_order,
-                doing_now['table_name'],
-                do_later)
-    return
-
-
-def extract_type_of_field(db_field: sy.YAML) -> Tuple[str, str]:
+    position = {name: ix for ix, name in enumerate(table_names)}
+    # dependants[ix] are the tables that reference table ix
+    dependants: List[List[int]] = [[] for _ in table_names]
+    adjacency: List[List[int]] = [[] for _ in table_names]
+    in_degree = [0] * len(table_names)
+    missing: Dict[str, List[str]] = {}
+    for ix, table_refs in enumerate(references):
+        for ref_name in table_refs:
+            ref_ix = position.get(ref_name)
+            if ref_ix is None:
+                missing.setdefault(table_names[ix], [])
+                if ref_name not in missing[table_names[ix]]:
+                    missing[table_names[ix]].append(ref_name)
+                continue
+            if ref_ix == ix or ref_ix in adjacency[ix]:
+                continue
+            adjacency[ix].append(ref_ix)
+            dependants[ref_ix].append(ix)
+            in_degree[ix] += 1
+    ready = [ix for ix, degree in enumerate(in_degree) if degree == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        ix = heapq.heappop(ready)
+        order.append(ix)
+        for dependant in dependants[ix]:
+            in_degree[dependant] -= 1
+            if in_degree[dependant] == 0:
+                heapq.heappush(ready, dependant)
+    if len(order) < len(table_names) or missing:
+        left_over = [ix for ix, degree in enumerate(in_degree) if degree > 0]
+        cycles = [[table_names[ix] for ix in component]
+                  for component in strongly_connected(left_over, adjacency)]
+        raise ReferenceCycleError(cycles, missing)
+    return order
+
+
+def extract_type_of_field(db_field: Field) -> Tuple[str, str]:
     """Extracts type of field aka column in db. If type is a reference, output that too.
+    The stages that look at every column use the classification of `y2s_types.classify_schema` instead.
 
     Parameters
     ----------
     db_field
-        Attributes snippet of the yaml file for the field.
+        The field as described in the openapi format.
 
     Returns
     -------
@@ -84,109 +190,53 @@ def extract_type_of_field(db_field: sy.YAML) -> Tuple[str, str]:
     reference:
         table name if the type is a reference to another table
     """
-    type_of = ''
-    reference: Optional[str] = None  # one of the outputs
-    # Let's find out what type of field it is
-    what_is_it = db_field.get('type', None)
-    if what_is_it is None:
-        # must be a reference to another table
-        if '$ref' in db_field:
-            reference = db_field["$ref"].text.split('/')[-1]
-            type_of = f"reference {reference}"
-    elif what_is_it.text == 'array':
-        # list of references to other tables
-        if '$ref' in db_field['items']:
-            reference = db_field['items']['$ref'].text.split('/')[-1]
-            type_of = f"list:reference {reference}"
-        elif 'type' in db_field['items']:
-            if db_field['items']['type'] == 'integer':
-                type_of = "list:integer"
-            elif db_field['items']['type'] == 'string':
-                type_of = "list:string"
-            else:
-                type_of = "INVALID"
-        else:
-            type_of = find_type_of_string(db_field['items'])
-    elif what_is_it.text == 'object':
-        type_of = "json"
-    elif what_is_it.text == 'number':
-        type_of = 'double'
-        if db_field.get('format',None) is not None:
-            if db_field['format'].text != 'float':
-                raise TypeError("'number' type with incorrect format field. Fix anvil_refined.yaml and rerun. Thanks!")
-    else:
-        type_of = find_type_of_string(db_field)
-    return type_of, reference
-
-
-def reorder_tables(openapi_yaml: sy.YAML) -> List[sy.Str]:
+    return TYPES.classify(db_field)
+
+
+def reorder_tables(schema: Schema, field_types: Optional[Dict[str, Dict[str, FieldType]]] = None) -> List[str]:
     """Orders the tables so no table references another table that might be defined after.
 
     Parameters
     ----------
-    openapi_yaml
+    schema
         Contains the openapi format describing the database schema
+    field_types
+        The column types of the schema from `y2s_types.classify_schema`, worked out here if not given
     Returns
     -------
     tables_in_order
-        A list of sy.Str of the table names in order
+        A list of the table names in order
+
+    Raises
+    ------
+    ReferenceCycleError
+        If the tables reference each other in a cycle or reference a table that is not defined.
     """
-    openapi = openapi_yaml['components']
-    # list of table names already processed
-    # Needed to re-order so that tables are not referenced before defined
-    # a list of table names in correct order
-    tables_in_order = []
-    # a list of dicts for the tables that need to added after their references are in tables_in_order
-    do_later = []
-    for table in openapi['schemas']:
-        # add fields
-        table_yaml = openapi['schemas'][table]['properties']
-        # for ordering
-        table_references = []
-        try:
-            t=iter(table_yaml)
-        except TypeError:
-            raise TypeError(f"There is no columns in the datatable `{table.text}`")
-        for field_name in table_yaml:
-            # dict of this table description
-            db_field = table_yaml[field_name]
-            # Let's find out what type of field it is
-            type_of, reference = extract_type_of_field(db_field)
-            # if self referencing, ignore when re-ordering
-            if reference is not None and reference != table.text:
-                table_references.append(reference)
-        # check if all the references are already in the list, if so, we can add this one too.
-        if len(table_references) == 0 \
-                or all([_t in tables_in_order for _t in table_references]):
-            yaml_recursive_add_to_table(tables_in_order, table, do_later)
-        else:
-            do_later.append({'references': table_references,
-                             'table_name': table})
-    return tables_in_order
-
-
-def reorder_openapi_yaml(openapi_yaml: sy.YAML, tables_in_order: List[sy.Str]) -> sy.YAML:
+    if field_types is None:
+        field_types = classify_schema(schema)
+    table_names = list(schema.tables)
+    table_references = [[field_type.reference for field_type in field_types[table_name].values()
+                         if field_type.reference is not None]
+                        for table_name in table_names]
+    order = dependency_order(table_names, table_references)
+    return [table_names[ix] for ix in order]
+
+
+def reorder_schema(schema: Schema, tables_in_order: List[str]) -> Schema:
     """Inputs an openapi description of database schema and outputs the same but reordered
     so no tables references a table that is defined later in the yaml description.
 
     Parameters
     ----------
-    openapi_yaml
-        unordered openapi yaml where tables could be referencing other tables that appear
-        later in the yaml definition
+    schema
+        unordered schema where tables could be referencing other tables that appear
+        later in the definition
     tables_in_order
         list of the tables in proper order
 
     Returns
     -------
-        openapi yaml so that the tables are all in proper order.
+        schema so that the tables are all in proper order.
 
     """
-    open_yaml_data = openapi_yaml.data
-    new_yaml = openapi_yaml.data
-
-    new_yaml['components']['schemas'] = OrderedDict()
-    for _t in tables_in_order:
-        tablename = _t.text
-        new_yaml['components']['schemas'][tablename] = open_yaml_data['components']['schemas'][tablename]
-    return sy.as_document(new_yaml, openapi_schema())
+    return Schema({table_name: schema.tables[table_name] for table_name in tables_in_order})
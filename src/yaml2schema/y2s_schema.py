@@ -1,19 +1,20 @@
 import strictyaml as sy
 
-from y2s_constants import OPENAPI_TYPES, OPENAPI_FORMATS
+from y2s_constants import OPENAPI_TYPES
+from y2s_types import TYPES
 
 
 def openapi_schema() -> sy.Map:
     """Schema of openapi in the strictyaml format."""
     string_schema = sy.Map({
         sy.Optional("type"): sy.Enum(OPENAPI_TYPES.values()),
-        sy.Optional("format"): sy.Enum(OPENAPI_FORMATS.values()),
+        sy.Optional("format"): sy.Enum(TYPES.known_formats()),
         sy.Optional("$ref"): sy.Str()
     })
 
     type_schema = sy.Map({
         sy.Optional("type"): sy.Enum(OPENAPI_TYPES.values()),
-        sy.Optional("format"): sy.Enum(OPENAPI_FORMATS.values()),
+        sy.Optional("format"): sy.Enum(TYPES.known_formats()),
         sy.Optional("items"): string_schema,
         sy.Optional("$ref"): sy.Str(),
         sy.Optional('nullable'): sy.Bool(),
@@ -23,6 +24,8 @@ def openapi_schema() -> sy.Map:
         'schemas': sy.EmptyDict() | sy.MapPattern(
             sy.Str(), sy.Map({
                 sy.Optional('required'): sy.EmptyDict() | sy.Seq(sy.Str()),  # FUTURE : not implemented
+                # database indexes, each a column name or comma separated column names
+                sy.Optional('x-indexes'): sy.Seq(sy.CommaSeparated(sy.Str())),
                 sy.Optional('properties'): sy.EmptyDict() | sy.MapPattern(
                     sy.Str(), type_schema
                 )
@@ -89,3 +92,107 @@ def anvil_yaml_schema() -> sy.MapPattern:
     # schema used by strictyaml to parse the text
     schema = sy.MapPattern(sy.Str(), sy.Any())
     return schema
+
+
+def _check_map(data, where: str) -> dict:
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected a mapping at `{where}`, found {type(data).__name__}.")
+    return data
+
+
+def _check_str(data, where: str) -> str:
+    if not isinstance(data, str):
+        raise ValueError(f"Expected a string at `{where}`, found {data!r}.")
+    return data
+
+
+def check_anvil_data(data) -> dict:
+    """Checks only the parts of a (non strictyaml) parsed anvil.yaml that are used:
+    the table names and the `name`, `type` and `target` of the columns.
+
+    Parameters
+    ----------
+    data
+        Parsed anvil.yaml containing the key `db_schema`
+
+    Returns
+    -------
+        The same data
+
+    Raises
+    ------
+    ValueError
+        If a part that is used is missing or of the wrong type.
+    """
+    db_schema = _check_map(_check_map(data, '')['db_schema'], 'db_schema')
+    for table_name, table in db_schema.items():
+        where = f"db_schema.{_check_str(table_name, 'db_schema')}"
+        columns = _check_map(table, where).get('columns', None)
+        if not isinstance(columns, list):
+            raise ValueError(f"Expected a list at `{where}.columns`.")
+        for ix, col in enumerate(columns):
+            col = _check_map(col, f"{where}.columns[{ix}]")
+            _check_str(col.get('name', None), f"{where}.columns[{ix}].name")
+            _check_str(col.get('type', None), f"{where}.columns[{ix}].type")
+            if col['type'] in ('link_single', 'link_multiple'):
+                _check_str(col.get('target', None), f"{where}.columns[{ix}].target")
+    return data
+
+
+def _check_property(prop, where: str, keys) -> dict:
+    prop = _check_map(prop, where)
+    for key, value in prop.items():
+        if key not in keys:
+            raise ValueError(f"Unexpected key `{key}` at `{where}`.")
+        if key == 'type' and value not in OPENAPI_TYPES.values():
+            raise ValueError(f"Unknown type `{value}` at `{where}`.")
+        if key == 'format' and value not in TYPES.known_formats():
+            raise ValueError(f"Unknown format `{value}` at `{where}`.")
+        if key in ('$ref', 'description'):
+            _check_str(value, f"{where}.{key}")
+        if key == 'nullable' and not isinstance(value, bool):
+            raise ValueError(f"Expected true or false at `{where}.nullable`.")
+    return prop
+
+
+def check_openapi_data(data) -> dict:
+    """Checks only the parts of a (non strictyaml) parsed openapi.yaml that are used:
+    the table names and the `type`, `format`, `items` and `$ref` of the properties.
+    Same rules as `openapi_schema`.
+
+    Parameters
+    ----------
+    data
+        Parsed openapi yaml containing the key `components`
+
+    Returns
+    -------
+        The same data
+
+    Raises
+    ------
+    ValueError
+        If a part that is used is missing or of the wrong type.
+    """
+    data = _check_map(data, '')
+    for key in data:
+        if key != 'components':
+            raise ValueError(f"Unexpected key `{key}`, only `components` is read.")
+    schemas = _check_map(_check_map(data['components'], 'components').get('schemas', None), 'components.schemas')
+    for table_name, table in schemas.items():
+        where = f"components.schemas.{_check_str(table_name, 'components.schemas')}"
+        table = _check_map(table, where)
+        indexes = table.get('x-indexes', None) or []
+        if not isinstance(indexes, list) or not all(isinstance(index, str) for index in indexes):
+            raise ValueError(f"Expected a list of column names at `{where}.x-indexes`.")
+        table['x-indexes'] = [[name.strip() for name in index.split(',')] for index in indexes]
+        properties = _check_map(table.get('properties', None), f"{where}.properties")
+        for field_name, prop in properties.items():
+            field_where = f"{where}.properties.{_check_str(field_name, where + '.properties')}"
+            prop = _check_property(prop, field_where,
+                                   ('type', 'format', 'items', '$ref', 'nullable', 'description'))
+            if 'items' in prop:
+                _check_property(prop['items'], field_where + '.items', ('type', 'format', '$ref'))
+    return data
@@ -0,0 +1,495 @@
+"""A long running local service generating the outputs of schemas, for tools that would otherwise run
+`python main.py` for every schema and pay the start of python and the imports of strictyaml and
+datamodel-code-generator each time::
+
+    python main.py --serve 127.0.0.1:8765
+    python main.py --serve unix:/tmp/yaml2schema.sock
+
+The generations run in a pool of worker processes, started and warmed up (modules imported, a small schema
+generated) before the first request. Endpoints:
+
+    POST /generate  a json object with `anvil` or `openapi` (the yaml text), optionally `refined`, `emit`
+                    (list of output names), `loader`, `class_style` and the options of `y2s_to_pydal.PydalOptions`
+                    (`dialect`, `junction_tables`..). Missing ones take the values the service was started with.
+                    Answers `{"files": {file name: text}, "cached": ..., "seconds": ...}`, or `{"error": ...}`
+                    with status 400.
+    GET /stats      requests, cache hits, latency percentiles and throughput, as json
+    GET /health     `{"ok": true}`
+
+The answers are remembered by the hash of the request, up to a size in bytes. Identical requests arriving
+together share one generation. At most `max_concurrent` generations run at once, `max_waiting` more wait
+for their turn and further requests are answered 503. When a worker process dies (out of memory, killed),
+the pool is replaced by a new warmed up one and the request tried once more.
+"""
+import asyncio
+import http.client
+import json
+import os
+import signal
+import socket
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple, Any, Callable
+
+from y2s_api import generate
+from y2s_cache import content_key, DEFAULT_CACHE_BYTES
+from y2s_constants import DEFAULT_ADDRESS
+from y2s_load import LOADERS
+from y2s_pipeline import DEFAULT_EMIT, check_emit, class_models_available
+from y2s_to_classes import CLASS_STYLES
+from y2s_to_pydal import PydalOptions, DEFAULT_OPTIONS
+
+# largest request body accepted
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# latencies kept for the percentiles of /stats
+LATENCY_WINDOW = 1024
+# generated by every worker when it starts, so the first request does not pay for the imports
+WARM_UP_SCHEMA = """components:
+  schemas:
+    warm_up:
+      properties:
+        name:
+          type: string
+        created_on:
+          type: string
+          format: date-time
+"""
+# keys of a /generate request besides the texts and the options of PydalOptions
+REQUEST_KEYS = ('anvil', 'refined', 'openapi', 'emit', 'loader', 'class_style')
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def warm_up_worker(emit: Tuple[str, ...]):
+    """Initializer of the worker processes: imports what the outputs need by generating a small schema."""
+    try:
+        generate(openapi_text=WARM_UP_SCHEMA, emit=emit)
+    except Exception:  # a warm up that fails only costs the time of the first request
+        pass
+
+
+def worker_pid() -> int:
+    return os.getpid()
+
+
+def generate_in_worker(request: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs in a worker process: the outputs of one normalized request (see `normalize_request`).
+    Errors are returned, not raised, as in `y2s_batch.run_app`.
+
+    Returns
+    -------
+        dict with the keys `files` (file name : text) or `error`, and `seconds`
+    """
+    start = time.perf_counter()
+    try:
+        outputs = generate(anvil_text=request['anvil'], refined_text=request['refined'],
+                           openapi_text=request['openapi'], emit=request['emit'], loader=request['loader'],
+                           pydal_options=PydalOptions(**request['pydal']), class_style=request['class_style'])
+        return {'files': outputs.files(), 'seconds': time.perf_counter() - start}
+    except Exception as e:
+        return {'error': f"{type(e).__name__}: {e}", 'seconds': time.perf_counter() - start}
+
+
+def pydal_defaults(pydal_options: PydalOptions) -> Dict[str, Any]:
+    """The options as the keyword arguments of `PydalOptions`."""
+    return {name: getattr(pydal_options, name) for name in PydalOptions.__slots__}
+
+
+def normalize_request(body: Dict[str, Any], defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """Checks a /generate request and fills in the missing options from `defaults`
+    (the keys `emit`, `loader`, `class_style` and `pydal`, a dict of the arguments of `PydalOptions`).
+
+    Raises
+    ------
+    ValueError
+        for unknown keys or values, or texts that are not strings
+    """
+    if not isinstance(body, dict):
+        raise ValueError("The request must be a json object.")
+    pydal = dict(defaults['pydal'])
+    for key, value in body.items():
+        if key in pydal:
+            pydal[key] = value
+        elif key not in REQUEST_KEYS:
+            raise ValueError(f"Unknown key `{key}`.")
+    request = {key: body.get(key) for key in ('anvil', 'refined', 'openapi')}
+    for key, text in request.items():
+        if text is not None and not isinstance(text, str):
+            raise ValueError(f"`{key}` must be the text of the yaml file.")
+    if (request['anvil'] is None) == (request['openapi'] is None):
+        raise ValueError("Give either `anvil` or `openapi`.")
+    emit = body.get('emit', defaults['emit'])
+    if isinstance(emit, str):
+        emit = [name.strip() for name in emit.split(',') if name.strip()]
+    pydal_options = PydalOptions(**pydal)
+    check_emit(emit, pydal_options)
+    if 'models' in emit and not class_models_available():
+        # as `y2s_pipeline.generate` does
+        emit = [name for name in emit if name != 'models']
+    request['emit'] = sorted(set(emit))
+    request['loader'] = body.get('loader', defaults['loader'])
+    if request['loader'] not in LOADERS:
+        raise ValueError(f"Unknown loader `{request['loader']}`, expected one of {', '.join(LOADERS)}.")
+    request['class_style'] = body.get('class_style', defaults['class_style'])
+    if request['class_style'] not in CLASS_STYLES:
+        raise ValueError(f"Unknown class style `{request['class_style']}`, expected one of {', '.join(CLASS_STYLES)}.")
+    request['pydal'] = pydal_defaults(pydal_options)
+    return request
+
+
+class ServiceStats:
+    """Counts the requests and keeps the latest latencies, for /stats."""
+    __slots__ = ('started', 'requests', 'statuses', 'cache_hits', 'shared', 'generations', 'rejected',
+                 'broken_pools', 'pool_restarts', 'latencies', 'generation_seconds', 'recent')
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.statuses: Dict[int, int] = {}
+        self.cache_hits = 0
+        self.shared = 0  # requests that waited for the same generation as another one
+        self.generations = 0
+        self.rejected = 0
+        self.broken_pools = 0  # generations lost because a worker process died
+        self.pool_restarts = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.generation_seconds = deque(maxlen=LATENCY_WINDOW)
+        self.recent = deque()  # end times of the requests of the last minute
+
+    def record(self, status: int, seconds: float):
+        now = time.monotonic()
+        self.requests += 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(seconds)
+        self.recent.append(now)
+        while self.recent and self.recent[0] < now - 60:
+            self.recent.popleft()
+
+    def report(self) -> Dict[str, Any]:
+        def percentiles(values) -> Dict[str, float]:
+            ordered = sorted(values)
+            if not ordered:
+                return {}
+            return {f"p{p}": round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000, 3)
+                    for p in (50, 90, 99)}
+
+        uptime = time.monotonic() - self.started
+        now = time.monotonic()
+        return {'uptime_seconds': round(uptime, 3),
+                'requests': self.requests,
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'cache_hits': self.cache_hits,
+                'shared_generations': self.shared,
+                'generations': self.generations,
+                'rejected': self.rejected,
+                'broken_pools': self.broken_pools,
+                'pool_restarts': self.pool_restarts,
+                'latency_ms': percentiles(self.latencies),
+                'generation_ms': percentiles(self.generation_seconds),
+                'requests_per_second': round(self.requests / uptime, 3) if uptime else 0.0,
+                'requests_last_minute': sum(1 for end in self.recent if end >= now - 60)}
+
+
+class Service:
+    """The state of a running service: worker pool, remembered answers, limits and stats.
+
+    Parameters
+    ----------
+    workers
+        Number of worker processes, the number of CPUs by default
+    max_concurrent
+        Generations running at once, `workers` by default
+    max_waiting
+        Requests waiting for a generation slot before the next ones are answered 503
+    cache_bytes
+        Size of the remembered answers; the least recently used are forgotten first
+    loader, emit, pydal_options, class_style
+        Defaults of the requests
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_concurrent: Optional[int] = None, max_waiting: int = 64,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES, loader: str = 'strict', emit=DEFAULT_EMIT,
+                 pydal_options: PydalOptions = DEFAULT_OPTIONS, class_style: str = 'dataclass'):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_concurrent = max_concurrent or self.workers
+        self.max_waiting = max_waiting
+        self.cache_bytes = cache_bytes
+        self.defaults = {'loader': loader, 'emit': list(emit), 'pydal': pydal_defaults(pydal_options),
+                         'class_style': class_style}
+        self.cache: 'OrderedDict[str, bytes]' = OrderedDict()
+        self.cached_bytes = 0
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.stats = ServiceStats()
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.pool_lock: Optional[asyncio.Lock] = None
+        self.waiting = 0
+        self.running = 0
+
+    async def start(self):
+        """Starts the worker processes and waits until all of them are warmed up."""
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.pool_lock = asyncio.Lock()
+        self.pool = await self.start_pool()
+
+    async def start_pool(self) -> ProcessPoolExecutor:
+        """A new pool of worker processes, once all of them are warmed up."""
+        emit = tuple(self.defaults['emit'])
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker, initargs=(emit,))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, worker_pid) for _ in range(self.workers)))
+        return pool
+
+    async def replace_pool(self, broken: ProcessPoolExecutor):
+        """Replaces the pool `broken`, unusable once one of its processes died. The requests that found it broken
+        at the same time wait for the one replacing it."""
+        async with self.pool_lock:
+            if self.pool is not broken:  # already replaced
+                return
+            broken.shutdown(wait=False)
+            self.pool = await self.start_pool()
+            self.stats.pool_restarts += 1
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def remember(self, key: str, files_json: bytes):
+        if len(files_json) > self.cache_bytes:
+            return
+        self.cache[key] = files_json
+        self.cached_bytes += len(files_json)
+        while self.cached_bytes > self.cache_bytes:
+            _, forgotten = self.cache.popitem(last=False)
+            self.cached_bytes -= len(forgotten)
+
+    async def generate(self, body: Dict[str, Any]) -> Tuple[int, bytes]:
+        """Status and json body of the answer to a /generate request."""
+        try:
+            request = normalize_request(body, self.defaults)
+        except (ValueError, TypeError) as e:
+            return 400, json_bytes({'error': str(e)})
+        key = content_key(json.dumps(request, sort_keys=True))
+        start = time.perf_counter()
+        files_json = self.cache.get(key)
+        if files_json is not None:
+            self.cache.move_to_end(key)
+            self.stats.cache_hits += 1
+            return 200, answer(files_json, True, time.perf_counter() - start)
+        pending = self.pending.get(key)
+        if pending is not None:
+            self.stats.shared += 1
+            status, files_json = await asyncio.shield(pending)
+        else:
+            if self.waiting >= self.max_waiting:
+                self.stats.rejected += 1
+                return 503, json_bytes({'error': "Too many requests waiting, try again later."})
+            pending = asyncio.get_running_loop().create_future()
+            self.pending[key] = pending
+            try:
+                status, files_json = await self.run(request)
+                if status == 200:
+                    self.remember(key, files_json)
+                pending.set_result((status, files_json))
+            except Exception as e:
+                pending.set_exception(e)
+                raise
+            finally:
+                del self.pending[key]
+        if status != 200:
+            return status, files_json
+        return 200, answer(files_json, False, time.perf_counter() - start)
+
+    async def run(self, request: Dict[str, Any]) -> Tuple[int, bytes]:
+        """Generates in a worker once a slot is free. Returns the status and the json of the files or the error."""
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            # once more on a new pool if a worker died, which may have been while running another request
+            for _ in range(2):
+                pool = self.pool
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(pool, generate_in_worker, request)
+                    break
+                except BrokenProcessPool:
+                    self.stats.broken_pools += 1
+                    await self.replace_pool(pool)
+            else:
+                return 503, json_bytes({'error': "A worker process died, try again later."})
+        finally:
+            self.running -= 1
+            self.slots.release()
+        self.stats.generations += 1
+        self.stats.generation_seconds.append(result['seconds'])
+        if 'error' in result:
+            return 400, json_bytes({'error': result['error']})
+        return 200, json_bytes(result['files'])
+
+    async def respond(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        path = path.split('?', 1)[0]
+        if path == '/generate':
+            if method != 'POST':
+                return 405, json_bytes({'error': "Use POST."})
+            try:
+                request = json.loads(body.decode('utf-8'))
+            except ValueError as e:
+                return 400, json_bytes({'error': f"The body is not json: {e}"})
+            return await self.generate(request)
+        if method != 'GET':
+            return 405, json_bytes({'error': "Use GET."})
+        if path == '/stats':
+            report = self.stats.report()
+            report.update(workers=self.workers, max_concurrent=self.max_concurrent, waiting=self.waiting,
+                          running=self.running, cached_answers=len(self.cache),
+                          cached_bytes=self.cached_bytes)
+            return 200, json_bytes(report)
+        if path == '/health':
+            return 200, json_bytes({'ok': True})
+        return 404, json_bytes({'error': f"No endpoint {path}, use /generate, /stats or /health."})
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Answers the HTTP/1.1 requests of one connection, kept open until the client closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                start = time.perf_counter()
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, json_bytes({'error': f"The body is over {MAX_BODY_BYTES} bytes."})
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, payload = await self.respond(method, path, body)
+                    except Exception as e:
+                        status, payload = 500, json_bytes({'error': f"{type(e).__name__}: {e}"})
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                             + payload)
+                await writer.drain()
+                # polling the stats does not count as traffic
+                if path.split('?', 1)[0] != '/stats':
+                    self.stats.record(status, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def json_bytes(data) -> bytes:
+    return json.dumps(data).encode('utf-8')
+
+
+def answer(files_json: bytes, cached: bool, seconds: float) -> bytes:
+    """Body of a generation, the json of the files is inserted as it is."""
+    return b'{"cached": ' + (b'true' if cached else b'false') + f', "seconds": {seconds:.6f}, "files": '.encode() \
+        + files_json + b'}'
+
+
+def parse_address(address: str) -> Tuple[Optional[str], Optional[int], Optional[str]]:
+    """`unix:PATH`, `HOST:PORT` or `PORT` (on 127.0.0.1) into (host, port, unix socket path)."""
+    if address.startswith('unix:'):
+        return None, None, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port), None
+
+
+async def serve_forever(service: Service, address: str = DEFAULT_ADDRESS,
+                        ready: Optional[Callable[[str], None]] = None):
+    """Starts the workers, then serves until cancelled. `ready` is called with the address once it listens."""
+    host, port, path = parse_address(address)
+    await service.start()
+    if path is not None:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(service.handle, path=path)
+    else:
+        server = await asyncio.start_server(service.handle, host=host, port=port)
+    # stop cleanly when the process is asked to, as with Ctrl-C
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):  # windows
+            pass
+    if ready is not None:
+        ready(address)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+
+
+def serve(address: str = DEFAULT_ADDRESS, workers: Optional[int] = None, max_concurrent: Optional[int] = None,
+          cache_size: int = DEFAULT_CACHE_BYTES, **options):
+    """Runs the service until interrupted (Ctrl-C).
+
+    Parameters
+    ----------
+    address
+        `HOST:PORT` or `unix:PATH`. Only bind to addresses of this machine: there is no authentication.
+    workers, max_concurrent
+        See `Service`
+    cache_size
+        Bytes of remembered answers
+    options
+        Defaults of the requests: `loader`, `emit`, `pydal_options`, `class_style`
+    """
+    service = Service(workers=workers, max_concurrent=max_concurrent, cache_bytes=cache_size, **options)
+    try:
+        asyncio.run(serve_forever(service, address, ready=lambda at: print(f"Serving on {at}, Ctrl-C to stop.")))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def request(address: str, method: str = 'GET', path: str = '/stats', body: Optional[Dict] = None,
+            timeout: float = 300.0) -> Tuple[int, Dict]:
+    """Sends one request to a running service, for tools written in python. Returns the status and the json."""
+    host, port, unix_path = parse_address(address)
+    if unix_path is not None:
+        connection = _UnixConnection(unix_path, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        payload = None if body is None else json_bytes(body)
+        connection.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
@@ -0,0 +1,81 @@
+"""Checks that the start of a generation stays fast: runs `main.py` under ``python -X importtime`` and fails when
+a module it should not need is imported, or when the imports take longer than the budget.
+
+Example::
+
+    python y2s_startup.py --emit pydal --budget 250
+
+The generation runs in a temporary copy of `tests/yaml/in`, so the outputs of the repository are left alone.
+Exits with 1 and prints the offending modules when the check fails.
+"""
+import argparse
+import pathlib
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+# modules a generation without `models` must not import: datamodel-code-generator and what it brings in,
+# and those of --serve and --batch
+FORBIDDEN_MODULES = ('datamodel_code_generator', 'pydantic', 'black', 'isort', 'jinja2', 'asyncio',
+                     'multiprocessing')
+# milliseconds, the cumulative time of all the imports
+DEFAULT_BUDGET_MS = 250.0
+HERE = pathlib.Path(__file__).parent
+# `import time: self [us] | cumulative | imported package`, nested imports are indented
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+
+def import_times(args: List[str]) -> Dict[str, Tuple[int, int]]:
+    """Runs `main.py` with `args` under ``-X importtime``, in a temporary copy of the input directory.
+
+    Returns
+    -------
+        the cumulative import time in microseconds and the nesting depth of each imported module
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        shutil.copytree(HERE / "tests/yaml/in", pathlib.Path(tmp) / "tests/yaml/in")
+        (pathlib.Path(tmp) / "tests/yaml/out").mkdir()
+        run = subprocess.run([sys.executable, '-X', 'importtime', str(HERE / "main.py")] + args,
+                             cwd=tmp, capture_output=True, text=True)
+    if run.returncode != 0:
+        raise RuntimeError(f"main.py {' '.join(args)} failed:\n{run.stderr}")
+    modules = {}
+    for line in run.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(2)), len(match.group(3)) // 2)
+    return modules
+
+
+def check_startup(args: List[str], budget_ms: float = DEFAULT_BUDGET_MS,
+                  forbidden: Tuple[str, ...] = FORBIDDEN_MODULES) -> List[str]:
+    """The problems of the start of `main.py` with `args`, empty when it is within the budget."""
+    modules = import_times(args)
+    problems = [f"imports `{name}`" for name in forbidden if name in modules]
+    # the top level imports include the ones they trigger
+    total_ms = sum(cumulative for cumulative, depth in modules.values() if depth == 0) / 1000
+    if total_ms > budget_ms:
+        slowest = sorted(((cumulative, name) for name, (cumulative, depth) in modules.items() if depth == 0),
+                         reverse=True)[:5]
+        problems.append(f"imports take {total_ms:.0f} ms, more than {budget_ms:.0f} ms; slowest: " +
+                        ', '.join(f"{name} {cumulative / 1000:.0f} ms" for cumulative, name in slowest))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Checks the modules imported by main.py and their time.")
+    parser.add_argument('--emit', default='pydal', help="outputs generated by main.py, without `models`")
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS,
+                        help="largest cumulative import time, in milliseconds")
+    args = parser.parse_args()
+    if 'models' in args.emit.split(','):
+        parser.error("--emit: `models` imports datamodel-code-generator, which is what this checks against")
+    problems = check_startup(['--emit', args.emit, '--no-cache'], args.budget)
+    for problem in problems:
+        print(f"main.py --emit {args.emit}: {problem}")
+    if not problems:
+        print(f"main.py --emit {args.emit}: start up within {args.budget:.0f} ms")
+    sys.exit(1 if problems else 0)
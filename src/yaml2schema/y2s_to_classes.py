@@ -0,0 +1,171 @@
+"""Class models of the tables written directly, without datamodel-code-generator and pydantic:
+`__slots__` dataclasses or msgspec Structs, plus a function per table turning a pyDAL row into its class.
+
+The column types are the ones of `y2s_to_pydal` (see `y2s_types`), mapped as in the README table:
+a `link_single` column is an instance of the class of the linked table, a `link_multiple` column a list of them.
+"""
+from functools import partial
+from typing import List, Callable, Optional, Dict
+
+from y2s_ir import Schema, Table
+from y2s_to_pydal import tab1
+from y2s_types import TYPES, FieldType, REFERENCES, classify_table
+
+CLASS_STYLES = ('dataclass', 'msgspec')
+# python annotation by pyDAL type, references are handled in `field_annotation`
+CLASS_TYPES: Dict[str, str] = {'string': "str",
+                               'text': "str",
+                               'boolean': "bool",
+                               'integer': "int",
+                               'bigint': "int",
+                               'double': "float",
+                               'date': "datetime.date",
+                               'datetime': "datetime.datetime",
+                               'json': "Dict[str, Any]",
+                               'blob': "bytes",
+                               'list:integer': "List[int]",
+                               'list:string': "List[str]"}
+
+CLASSES_HEADER = {
+    'dataclass': '''"""Class models of the database tables, with a function converting a pyDAL row of each table."""
+from __future__ import annotations
+
+import datetime
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# __slots__ need python 3.10 for dataclasses with defaults
+SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+''',
+    'msgspec': '''"""Class models of the database tables, with a function converting a pyDAL row of each table."""
+from __future__ import annotations
+
+import datetime
+from typing import Any, Dict, List, Optional
+
+import msgspec
+''',
+}
+
+CONVERTERS_HEADER = '''
+
+def _ref(cls, from_row, value):
+    """A referenced row: a row (of a join) is converted, an id gives an instance with only its `id`."""
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return cls(id=int(value))
+    return from_row(value)
+
+
+def _refs(cls, from_row, values):
+    if values is None:
+        return None
+    return [_ref(cls, from_row, value) for value in values]
+'''
+
+
+def class_name(table: str) -> str:
+    """Class of the table, as datamodel-code-generator names it: `email_list` is `EmailList`."""
+    return ''.join(part[:1].upper() + part[1:] for part in table.split('_') if part)
+
+
+def field_annotation(type_of: str) -> str:
+    """python annotation of a column of pyDAL type `type_of`, without the Optional."""
+    if type_of.startswith("reference "):
+        return class_name(type_of[len("reference "):])
+    if type_of.startswith("list:reference "):
+        return f"List[{class_name(type_of[len('list:reference '):])}]"
+    annotation = CLASS_TYPES.get(type_of) or TYPES.python_types.get(type_of)
+    if annotation is None:
+        raise ValueError(f"No python type for the pyDAL type `{type_of}`, see `y2s_types.register_format`.")
+    return annotation
+
+
+def table_to_class(table: str, table_schema: Table, style: str = 'dataclass',
+                   field_types: Optional[Dict[str, FieldType]] = None) -> List[str]:
+    """Lines of the class of one table and of its row converter `<table>_from_row`.
+
+    Parameters
+    ----------
+    table
+        table name
+    table_schema
+        the table in openapi format
+    style
+        `dataclass` or `msgspec`, see `CLASS_STYLES`
+    field_types
+        The column types of the table from `y2s_types.classify_schema`, worked out here if not given
+
+    Returns
+    -------
+    list of lines
+    """
+    if field_types is None:
+        field_types = classify_table(table_schema)
+    name = class_name(table)
+    if style == 'msgspec':
+        lines = ["", "", f"class {name}(msgspec.Struct, kw_only=True):"]
+    else:
+        lines = ["", "", "@dataclass(**SLOTS)", f"class {name}:"]
+    values = []
+    if 'id' not in table_schema.fields:
+        lines.append(tab1 + "id: Optional[int] = None")
+        values.append("id=get('id')")
+    for field_name, field_type in field_types.items():
+        lines.append(tab1 + f"{field_name}: Optional[{field_annotation(field_type.type_of)}] = None")
+        reference = field_type.reference
+        if reference is None:
+            values.append(f"{field_name}=get('{field_name}')")
+        else:
+            ref = '_refs' if field_type.kind == REFERENCES else '_ref'
+            values.append(f"{field_name}={ref}({class_name(reference)}, {reference}_from_row, get('{field_name}'))")
+    lines.extend(["", "",
+                  f"def {table}_from_row(row) -> {name}:",
+                  tab1 + f'"""Converts a `{table}` row (a pyDAL Row or a dict) into `{name}`."""',
+                  tab1 + "get = row.get",
+                  tab1 + f"return {name}("])
+    lines.extend(tab1 * 2 + value + ("," if ix < len(values) - 1 else ")") for ix, value in enumerate(values))
+    return lines
+
+
+def schema_to_classes(ordered_schema: Schema, render_table: Optional[Callable[[str, Table], List[str]]] = None,
+                      style: str = 'dataclass') -> List[str]:
+    """Converts the schema into the module of the class models and their row converters.
+
+    Parameters
+    ----------
+    ordered_schema
+        Database schema in openapi format
+    render_table
+        Function giving the lines of one table, `table_to_class` by default (or a cached version of it).
+    style
+        `dataclass` or `msgspec`, see `CLASS_STYLES`. `render_table` must use the same.
+
+    Returns
+    -------
+    list of lines
+    """
+    if style not in CLASS_STYLES:
+        raise ValueError(f"Unknown class style `{style}`, expected one of {', '.join(CLASS_STYLES)}.")
+    if render_table is None:
+        render_table = partial(table_to_class, style=style)
+    # modules of the python types of the registered formats, such as `decimal` for `decimal.Decimal`
+    modules = sorted({python_type.split('.')[0] for python_type in TYPES.python_types.values()
+                      if '.' in python_type} - {'datetime'})
+    header = CLASSES_HEADER[style].replace("import datetime\n", "import datetime\n" +
+                                           ''.join(f"import {module}\n" for module in modules))
+    lines = (header + CONVERTERS_HEADER).rstrip('\n').split('\n')
+    for table, table_schema in ordered_schema.tables.items():
+        lines.extend(render_table(table, table_schema))
+    lines.extend(["", "", "# converter of the rows of each table",
+                  "FROM_ROW = {"])
+    lines.extend(tab1 + f"'{table}': {table}_from_row," for table in ordered_schema.tables)
+    lines.extend(["}", "", "",
+                  "def from_rows(table: str, rows) -> list:",
+                  tab1 + '"""The rows of `table` (pyDAL Rows, or a list of dicts) as a list of its class."""',
+                  tab1 + "convert = FROM_ROW[table]",
+                  tab1 + "return [convert(row) for row in rows]",
+                  ""])
+    return lines
@@ -0,0 +1,103 @@
+"""Generates `db_fixtures.py`, pytest fixtures giving each test a fresh database with the tables of `pydal_def`.
+
+The tables are created once, with the sqlite script of `y2s_to_sql`, in a template database in memory.
+Each test then gets a copy of the template made with sqlite's backup API, instead of creating the tables again.
+"""
+from typing import List
+
+FIXTURES_HEADER = '''"""pytest fixtures: each test gets its own copy of a database with all the tables of pydal_def.
+
+The tables are created once, in a template database in memory, and copied for each test with sqlite's
+backup API. In conftest.py::
+
+    from db_fixtures import db, file_db  # noqa
+
+    def test_something(db):
+        db.my_table.insert(my_column=1)
+
+While the test runs, `pydal_def.db` is the copy, so code using `pydal_def.db` sees it.
+"""
+import sqlite3
+
+import pytest
+from pydal import DAL
+
+import pydal_def
+
+'''
+
+FIXTURES_BODY = '''
+_template = None
+
+
+def template() -> sqlite3.Connection:
+    """The template database, created the first time."""
+    global _template
+    if _template is None:
+        _template = sqlite3.connect(':memory:', check_same_thread=False)
+        _template.executescript(SCHEMA_SQL)
+    return _template
+
+
+def clone(folder=None) -> DAL:
+    """A new connection to a copy of the template, in memory or in `folder`/storage.sqlite if given.
+    No table is defined yet, see `use`."""
+    if folder is None:
+        new_db = DAL('sqlite:memory', migrate=False)
+    else:
+        new_db = DAL('sqlite://storage.sqlite', folder=str(folder), migrate=False)
+    template().backup(new_db._adapter.connection)
+    return new_db
+
+
+def use(new_db: DAL) -> DAL:
+    """Makes `new_db` the database of `pydal_def` and defines its tables there, without migrations."""
+    pydal_def.db = new_db
+    pydal_def.define_tables_of_db()
+    return new_db
+
+
+@pytest.fixture
+def db():
+    """A database for the test only, in memory."""
+    saved = pydal_def.db
+    new_db = use(clone())
+    yield new_db
+    new_db.close()
+    pydal_def.db = saved
+
+
+@pytest.fixture
+def file_db(tmp_path):
+    """A database for the test only, in the file storage.sqlite of the temporary directory of the test."""
+    saved = pydal_def.db
+    new_db = use(clone(tmp_path))
+    yield new_db
+    new_db.close()
+    pydal_def.db = saved
+'''
+
+
+def sql_literal(sql: str) -> str:
+    """`sql` as a python string literal, a readable triple quoted one when possible."""
+    if "'''" in sql or '\\' in sql:
+        return repr(sql)
+    return "'''\n" + sql + "'''"
+
+
+def fixtures_module(schema_sql: List[str]) -> str:
+    """Text of `db_fixtures.py`.
+
+    Parameters
+    ----------
+    schema_sql
+        Lines of the sqlite script creating the tables, from `y2s_to_sql.schema_to_sql`,
+        with the same options as `pydal_def.py`.
+
+    Returns
+    -------
+        python module
+    """
+    sql = ''.join(line + '\n' for line in schema_sql)
+    return FIXTURES_HEADER + "# the tables and indexes of pydal_def, see schema.sql\nSCHEMA_SQL = " + \
+        sql_literal(sql) + "\n\n" + FIXTURES_BODY
@@ -1,76 +1,171 @@
+import json
+import re
+from typing import Dict, Callable, Optional, List
+
 import strictyaml as sy
-from collections import OrderedDict
 
-from y2s_constants import OPENAPI_FORMATS, OPENAPI_TYPES
+from y2s_constants import OPENAPI_FORMATS, OPENAPI_TYPES, Openapi_preamble_data
+from y2s_ir import Schema, Table, Field, REF_PREFIX
 from y2s_schema import openapi_schema
+from y2s_types import TYPES
+
+OPENAPI_COMPONENTS_HEADER = "components:\n  schemas:\n"
+# strings written as they are by `emit_table_yaml`. Anything else (quotes, multiple lines, a leading `@`, ...)
+# is left to strictyaml, so the output stays the same as `table_to_openapi_yaml_strict`.
+PLAIN_SCALAR = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.,()+/\-]*(?: [A-Za-z0-9_.,()+/\-]+)*")
+MAX_PLAIN_LINE = 78
+_openapi_type_values = frozenset(OPENAPI_TYPES.values())
 
 
-def convert_anvil_to_openapi_yaml(anvil_yaml: sy.YAML) -> sy.YAML:
+def convert_anvil_to_openapi(anvil_data: Dict) -> Schema:
     """
-    Converts `strictyaml` that was parsed from anvil.yaml to openapi format.
+    Converts the data that was parsed from anvil.yaml to the openapi description of the schema.
 
     Parameters
     ----------
-    anvil_yaml
-        Parsed anvil.yaml
+    anvil_data
+        Parsed anvil.yaml as plain dicts, containing the key `db_schema`
 
     Returns
     -------
-    sy.YAML
+    Schema
         open api format of the database schema
     """
-    # change first anvil keyword to openapi keyword
-    openapi_dict = {'schemas': {}}  # contains final version of the openapi schema
-    an_yaml = anvil_yaml['db_schema']  # the input to be converted
+    schema = Schema()  # contains final version of the openapi schema
+    an_yaml = anvil_data['db_schema']  # the input to be converted
     for key_ in an_yaml:
-        o_key = key_.text  # an_yaml[key_]['title']  # db table name
-        # the basic structure of the openapi table
-        openapi_dict['schemas'].update({str(o_key): OrderedDict(
-            {  # 'required': [],
-                'properties': {}
-            })})
-
-        # add an id column
-        # key_col = "id"  # column name
-        # type_col = {'nullable': True}  # type of column
-        # property_dict = openapi_dict['schemas'][o_key]['properties']
-        # property_dict.update({key_col:  type_col})
-
+        o_key = str(key_)  # db table name
+        table = Table(o_key)
+        schema.add(table)
         # for the rest of the columns listed in the anvil.yaml file
         for col in an_yaml[key_]['columns']:  # for each column in the anvil table
             key_col = str(col['name'])  # column name
-            # openapi_dict['schemas'][o_key]['required'].append(key_col)  # openapi listing columns
             type_col = str(col['type'])  # what is the type of the column
             format_col = None
-            property_dict = openapi_dict['schemas'][o_key]['properties']
             if type_col in OPENAPI_FORMATS:  # translate tha anvil type to openapi type
                 format_col = OPENAPI_FORMATS[type_col]
             if type_col == 'link_single':  # reference to another table row
-                if col['target'] in an_yaml:
-                    table_name = col['target'].text  # str(an_yaml[col['target']]['title'])
-                    prop_ref = {'$ref': "#/components/schemas/" + table_name}
-                    property_dict.update({key_col: prop_ref})
+                if col.get('target', None) in an_yaml:
+                    table.add(Field(key_col, ref=str(col['target'])))
             elif type_col == 'link_multiple':  # reference to multiple table rows
-                if col['target'] in an_yaml:
-                    property_dict.update({key_col: {'type': 'array'}})
-                    table_name = col['target'].text  # str(an_yaml[col['target']]['title'])
-                    prop_ref = {'$ref': "#/components/schemas/" + table_name}
-                    property_dict[key_col].update({'items': prop_ref})
+                if col.get('target', None) in an_yaml:
+                    table.add(Field(key_col, type='array', items=Field(ref=str(col['target']))))
             else:
                 try:
                     type_col = OPENAPI_TYPES[type_col]
                 except KeyError:
                     type_col = 'string'
+                table.add(Field(key_col, type=type_col, format=format_col))
+    return schema
+
+
+def table_to_openapi_yaml_strict(table_name: str, table: Table) -> str:
+    """Writes one table as the openapi yaml that goes under `components: schemas:`, validated by strictyaml."""
+    document = sy.as_document({'components': {'schemas': {table_name: table.to_openapi()}}},
+                              openapi_schema(), 'Openapi').as_yaml()
+    return document[len(OPENAPI_COMPONENTS_HEADER):]
+
+
+def _plain(text) -> bool:
+    return isinstance(text, str) and PLAIN_SCALAR.fullmatch(text) is not None
+
+
+def _field_yaml(lines: List[str], indent: str, field: Field, is_items: bool = False) -> bool:
+    """Appends the lines of one property (or of its `items`) as strictyaml writes them.
+    False if strictyaml has to write it instead (a value to quote or to validate)."""
+    if field.type is not None:
+        if field.type not in _openapi_type_values:
+            return False
+        lines.append(f"{indent}type: {field.type}")
+    if field.format is not None:
+        if field.format not in TYPES.known_formats():
+            return False
+        lines.append(f"{indent}format: {field.format}")
+    if field.items is not None:
+        if is_items:
+            return False
+        lines.append(f"{indent}items:")
+        if not _field_yaml(lines, indent + "  ", field.items, is_items=True):
+            return False
+    if field.ref is not None:
+        if not _plain(field.ref):
+            return False
+        lines.append(f"{indent}$ref: '{REF_PREFIX}{field.ref}'")
+    if field.nullable is not None or field.description is not None:
+        if is_items:
+            return False
+        if field.nullable is not None:
+            lines.append(f"{indent}nullable: {'yes' if field.nullable else 'no'}")
+        if field.description is not None:
+            if not _plain(field.description):
+                return False
+            lines.append(f"{indent}description: {field.description}")
+    return True
+
+
+def emit_table_yaml(table_name: str, table: Table) -> Optional[str]:
+    """Writes one table as `table_to_openapi_yaml_strict` does, byte for byte, without building a yaml document.
+
+    Returns
+    -------
+        yaml text, or None when a name or value is one that strictyaml quotes or folds, or that it would reject
+    """
+    if not _plain(table_name):
+        return None
+    lines = [f"    {table_name}:"]
+    if table.indexes:
+        lines.append("      x-indexes:")
+        for index in table.indexes:
+            if not index or not all(_plain(column) and ',' not in column for column in index):
+                return None
+            lines.append("      - " + ", ".join(index))
+    lines.append("      properties:")
+    for name, field in table.fields.items():
+        if not _plain(name):
+            return None
+        lines.append(f"        {name}:")
+        if not _field_yaml(lines, "          ", field):
+            return None
+    # strictyaml folds long lines
+    if any(len(line) > MAX_PLAIN_LINE for line in lines):
+        return None
+    lines.append("")
+    return "\n".join(lines)
+
+
+def table_to_openapi_yaml(table_name: str, table: Table) -> str:
+    """Writes one table as the openapi yaml that goes under `components: schemas:`.
+    Written directly when possible (`emit_table_yaml`), by strictyaml otherwise, with the same result."""
+    text = emit_table_yaml(table_name, table)
+    if text is None:
+        return table_to_openapi_yaml_strict(table_name, table)
+    return text
+
+
+def schema_to_openapi_yaml(schema: Schema,
+                           render_table: Optional[Callable[[str, Table], str]] = None) -> str:
+    """Writes the `components` of the schema as openapi yaml.
+
+    Parameters
+    ----------
+    schema
+        Database schema
+    render_table
+        Function giving the yaml of one table, `table_to_openapi_yaml` by default (or a cached version of it).
+
+    Returns
+    -------
+        yaml text
+    """
+    if render_table is None:
+        render_table = table_to_openapi_yaml
+    return OPENAPI_COMPONENTS_HEADER + ''.join(
+        render_table(table_name, table) for table_name, table in schema.tables.items())
+
 
-                property_dict.update({key_col: {'type': type_col}})
-                if format_col:
-                    property_dict[key_col].update({'format': format_col})
-
-            # add None types to the columns
-            # property_dict[key_col].update({'nullable': 'true'})
-        # add info
-        if len(openapi_dict.keys()) == 0:
-            # there are no database tables!!!
-            print("No database tables in anvil.yaml!! Exiting.")
-            exit(0)
-    return sy.as_document({'components': openapi_dict}, openapi_schema(), 'Openapi')
+def schema_to_openapi_json(schema: Schema) -> str:
+    """The openapi document of the schema, preamble included, as json.
+    The keys keep the order of the schema, so the same schema always gives the same text."""
+    document = dict(Openapi_preamble_data)
+    document.update(schema.to_openapi())
+    return json.dumps(document, indent=2, ensure_ascii=False) + "\n"
@@ -1,32 +1,392 @@
-from typing import List
+import hashlib
+from functools import partial
+from typing import List, Callable, Optional, Tuple, Dict
 
-import strictyaml as sy
+from y2s_ir import Schema, Table, Reference
+from y2s_types import FieldType, REFERENCES, classify_table
 
-from y2s_reorder import extract_type_of_field
+tab1 = "    "
+# longest index name postgres keeps (mysql 64, sqlite no limit)
+MAX_INDEX_NAME = 63
+DIALECTS = ('sqlite', 'postgres', 'mysql')
+# DAL uri of the generated module, when the environment variable DATABASE_URI is not set.
+# `postgres3` is pyDAL's postgres adapter storing `list:` fields as native arrays and `jsonb` natively.
+DAL_URIS = {'postgres': "postgres3://postgres@localhost/postgres",
+            'mysql': "mysql://root@localhost/mysql"}
+MIGRATE_MODES = ('on', 'off', 'fake')
+# run on every new sqlite connection with `sqlite_pragmas`
+SQLITE_PRAGMAS = ("PRAGMA journal_mode=WAL",
+                  "PRAGMA synchronous=NORMAL",
+                  "PRAGMA mmap_size=268435456",  # 256 MB
+                  "PRAGMA cache_size=-65536",  # 64 MB
+                  )
+# pyDAL types stored natively by postgres, searchable with a GIN index
+GIN_TYPES = ('jsonb', 'list:integer', 'list:string', 'list:reference')
 
 
-def openapi_to_pydal(ordered_openapi_yaml: sy.YAML) -> List[str]:
-    """Converts open api yaml describing the database into a pydal definition string such as:
+class PydalOptions:
+    """How the pyDAL definition is generated.
+
+    Attributes
+    ----------
+    dialect
+        One of `DIALECTS`. The database `pydal_def.py` connects to and the column types it uses.
+    reference_indexes
+        Index every reference column, on top of the indexes declared in `x-indexes`. Not in mysql, where InnoDB
+        indexes the foreign keys itself.
+    junction_tables
+        Each `link_multiple` column becomes a junction table, with `get_`, `find_` and `set_` functions,
+        instead of a `list:reference` column.
+    pool_size
+        Number of connections kept open by pyDAL, 0 for none.
+    lazy_tables
+        pyDAL only defines a table when it is first used.
+    migrate
+        One of `MIGRATE_MODES`: `on` creates and alters the tables, `off` expects them to exist,
+        `fake` only updates pyDAL's `.table` files. Unless `on` (or with `lazy_tables`) the indexes are
+        created by the function `create_indexes` instead of by `define_tables_of_db`.
+    sqlite_pragmas
+        Run `SQLITE_PRAGMAS` on every new connection. sqlite only.
+    split_tables
+        Write a package with one module per table instead of a single file, see `openapi_to_pydal_package`.
+    """
+    __slots__ = ('dialect', 'reference_indexes', 'junction_tables', 'pool_size', 'lazy_tables', 'migrate',
+                 'sqlite_pragmas', 'split_tables')
+
+    def __init__(self, dialect: str = 'sqlite', reference_indexes: bool = True, junction_tables: bool = False,
+                 pool_size: int = 0, lazy_tables: bool = False, migrate: str = 'on', sqlite_pragmas: bool = False,
+                 split_tables: bool = False):
+        if dialect not in DIALECTS:
+            raise ValueError(f"Unknown dialect `{dialect}`, expected one of: {', '.join(DIALECTS)}.")
+        if migrate not in MIGRATE_MODES:
+            raise ValueError(f"Unknown migrate mode `{migrate}`, expected one of: {', '.join(MIGRATE_MODES)}.")
+        if sqlite_pragmas and dialect != 'sqlite':
+            raise ValueError(f"sqlite pragmas can not be used with the dialect `{dialect}`.")
+        if pool_size < 0:
+            raise ValueError("The pool size can not be negative.")
+        self.dialect = dialect
+        self.reference_indexes = reference_indexes
+        self.junction_tables = junction_tables
+        self.pool_size = pool_size
+        self.lazy_tables = lazy_tables
+        self.migrate = migrate
+        self.sqlite_pragmas = sqlite_pragmas
+        self.split_tables = split_tables
+
+    def key(self) -> str:
+        """Text that changes whenever the options change the output, for the cache keys."""
+        return ','.join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+    def table_key(self) -> str:
+        """Same as `key`, for the options that change the definition of a single table (`table_to_pydal`)."""
+        return f"dialect={self.dialect},junction_tables={self.junction_tables}"
+
+    def separate_indexes(self) -> bool:
+        """Are the indexes created by `create_indexes` rather than when the tables are defined?"""
+        return self.migrate != 'on' or self.lazy_tables
+
+
+DEFAULT_OPTIONS = PydalOptions()
+
+
+def pydal_type(type_of: str, dialect: str) -> str:
+    """The pyDAL type of a column of type `type_of` (see `y2s_types.FieldType`) in `dialect`."""
+    if dialect == 'postgres' and type_of == 'json':
+        return 'jsonb'
+    return type_of
+
+
+def table_to_pydal(table: str, table_schema: Table, options: PydalOptions = DEFAULT_OPTIONS,
+                   field_types: Optional[Dict[str, FieldType]] = None) -> List[str]:
+    """Lines of the pydal definition of one table, such as:
         db.define_table("my_table",Field("my_column","")
 
     Parameters
     ----------
-    ordered_openapi_yaml
+    table
+        table name
+    table_schema
+        the table in openapi format
+    options
+        Dialect of the column types. With `junction_tables` the `list:reference` columns are left out,
+        they are junction tables (see `junction_to_pydal`).
+    field_types
+        The column types of the table from `y2s_types.classify_schema`, worked out here if not given
+
+    Returns
+    -------
+    list of lines
+    """
+    if field_types is None:
+        field_types = classify_table(table_schema)
+    # _#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#
+    # create the table in pyDal
+    table_def_lines = [tab1 + f"if '{table}' not in db.tables:",
+                       tab1 * 2 + f"db.define_table('{table}'"]
+    # add fields
+    for field_name, field_type in field_types.items():
+        if options.junction_tables and field_type.kind == REFERENCES:
+            continue
+        type_of = pydal_type(field_type.type_of, options.dialect)
+        # _#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#
+        # line of the Column aka Field definition
+        if "reference" in type_of:
+            ondelete = ", ondelete='NO ACTION'"
+        else:
+            ondelete = ""
+        # if the field is a file, may need an extra entry for filename
+        if type_of=='blob':
+            table_def_lines.append(
+                tab1 * 3 + f", Field('{field_name}_name', type='upload', uploadfield='{field_name}')")
+        table_def_lines.append(
+            tab1 * 3 + f", Field('{field_name}', type='{type_of}', default=None{ondelete})")
+    # last parenthesis of table definition
+    table_def_lines.append(tab1 * 2 + ')')
+    return table_def_lines
+
+
+def junction(ref: Reference) -> Tuple[str, str, str]:
+    """Names of the junction table of a `link_multiple` column and of its two columns:
+    `my_table_my_column`, `my_table` (the row that has the link) and `my_column` (the linked row)."""
+    item = ref.field if ref.field != ref.table else ref.field + "_item"
+    return f"{ref.table}_{ref.field}", ref.table, item
+
+
+def junctions(ordered_schema: Schema) -> List[Reference]:
+    """The `link_multiple` columns of the schema, each becoming a junction table.
+
+    Raises
+    ------
+    ValueError
+        if the name of a junction table is already the name of a table or of another junction table
+        (`a_b.c` and `a.b_c` both give `a_b_c`)
+    """
+    refs = [ref for ref in ordered_schema.references() if ref.multiple]
+    seen: Dict[str, Reference] = {}
+    for ref in refs:
+        name = junction(ref)[0]
+        if name in ordered_schema.tables:
+            raise ValueError(f"Junction table of `{ref.table}.{ref.field}` would replace the table `{name}`.")
+        if name in seen:
+            raise ValueError(f"Junction tables of `{seen[name].table}.{seen[name].field}` and "
+                             f"`{ref.table}.{ref.field}` would both be `{name}`.")
+        seen[name] = ref
+    return refs
+
+
+def junction_to_pydal(ref: Reference) -> List[str]:
+    """Lines of the pydal definition of the junction table of a `link_multiple` column:
+    one reference to each side and the pair of them as primary key."""
+    name, owner, item = junction(ref)
+    return [tab1 + f"if '{name}' not in db.tables:",
+            tab1 * 2 + f"db.define_table('{name}'",
+            tab1 * 3 + f", Field('{owner}', type='reference {ref.table}', notnull=True, ondelete='NO ACTION')",
+            tab1 * 3 + f", Field('{item}', type='reference {ref.target}', notnull=True, ondelete='NO ACTION')",
+            tab1 * 3 + f", primarykey=['{owner}', '{item}']",
+            tab1 * 2 + ')']
+
+
+def junction_helpers(ref: Reference, link: Optional[str] = None) -> List[str]:
+    """Functions of the generated module reading and writing the links of a junction table:
+    `get_<table>_<column>` (linked rows of a row), `find_<table>_by_<column>` (rows linking to a row)
+    and `set_<table>_<column>` (replaces the links of a row).
+    `link` is the expression giving the junction table, `db.<junction table>` by default."""
+    name, owner, item = junction(ref)
+    if link is None:
+        link = f"db.{name}"
+    return [f"""
+def get_{name}({owner}_id):
+    \"\"\"`{ref.target}` rows linked to the `{ref.table}` row `{owner}_id` by `{ref.table}.{ref.field}`.\"\"\"
+    link = {link}
+    return db((link.{owner} == {owner}_id) & (link.{item} == db.{ref.target}.id)).select(db.{ref.target}.ALL)
+
+
+def find_{ref.table}_by_{ref.field}({item}_id):
+    \"\"\"`{ref.table}` rows whose `{ref.field}` links to the `{ref.target}` row `{item}_id`.\"\"\"
+    link = {link}
+    return db((link.{item} == {item}_id) & (link.{owner} == db.{ref.table}.id)).select(db.{ref.table}.ALL)
+
+
+def set_{name}({owner}_id, {item}_ids):
+    \"\"\"Links the `{ref.table}` row `{owner}_id` to the `{ref.target}` rows `{item}_ids` (and no others).\"\"\"
+    link = {link}
+    # a delete through pyDAL fails on tables without an `id`, so run the sql it generates
+    db.executesql(db(link.{owner} == {owner}_id)._delete())
+    for {item}_id in dict.fromkeys({item}_ids):
+        link.insert({owner}={owner}_id, {item}={item}_id)
+"""]
+
+
+def index_name(table: str, columns: List[str]) -> str:
+    """Name of the index of `columns` of `table`, such as `my_table_my_column_idx`.
+    Names too long for the database end with a hash of the full name instead."""
+    name = f"{table}_{'_'.join(columns)}_idx"
+    if len(name) > MAX_INDEX_NAME:
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+        name = name[:MAX_INDEX_NAME - 13] + '_' + digest + '_idx'
+    return name
+
+
+def table_indexes(table: str, table_schema: Table, options: PydalOptions = DEFAULT_OPTIONS,
+                  field_types: Optional[Dict[str, FieldType]] = None) -> List[Tuple[List[str], str]]:
+    """Columns and method of each index of the table, without duplicates:
+        - one per reference column (if `reference_indexes`, not in mysql, where InnoDB already indexes every
+          foreign key),
+        - in postgres, a GIN index per array or json column,
+        - then the ones declared in `x-indexes`; in postgres those of one array or json column are GIN too.
+
+    The method is '' for the default index of the database or 'gin'.
+    In sqlite and mysql `list:reference` columns are not indexed: pyDAL stores them as text such as `|1|2|`,
+    which an index does not help to search.
+
+    Raises
+    ------
+    ValueError
+        if a declared index has a column that is not in the table
+    """
+    def method(columns: List[str]) -> str:
+        if options.dialect != 'postgres' or len(columns) != 1:
+            return ''
+        type_of = pydal_type(field_types[columns[0]].type_of, options.dialect)
+        return 'gin' if type_of.startswith(GIN_TYPES) else ''
+
+    if field_types is None:
+        field_types = classify_table(table_schema)
+
+    candidates = []
+    if options.reference_indexes and options.dialect != 'mysql':
+        for ref in table_schema.references():
+            if not ref.multiple:
+                candidates.append([ref.field])
+    if options.dialect == 'postgres':
+        for field_name, field_type in field_types.items():
+            # with junction tables, link_multiple columns are not in the table
+            if method([field_name]) and not (options.junction_tables and field_type.kind == REFERENCES):
+                candidates.append([field_name])
+    for columns in table_schema.indexes:
+        for column in columns:
+            if column not in table_schema.fields:
+                raise ValueError(f"Index of table `{table}` has the column `{column}` that is not in the table.")
+        candidates.append(list(columns))
+    indexes = []
+    for columns in candidates:
+        if all(columns != index for index, _ in indexes):
+            indexes.append((columns, method(columns)))
+    return indexes
+
+
+def index_to_pydal(dialect: str, table: str, columns: List[str], method: str = '') -> List[str]:
+    """Lines of `define_tables_of_db` creating one index, if it does not exist yet."""
+    name = index_name(table, columns)
+    if dialect == 'mysql':
+        # mysql has no CREATE INDEX IF NOT EXISTS
+        column_list = ', '.join(f'`{column}`' for column in columns)
+        return [tab1 + f"""if not db.executesql("SELECT 1 FROM information_schema.statistics WHERE table_schema = """
+                       f"""DATABASE() AND table_name = '{table}' AND index_name = '{name}'"):""",
+                tab1 * 2 + f"db.executesql('CREATE INDEX `{name}` ON `{table}` ({column_list});')"]
+    column_list = ', '.join(f'"{column}"' for column in columns)
+    using = f" USING {method.upper()}" if method else ""
+    return [tab1 + f"""db.executesql('CREATE INDEX IF NOT EXISTS "{name}" ON "{table}"{using} ({column_list});')"""]
+
+
+def indexes_to_pydal(ordered_schema: Schema, options: PydalOptions = DEFAULT_OPTIONS,
+                     field_types: Optional[Dict[str, Dict[str, FieldType]]] = None) -> List[str]:
+    """Lines creating the indexes of all the tables, after the tables are defined.
+    They are only created if they do not exist, so it is safe to run them every time the database is opened.
+
+    Parameters
+    ----------
+    ordered_schema
         Database schema in openapi format
+    options
+        The indexes depend on `dialect`, `reference_indexes` and `junction_tables`, see `table_indexes`.
+        The linked rows column of each junction table is indexed too, except in mysql where its foreign key
+        is. The other column starts the primary key, which is already an index of it.
+    field_types
+        The column types of the schema from `y2s_types.classify_schema`, worked out here if not given
+
+    Returns
+    -------
+    list of lines, empty if there are no indexes
+    """
+    lines = []
+    for table, table_schema in ordered_schema.tables.items():
+        table_types = field_types[table] if field_types is not None else None
+        for columns, method in table_indexes(table, table_schema, options, table_types):
+            lines.extend(index_to_pydal(options.dialect, table, columns, method))
+    if options.junction_tables and options.dialect != 'mysql':
+        for ref in junctions(ordered_schema):
+            name, owner, item = junction(ref)
+            lines.extend(index_to_pydal(options.dialect, name, [item]))
+    if lines:
+        lines.append(tab1 + "db.commit()")
+    return lines
+
+
+def connection_setup(options: PydalOptions) -> Tuple[str, str, str]:
+    """Parts of the generated module that connect to the database: the extra imports,
+    the arguments of `DAL(..)` and the definitions they need (the sqlite pragmas), each a piece of code."""
+    if options.dialect in DAL_URIS:
+        imports = "import os\n"
+        dal_args = f"os.environ.get('DATABASE_URI', '{DAL_URIS[options.dialect]}'), folder=abs_path"
+    else:
+        imports = ""
+        dal_args = "'sqlite://storage.sqlite', folder=abs_path"
+    if options.pool_size:
+        dal_args += f", pool_size={options.pool_size}"
+    if options.lazy_tables:
+        dal_args += ", lazy_tables=True"
+    if options.migrate == 'off':
+        dal_args += ", migrate=False"
+    elif options.migrate == 'fake':
+        dal_args += ", fake_migrate=True"
+    pragmas = ""
+    if options.sqlite_pragmas:
+        dal_args += ", after_connection=apply_sqlite_pragmas"
+        pragmas = f"""SQLITE_PRAGMAS = {SQLITE_PRAGMAS!r}
+
+
+def apply_sqlite_pragmas(adapter):
+    \"\"\"Runs on every new connection, the pragmas only last as long as the connection.\"\"\"
+    for pragma in SQLITE_PRAGMAS:
+        adapter.execute(pragma)
+
+"""
+    return imports, dal_args, pragmas
+
+
+def openapi_to_pydal(ordered_schema: Schema,
+                     render_table: Optional[Callable[[str, Table], List[str]]] = None,
+                     options: PydalOptions = DEFAULT_OPTIONS,
+                    field_types: Optional[Dict[str, Dict[str, FieldType]]] = None) -> List[str]:
+    """Converts open api yaml describing the database into a pydal definition string such as:
+        db.define_table("my_table",Field("my_column","")
+
+    Parameters
+    ----------
+    ordered_schema
+        Database schema in openapi format, tables in the order they are to be defined
+    render_table
+        Function giving the lines of one table, `table_to_pydal` by default (or a cached version of it).
+    options
+        Dialect, indexes and junction tables, see `PydalOptions`. `render_table` must use the same options.
+    field_types
+        The column types of the schema from `y2s_types.classify_schema`, for the indexes
 
     Returns
     -------
     list of lines
         pydal definition string of the database schema
     """
-    tab1 = "    "
-
-    openapi_dict = ordered_openapi_yaml['components']
+    if render_table is None:
+        render_table = partial(table_to_pydal, options=options)
+    refs = junctions(ordered_schema) if options.junction_tables else []
+    imports, dal_args, pragmas = connection_setup(options)
     # _#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#
     # a list of strings for each line in the file
     file_lines = [
-        """
-import pathlib
+        f"""
+{imports}import pathlib
 
 from pydal import DAL, Field
 
@@ -36,44 +396,168 @@ abs_path = pathlib.Path(__file__).parent / 'database'
 if abs_path.exists() is False:
     abs_path.mkdir()
 
-def define_tables_of_db():
+{pragmas}def define_tables_of_db():
     global db
     global abs_path
     if db is None:
-        db = DAL('sqlite://storage.sqlite', folder=abs_path)
+        db = DAL({dal_args})
     # in following definitions, delete 'ondelete=..' parameter and CASCADE will be ON.
 """
     ]
 
-    for table in openapi_dict['schemas']:
-        # _#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#
-        # create the table in pyDal
-        table_def_lines = [tab1 + f"if '{table}' not in db.tables:",
-                           tab1 * 2 + f"db.define_table('{table}'"]
-        # add fields
-        table_dict = openapi_dict['schemas'][table]['properties']
-        for field_name in table_dict:
-            # dict of this table description
-            db_field = table_dict[field_name]
-            # add field to the table string? Let's find out what type
-            type_of, reference = extract_type_of_field(db_field)
-            # _#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#_#
-            # line of the Column aka Field definition
-            if "reference" in type_of:
-                ondelete = ", ondelete='NO ACTION'"
-            else:
-                ondelete = ""
-            # if the field is a file, may need an extra entry for filename
-            if type_of=='blob':
-                table_def_lines.append(
-                    tab1 * 3 + f", Field('{field_name}_name', type='upload', uploadfield='{field_name}')")
-            table_def_lines.append(
-                tab1 * 3 + f", Field('{field_name}', type='{type_of}', default=None{ondelete})")
-        # last parenthesis of table definition
-        table_def_lines.append(tab1 * 2 + ')')
-        file_lines.extend(table_def_lines)
+    for table, table_schema in ordered_schema.tables.items():
+        file_lines.extend(render_table(table, table_schema))
+    for ref in refs:
+        file_lines.extend(junction_to_pydal(ref))
+    index_lines = indexes_to_pydal(ordered_schema, options, field_types)
+    if not options.separate_indexes():
+        file_lines.extend(index_lines)
     file_lines.append(tab1 + "return\n")
-    file_lines.append("""if __name__ == '__main__':
-    define_tables_of_db()
-""")
+    for ref in refs:
+        file_lines.extend(junction_helpers(ref))
+    main_lines = tab1 + "define_tables_of_db()\n"
+    if options.separate_indexes() and index_lines:
+        file_lines.append("""
+def create_indexes():
+    \"\"\"Creates the indexes missing from the database, after `define_tables_of_db` (run this file).\"\"\"""")
+        if options.lazy_tables:
+            file_lines.extend([tab1 + "for table in db.tables:",
+                               tab1 * 2 + "db[table]  # defines the lazy tables"])
+        file_lines.extend(index_lines)
+        file_lines.append("")
+        main_lines += tab1 + "create_indexes()\n"
+    file_lines.append("if __name__ == '__main__':\n" + main_lines)
     return file_lines
+
+
+def table_module(definition: List[str], index_lines: List[str]) -> str:
+    """Text of the module of one table in the package of `openapi_to_pydal_package`."""
+    lines = ["from pydal import Field", "", "", "def define(db):"]
+    lines.extend(definition)
+    lines.extend(["", "", "def create_indexes(db):"])
+    lines.extend(index_lines if index_lines else [tab1 + "return"])
+    return '\n'.join(lines) + '\n'
+
+
+def openapi_to_pydal_package(ordered_schema: Schema,
+                             render_table: Optional[Callable[[str, Table], List[str]]] = None,
+                             options: PydalOptions = DEFAULT_OPTIONS,
+                            field_types: Optional[Dict[str, Dict[str, FieldType]]] = None) -> Dict[str, str]:
+    """Same as `openapi_to_pydal`, but as a package with one module per table (`table_<name>.py`).
+    The `__init__.py` defines a table, after the tables it references, the first time it is used::
+
+        import pydal_def
+        pydal_def.contact  # imports and defines users, email, phone and contact, not the other tables
+
+    `define_tables_of_db()` still defines all of them, in the order of `ordered_schema`.
+
+    Parameters
+    ----------
+    ordered_schema
+        Database schema in openapi format, tables in the order they are to be defined
+    render_table
+        Function giving the lines of one table, `table_to_pydal` by default (or a cached version of it).
+    options
+        See `PydalOptions`. `render_table` must use the same options.
+    field_types
+        The column types of the schema from `y2s_types.classify_schema`, for the indexes
+
+    Returns
+    -------
+        The text of each file of the package, by file name
+    """
+    if render_table is None:
+        render_table = partial(table_to_pydal, options=options)
+    refs = junctions(ordered_schema) if options.junction_tables else []
+    files = {}
+    depends: Dict[str, List[str]] = {}
+    for table, table_schema in ordered_schema.tables.items():
+        depends[table] = []
+        for ref in table_schema.references():
+            # with junction tables, the link_multiple columns are not in the table
+            if ref.target != table and ref.target not in depends[table] and not (
+                    ref.multiple and options.junction_tables):
+                depends[table].append(ref.target)
+        index_lines = []
+        table_types = field_types[table] if field_types is not None else None
+        for columns, method in table_indexes(table, table_schema, options, table_types):
+            index_lines.extend(index_to_pydal(options.dialect, table, columns, method))
+        files[f"table_{table}.py"] = table_module(render_table(table, table_schema), index_lines)
+    for ref in refs:
+        name, owner, item = junction(ref)
+        depends[name] = list(dict.fromkeys([ref.table, ref.target]))
+        files[f"table_{name}.py"] = table_module(junction_to_pydal(ref),
+                                                 index_to_pydal(options.dialect, name, [item]))
+    imports, dal_args, pragmas = connection_setup(options)
+    tables = ''.join(f"    {name!r}: {tuple(targets)!r},\n" for name, targets in depends.items())
+    init = f'''"""pyDAL definition of the database, one module per table.
+A table is defined, after the tables it references, the first time it is used::
+
+    import pydal_def
+    pydal_def.my_table  # the pyDAL table, same as pydal_def.db.my_table once defined
+"""
+{imports}import importlib
+import pathlib
+
+from pydal import DAL
+
+db = None
+logged_in_user = None
+abs_path = pathlib.Path(__file__).parent.parent / 'database'
+if abs_path.exists() is False:
+    abs_path.mkdir()
+
+# the tables in the order they can be defined, each with the tables it references
+TABLES = {{
+{tables}}}
+
+
+{pragmas}def connect():
+    global db
+    if db is None:
+        db = DAL({dal_args})
+    return db
+
+
+def define_table(name):
+    """Defines the table `name`, and before it the tables it references, unless already done. Returns the table."""
+    connect()
+    if name not in db.tables:
+        for target in TABLES[name]:
+            define_table(target)
+        module = importlib.import_module(f"{{__name__}}.table_{{name}}")
+        module.define(db)
+'''
+    if not options.separate_indexes():
+        init += f'''        module.create_indexes(db)
+        db.commit()
+'''
+    init += f'''    return db[name]
+
+
+def define_tables_of_db():
+    """Defines all the tables."""
+    for name in TABLES:
+        define_table(name)
+    return
+
+
+def create_indexes():
+    """Creates the indexes missing from the database (run `python -m pydal_def`)."""
+    define_tables_of_db()
+    for name in TABLES:
+        importlib.import_module(f"{{__name__}}.table_{{name}}").create_indexes(db)
+    db.commit()
+
+
+def __getattr__(name):
+    if name in TABLES:
+        return define_table(name)
+    raise AttributeError(f"module {{__name__!r}} has no attribute {{name!r}}")
+'''
+    for ref in refs:
+        init += '\n' + ''.join(junction_helpers(ref, link=f"define_table('{junction(ref)[0]}')"))
+    files["__init__.py"] = init
+    files["__main__.py"] = "from . import define_tables_of_db, create_indexes\n\ndefine_tables_of_db()\n" \
+                           "create_indexes()\n"
+    return files
@@ -0,0 +1,240 @@
+"""SQL script creating the tables and indexes of the schema directly, without pyDAL and its migrations.
+
+The tables, columns and column types are the ones pyDAL creates, so a database built with the script can be
+opened by `pydal_def.py` generated with the same options and `--migrate off`.
+"""
+from functools import partial
+from typing import List, Callable, Optional, Dict, Tuple
+
+from y2s_ir import Schema, Table, Reference
+from y2s_to_pydal import (PydalOptions, DEFAULT_OPTIONS, pydal_type, junction, junctions, table_indexes,
+                          index_name, tab1)
+from y2s_types import TYPES, FieldType, REFERENCES, classify_table
+
+# column types of pyDAL (with the adapter of `y2s_to_pydal.DAL_URIS` for postgres), by dialect and pyDAL type
+SQL_TYPES: Dict[str, Dict[str, str]] = {
+    'sqlite': {'id': "INTEGER PRIMARY KEY AUTOINCREMENT",
+               'string': "CHAR(512)",
+               'text': "TEXT",
+               'boolean': "CHAR(1)",
+               'integer': "INTEGER",
+               'bigint': "INTEGER",
+               'double': "DOUBLE",
+               'date': "DATE",
+               'datetime': "TIMESTAMP",
+               'json': "TEXT",
+               'blob': "BLOB",
+               'upload': "CHAR(512)",
+               'reference': "INTEGER",
+               'list:integer': "TEXT",
+               'list:string': "TEXT",
+               'list:reference': "TEXT"},
+    'postgres': {'id': "SERIAL PRIMARY KEY",
+                 'string': "VARCHAR(512)",
+                 'text': "TEXT",
+                 'boolean': "BOOLEAN",
+                 'integer': "INTEGER",
+                 'bigint': "BIGINT",
+                 'double': "FLOAT8",
+                 'date': "DATE",
+                 'datetime': "TIMESTAMP",
+                 'json': "JSON",
+                 'jsonb': "JSONB",
+                 'blob': "BYTEA",
+                 'upload': "VARCHAR(512)",
+                 'reference': "INTEGER",
+                 'list:integer': "BIGINT[]",
+                 'list:string': "TEXT[]",
+                 'list:reference': "BIGINT[]"},
+    'mysql': {'id': "INT AUTO_INCREMENT NOT NULL",
+              'string': "VARCHAR(512)",
+              'text': "LONGTEXT",
+              'boolean': "CHAR(1)",
+              'integer': "INTEGER",
+              'bigint': "BIGINT",
+              'double': "DOUBLE",
+              'date': "DATE",
+              'datetime': "DATETIME",
+              'json': "LONGTEXT",
+              'blob': "LONGBLOB",
+              'upload': "VARCHAR(512)",
+              'reference': "INT",
+              'list:integer': "LONGTEXT",
+              'list:string': "LONGTEXT",
+              'list:reference': "LONGTEXT"},
+}
+# added to each CREATE TABLE of mysql
+MYSQL_TABLE_OPTIONS = " ENGINE=InnoDB CHARACTER SET utf8mb4"
+
+
+def quote(dialect: str, name: str) -> str:
+    """Table or column name quoted as pyDAL does (`entity_quoting`)."""
+    return f"`{name}`" if dialect == 'mysql' else f'"{name}"'
+
+
+def foreign_key_sql(dialect: str, target: str) -> str:
+    """The REFERENCES clause of a reference to the table `target`."""
+    return f"REFERENCES {quote(dialect, target)} ({quote(dialect, 'id')}) ON DELETE NO ACTION"
+
+
+def sql_type(dialect: str, name: str, type_of: str) -> str:
+    """SQL type of the column `name` of pyDAL type `type_of`, such as `INTEGER` for a reference."""
+    if type_of.startswith("reference "):
+        type_of = "reference"
+    elif type_of.startswith("list:reference"):
+        type_of = "list:reference"
+    column_type = SQL_TYPES[dialect].get(type_of) or TYPES.sql_types.get(dialect, {}).get(type_of)
+    if column_type is None:
+        raise ValueError(f"No {dialect} type for the column `{name}` of type `{type_of}`, "
+                         f"see `y2s_types.register_format`.")
+    return column_type
+
+
+def column_to_sql(dialect: str, name: str, type_of: str) -> str:
+    """Definition of one column of pyDAL type `type_of`, such as `"created_by" INTEGER REFERENCES "users" ("id")`.
+    mysql ignores REFERENCES in a column, its foreign keys are constraints of the table (see `foreign_keys_sql`)."""
+    column = f"{quote(dialect, name)} {sql_type(dialect, name, type_of)}"
+    if type_of.startswith("reference ") and dialect != 'mysql':
+        return column + " " + foreign_key_sql(dialect, type_of[len("reference "):])
+    return column
+
+
+def foreign_keys_sql(dialect: str, columns: List[Tuple[str, str]]) -> List[str]:
+    """FOREIGN KEY constraints of the (column name, pyDAL type) `columns` that are references, mysql only."""
+    if dialect != 'mysql':
+        return []
+    return [f"FOREIGN KEY ({quote(dialect, name)}) {foreign_key_sql(dialect, type_of[len('reference '):])}"
+            for name, type_of in columns if type_of.startswith("reference ")]
+
+
+def create_table_sql(dialect: str, table: str, columns: List[str], constraints: List[str]) -> List[str]:
+    """Lines of one CREATE TABLE statement."""
+    lines = [f"CREATE TABLE IF NOT EXISTS {quote(dialect, table)} ("]
+    body = columns + constraints
+    lines.extend(tab1 + line + ("," if ix < len(body) - 1 else "") for ix, line in enumerate(body))
+    lines.append(")" + (MYSQL_TABLE_OPTIONS if dialect == 'mysql' else "") + ";")
+    return lines
+
+
+def create_index_sql(dialect: str, table: str, columns: List[str], method: str = '') -> str:
+    """CREATE INDEX statement of sqlite or postgres. mysql has no `IF NOT EXISTS` for indexes,
+    its indexes are in the CREATE TABLE instead (see `table_to_sql`)."""
+    column_list = ', '.join(quote(dialect, column) for column in columns)
+    using = f" USING {method.upper()}" if method else ""
+    return f"CREATE INDEX IF NOT EXISTS {quote(dialect, index_name(table, columns))} ON {quote(dialect, table)}" \
+           f"{using} ({column_list});"
+
+
+def table_columns(field_types: Dict[str, FieldType], options: PydalOptions = DEFAULT_OPTIONS) -> List[Tuple[str, str]]:
+    """(column name, pyDAL type) of the columns of a table in the database, without `id`:
+    with the upload column pyDAL adds for the file name of a blob, without the `link_multiple` columns that are
+    junction tables."""
+    column_types = []
+    for field_name, field_type in field_types.items():
+        if options.junction_tables and field_type.kind == REFERENCES:
+            continue
+        type_of = pydal_type(field_type.type_of, options.dialect)
+        # the upload field pyDAL adds for the file name, see `table_to_pydal`
+        if type_of == 'blob':
+            column_types.append((field_name + "_name", 'upload'))
+        column_types.append((field_name, type_of))
+    return column_types
+
+
+def table_body_sql(dialect: str, column_types: List[Tuple[str, str]]) -> Tuple[List[str], List[str]]:
+    """Column definitions and constraints of a CREATE TABLE with `id` and the `table_columns`."""
+    columns = [f"{quote(dialect, 'id')} {SQL_TYPES[dialect]['id']}"]
+    columns.extend(column_to_sql(dialect, name, type_of) for name, type_of in column_types)
+    constraints = []
+    if dialect == 'mysql':
+        constraints.append(f"PRIMARY KEY ({quote(dialect, 'id')})")
+    constraints.extend(foreign_keys_sql(dialect, column_types))
+    return columns, constraints
+
+
+def table_to_sql(table: str, table_schema: Table, options: PydalOptions = DEFAULT_OPTIONS,
+                 field_types: Optional[Dict[str, FieldType]] = None) -> List[str]:
+    """Lines of the SQL creating one table and its indexes, with the columns of `y2s_to_pydal.table_to_pydal`.
+
+    Parameters
+    ----------
+    table
+        table name
+    table_schema
+        the table in openapi format
+    options
+        Dialect, indexes and junction tables, the same as for `pydal_def.py`
+    field_types
+        The column types of the table from `y2s_types.classify_schema`, worked out here if not given
+
+    Returns
+    -------
+    list of lines
+    """
+    if field_types is None:
+        field_types = classify_table(table_schema)
+    dialect = options.dialect
+    columns, constraints = table_body_sql(dialect, table_columns(field_types, options))
+    indexes = table_indexes(table, table_schema, options, field_types)
+    if dialect == 'mysql':
+        for index_columns, method in indexes:
+            column_list = ', '.join(quote(dialect, column) for column in index_columns)
+            constraints.append(f"INDEX {quote(dialect, index_name(table, index_columns))} ({column_list})")
+        return create_table_sql(dialect, table, columns, constraints)
+    return create_table_sql(dialect, table, columns, constraints) + \
+        [create_index_sql(dialect, table, index_columns, method) for index_columns, method in indexes]
+
+
+def junction_to_sql(dialect: str, ref: Reference) -> List[str]:
+    """Lines creating the junction table of a `link_multiple` column (see `y2s_to_pydal.junction`),
+    with its two references as primary key and an index on the linked rows (in mysql, the one InnoDB creates
+    for its foreign key)."""
+    name, owner, item = junction(ref)
+    column_types = [(owner, f"reference {ref.table}"), (item, f"reference {ref.target}")]
+    columns = [column_to_sql(dialect, column, type_of) + " NOT NULL" for column, type_of in column_types]
+    constraints = [f"PRIMARY KEY ({quote(dialect, owner)}, {quote(dialect, item)})"]
+    constraints.extend(foreign_keys_sql(dialect, column_types))
+    if dialect == 'mysql':
+        return create_table_sql(dialect, name, columns, constraints)
+    return create_table_sql(dialect, name, columns, constraints) + [create_index_sql(dialect, name, [item])]
+
+
+def schema_to_sql(ordered_schema: Schema, render_table: Optional[Callable[[str, Table], List[str]]] = None,
+                  options: PydalOptions = DEFAULT_OPTIONS) -> List[str]:
+    """Converts the schema into one SQL script creating all the tables, in order, and their indexes.
+    In sqlite and postgres the script is a single transaction. mysql commits each CREATE TABLE on its own.
+
+    Parameters
+    ----------
+    ordered_schema
+        Database schema in openapi format, tables in the order they are to be defined (see `reorder_tables`),
+        so each foreign key points to a table already created.
+    render_table
+        Function giving the lines of one table, `table_to_sql` by default (or a cached version of it).
+    options
+        Dialect, indexes and junction tables, the same as for `pydal_def.py`. `render_table` must use the same.
+
+    Returns
+    -------
+    list of lines
+
+    Raises
+    ------
+    ValueError
+        With `junction_tables`, if two junction tables, or a junction table and a table, have the same name
+        (see `y2s_to_pydal.junctions`)
+    """
+    if render_table is None:
+        render_table = partial(table_to_sql, options=options)
+    dialect = options.dialect
+    lines = [f"-- {dialect} schema, the tables of pydal_def.py (open it with migrate=False)"]
+    if dialect != 'mysql':
+        lines.append("BEGIN;")
+    for table, table_schema in ordered_schema.tables.items():
+        lines.extend(render_table(table, table_schema))
+    if options.junction_tables:
+        for ref in junctions(ordered_schema):
+            lines.extend(junction_to_sql(dialect, ref))
+    if dialect != 'mysql':
+        lines.append("COMMIT;")
+    return lines
@@ -0,0 +1,171 @@
+"""The type of every column, worked out once per schema and shared by the stages that need it
+(reordering, pyDAL, SQL and class emission).
+
+The pyDAL type of a property comes from its openapi `type` and `format`. Formats other than the ones of
+`y2s_constants.OPENAPI_FORMATS` can be registered, with the python and SQL types that go with them,
+so a custom type needs no code change::
+
+    from y2s_types import register_format
+
+    register_format('uuid', 'string')  # format: uuid is stored in a string column
+    register_format('decimal', 'decimal(10,2)', openapi_type='number', python_type='decimal.Decimal',
+                    sql_types={'sqlite': "NUMERIC(10,2)", 'postgres': "NUMERIC(10,2)", 'mysql': "DECIMAL(10,2)"})
+"""
+import hashlib
+from typing import Dict, Optional, Tuple
+
+from y2s_constants import OPENAPI_TYPES, OPENAPI_FORMATS
+from y2s_ir import Schema, Table, Field
+
+# kinds of column
+VALUE = 'value'
+REFERENCE = 'reference'  # link_single
+REFERENCES = 'references'  # link_multiple
+
+# openapi format : pyDAL type, the inverse of OPENAPI_FORMATS (the first anvil type of a format wins)
+FORMAT_TYPES: Dict[str, str] = {}
+for _anvil_type, _format in OPENAPI_FORMATS.items():
+    FORMAT_TYPES.setdefault(_format, 'blob' if _anvil_type == 'media' else _anvil_type)
+# array items : pyDAL type
+LIST_TYPES = {'integer': "list:integer", 'string': "list:string"}
+
+
+class FieldType:
+    """The classification of one column.
+
+    Attributes
+    ----------
+    table, field
+        Table and column names
+    type_of
+        pyDAL type, before the changes of a dialect (see `y2s_to_pydal.pydal_type`),
+        for example `datetime`, `reference users` or `list:reference email`
+    reference
+        Name of the referenced table, None if the column is not a reference
+    kind
+        `VALUE`, `REFERENCE` or `REFERENCES`
+    """
+    __slots__ = ('table', 'field', 'type_of', 'reference', 'kind')
+
+    def __init__(self, table: str, field: str, type_of: str, reference: Optional[str] = None):
+        self.table = table
+        self.field = field
+        self.type_of = type_of
+        self.reference = reference
+        if reference is None:
+            self.kind = VALUE
+        else:
+            self.kind = REFERENCES if type_of.startswith("list:") else REFERENCE
+
+    def __repr__(self):
+        return f"FieldType({self.table}.{self.field}: {self.type_of})"
+
+
+class TypeRegistry:
+    """The formats that can be used on top of the openapi ones, with the types they map to."""
+
+    def __init__(self):
+        # (openapi type, format) : pyDAL type
+        self.formats: Dict[Tuple[str, str], str] = {}
+        # pyDAL type : python annotation, for `y2s_to_classes`
+        self.python_types: Dict[str, str] = {}
+        # dialect : {pyDAL type : SQL column type}, for `y2s_to_sql`
+        self.sql_types: Dict[str, Dict[str, str]] = {}
+        self._known_formats = tuple(OPENAPI_FORMATS.values())
+
+    def register_format(self, format: str, type_of: str, openapi_type: str = 'string',
+                        python_type: Optional[str] = None, sql_types: Optional[Dict[str, str]] = None):
+        """Properties of `openapi_type` with `format` become columns of pyDAL type `type_of`.
+
+        Parameters
+        ----------
+        format
+            openapi `format`
+        type_of
+            pyDAL type, for example `string` or `decimal(10,2)`
+        openapi_type
+            openapi `type` the format is used with
+        python_type
+            Annotation in `db_classes.py`, needed if `type_of` is not a type `y2s_to_classes` knows
+        sql_types
+            SQL column type by dialect in `schema.sql`, needed if `type_of` is not a type `y2s_to_sql` knows
+        """
+        if openapi_type not in OPENAPI_TYPES.values():
+            raise ValueError(f"Unknown openapi type `{openapi_type}`.")
+        self.formats[(openapi_type, format)] = type_of
+        if format not in self._known_formats:
+            self._known_formats += (format,)
+        if python_type is not None:
+            self.python_types[type_of] = python_type
+        for dialect, sql_type in (sql_types or {}).items():
+            self.sql_types.setdefault(dialect, {})[type_of] = sql_type
+
+    def known_formats(self) -> Tuple[str, ...]:
+        """Every format a property may have: the openapi ones and the registered ones."""
+        return self._known_formats
+
+    def key(self) -> str:
+        """Changes with the registered formats, '' when there are none. Part of the cache keys of the outputs."""
+        if not self.formats and not self.python_types and not self.sql_types:
+            return ''
+        return hashlib.sha256(repr((sorted(self.formats.items()), sorted(self.python_types.items()),
+                                    sorted((dialect, sorted(types.items()))
+                                           for dialect, types in self.sql_types.items())))
+                              .encode('utf-8')).hexdigest()
+
+    def type_of_string(self, field: Field) -> str:
+        """pyDAL type of a property that is not an array, object or reference, from its `format` or `type`."""
+        if field.format is None:
+            return field.type
+        registered = self.formats.get((field.type, field.format))
+        if registered is not None:
+            return registered
+        return FORMAT_TYPES.get(field.format)
+
+    def classify(self, field: Field) -> Tuple[str, Optional[str]]:
+        """pyDAL type of the property and the table it references (or None), see `extract_type_of_field`."""
+        if field.type is None:
+            # must be a reference to another table
+            if field.ref is not None:
+                return f"reference {field.ref}", field.ref
+            return '', None
+        if field.format is not None and (field.type, field.format) in self.formats:
+            return self.formats[(field.type, field.format)], None
+        if field.type == 'array':
+            items = field.items
+            if items.ref is not None:
+                return f"list:reference {items.ref}", items.ref
+            if items.type is not None:
+                return LIST_TYPES.get(items.type, "INVALID"), None
+            return self.type_of_string(items), None
+        if field.type == 'object':
+            return "json", None
+        if field.type == 'number':
+            if field.format is not None and field.format != 'float':
+                raise TypeError("'number' type with incorrect format field. Fix anvil_refined.yaml and rerun. Thanks!")
+            return 'double', None
+        return self.type_of_string(field), None
+
+
+# the registry used by default
+TYPES = TypeRegistry()
+
+
+def register_format(format: str, type_of: str, openapi_type: str = 'string', python_type: Optional[str] = None,
+                    sql_types: Optional[Dict[str, str]] = None):
+    """`TypeRegistry.register_format` of the default registry."""
+    TYPES.register_format(format, type_of, openapi_type, python_type, sql_types)
+
+
+def classify_table(table: Table, registry: TypeRegistry = TYPES) -> Dict[str, FieldType]:
+    """The type of every column of the table, by column name, in the order of the columns."""
+    types = {}
+    for field_name, field in table.fields.items():
+        type_of, reference = registry.classify(field)
+        types[field_name] = FieldType(table.name, field_name, type_of, reference)
+    return types
+
+
+def classify_schema(schema: Schema, registry: TypeRegistry = TYPES) -> Dict[str, Dict[str, FieldType]]:
+    """The type of every column of every table, by table name then column name, in one pass over the schema."""
+    return {table_name: classify_table(table, registry) for table_name, table in schema.tables.items()}
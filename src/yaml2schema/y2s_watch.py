@@ -0,0 +1,174 @@
+"""Watch mode: stays resident and regenerates the outputs whenever the input yaml files change.
+
+Everything is imported once, the input files are polled, bursts of writes are debounced, and each
+regeneration only redoes what the change touched:
+    - the yaml of a table is only parsed again if its text changed (`TableParseMemo`),
+    - openapi and pyDAL fragments of unchanged tables and unchanged models come from the cache (`y2s_cache`).
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from y2s_emit import warm_up_models
+from y2s_ir import Schema, schema_from_openapi
+from y2s_load import load_anvil, load_openapi
+from y2s_modify import update_field_type
+from y2s_pipeline import generate, class_models_available, NoTablesError
+from y2s_to_openapi import convert_anvil_to_openapi
+
+WATCHED_FILES = ("anvil.yaml", "anvil_refined.yaml", "openapi.yaml")
+
+
+def split_blocks(section: str, header_lines: int) -> Optional[Tuple[str, List[str]]]:
+    """Splits a yaml mapping into the text of each of its entries.
+
+    Parameters
+    ----------
+    section
+        For example the `db_schema` section of anvil.yaml
+    header_lines
+        Number of lines before the entries: 1 for `db_schema:`, 2 for `components:` `schemas:`
+
+    Returns
+    -------
+        The header text and the text of each entry, or None if the section is not in block style.
+    """
+    lines = section.split('\n')
+    header = '\n'.join(lines[:header_lines]) + '\n'
+    indent = None
+    blocks: List[List[str]] = []
+    for line in lines[header_lines:]:
+        stripped = line.lstrip()
+        if not stripped or stripped.startswith('#'):
+            if blocks:
+                blocks[-1].append(line)
+            continue
+        if indent is None:
+            indent = len(line) - len(stripped)
+            if indent == 0:
+                return None
+        if len(line) - len(stripped) == indent and not stripped.startswith('- '):
+            blocks.append([line])
+        elif not blocks or len(line) - len(stripped) < indent:
+            return None
+        else:
+            blocks[-1].append(line)
+    return header, ['\n'.join(block) + '\n' for block in blocks]
+
+
+class TableParseMemo:
+    """A `parse_schema` that remembers the parse of every table by the hash of its text,
+    so after an edit only the edited tables are parsed again.
+
+    Parameters
+    ----------
+    max_entries
+        Number of parsed tables kept. The least recently used are forgotten first.
+    """
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self.memo: 'OrderedDict[str, Dict]' = OrderedDict()
+        self.parsed = 0
+
+    def _parse_blocks(self, kind: str, section: str, loader: str) -> Dict:
+        header_lines = 1 if kind == 'anvil' else 2
+        split = split_blocks(section, header_lines)
+        if split is None:
+            return self._load(kind, section, loader)
+        header, blocks = split
+        tables = {}
+        for block in blocks:
+            key = hashlib.sha256(f"{kind}\0{loader}\0{block}".encode('utf-8')).hexdigest()
+            data = self.memo.get(key)
+            if data is None:
+                data = self._load(kind, header + block, loader)
+                self.memo[key] = data
+                self.parsed += 1
+                if len(self.memo) > self.max_entries:
+                    self.memo.popitem(last=False)
+            else:
+                self.memo.move_to_end(key)
+            tables.update(data)
+        return tables
+
+    @staticmethod
+    def _load(kind: str, text: str, loader: str) -> Dict:
+        if kind == 'anvil':
+            return load_anvil(text, loader)['db_schema'] or {}
+        return (load_openapi(text, loader)['components'] or {}).get('schemas', None) or {}
+
+    def __call__(self, source: str, db_str: str, refined_str: str, loader: str = 'strict') -> Schema:
+        if source == 'openapi':
+            return schema_from_openapi({'components': {'schemas': self._parse_blocks('openapi', db_str, loader)}})
+        schema = convert_anvil_to_openapi({'db_schema': self._parse_blocks('anvil', db_str, loader)})
+        if refined_str:
+            update_field_type(schema, schema_from_openapi(
+                {'components': {'schemas': self._parse_blocks('openapi', refined_str, loader)}}))
+        return schema
+
+
+def snapshot(input_dir: str) -> Dict[str, Tuple[int, int]]:
+    """(mtime, size) of each watched file that exists."""
+    state = {}
+    for name in WATCHED_FILES:
+        try:
+            stat = os.stat(os.path.join(input_dir, name))
+        except FileNotFoundError:
+            continue
+        state[name] = (stat.st_mtime_ns, stat.st_size)
+    return state
+
+
+def watch(input_dir: str, output_dir: str, interval: float = 0.2, debounce: float = 0.3, **options):
+    """Generates the outputs, then again after every change of the input files, until interrupted.
+
+    Parameters
+    ----------
+    input_dir
+        Directory of anvil.yaml, anvil_refined.yaml or openapi.yaml
+    output_dir
+        Directory of the generated files
+    interval
+        Seconds between two polls of the files
+    debounce
+        Seconds without further changes before regenerating, so a burst of writes gives one regeneration
+    options
+        Passed on to `y2s_pipeline.generate` (loader, use_cache, cache_size, emit)
+    """
+    if 'models' in options.get('emit', ('models',)) and class_models_available():
+        warm_up_models()
+    parse = TableParseMemo()
+
+    def regenerate():
+        start = time.perf_counter()
+        parsed = parse.parsed
+        try:
+            generate(input_dir, output_dir, parse=parse, **options)
+        except NoTablesError:
+            print("No database tables, nothing generated.")
+            return
+        except Exception as e:  # the file may be half written, keep watching
+            print(f"Failed: {type(e).__name__}: {e}")
+            return
+        print(f"Regenerated in {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"({parse.parsed - parsed} tables parsed).")
+
+    state = snapshot(input_dir)
+    regenerate()
+    print(f"Watching {', '.join(os.path.join(input_dir, name) for name in state)} (Ctrl-C to stop)")
+    changed_at = None
+    try:
+        while True:
+            time.sleep(interval)
+            new_state = snapshot(input_dir)
+            if new_state != state:
+                state = new_state
+                changed_at = time.monotonic()
+            elif changed_at is not None and time.monotonic() - changed_at >= debounce:
+                changed_at = None
+                regenerate()
+    except KeyboardInterrupt:
+        pass